@@ -17,21 +17,64 @@
 The documentation for this module has a custom layout in process_utils.rst.
 """
 
+from .async_execute_process import async_execute_pipeline
 from .async_execute_process import async_execute_process
+from .async_execute_process import async_wait_for_output
 from .async_execute_process import asyncio
 from .async_execute_process import AsyncSubprocessProtocol
+from .async_execute_process import DecodedSubprocessProtocol
 from .async_execute_process import get_loop
+from .async_execute_process import HeadTailProtocol
 
+from .execute_process_nopty import ReturnCode
+
+from .impl import execute_pipeline
 from .impl import execute_process
+from .impl import execute_process_head_tail
 from .impl import execute_process_split
+from .impl import execute_process_to_file
+from .impl import execute_processes
+from .impl import wait_for_output
 from .impl import which
 
+from .output_timeline import OutputTimeline
+
+from .pty_manager import get_pty_manager
+from .pty_manager import PtyManager
+
+from .rate_limit import RateLimiter
+
+from .readiness import NotReadyError
+from .readiness import OutputReady
+
+from .resource_sampler import ResourceSample
+
+from .run_result import RunResult
+
 __all__ = [
+    'async_execute_pipeline',
     'async_execute_process',
+    'async_wait_for_output',
     'asyncio',
     'AsyncSubprocessProtocol',
+    'DecodedSubprocessProtocol',
     'get_loop',
+    'get_pty_manager',
+    'execute_pipeline',
+    'HeadTailProtocol',
     'execute_process',
+    'execute_process_head_tail',
     'execute_process_split',
+    'execute_process_to_file',
+    'execute_processes',
+    'NotReadyError',
+    'OutputReady',
+    'OutputTimeline',
+    'PtyManager',
+    'RateLimiter',
+    'ResourceSample',
+    'ReturnCode',
+    'RunResult',
+    'wait_for_output',
     'which',
 ]
@@ -14,15 +14,28 @@
 
 from __future__ import print_function
 
+import codecs
 import sys
+import time
 
+from .async_execute_process_asyncio import async_execute_pipeline
 from .async_execute_process_asyncio import async_execute_process
+from .async_execute_process_asyncio import async_wait_for_output
 from .async_execute_process_asyncio import get_loop
 from .async_execute_process_asyncio import asyncio
+from .head_tail import HeadTailCapture
+from .line_assembler import LineAssembler
+from .line_normalizer import LineNormalizer
+from .resource_sampler import _ResourceSampler
+from .run_result import _RunStats
 
 __all__ = [
+    'async_execute_pipeline',
     'async_execute_process',
+    'async_wait_for_output',
     'AsyncSubprocessProtocol',
+    'DecodedSubprocessProtocol',
+    'HeadTailProtocol',
     'get_loop',
 ]
 
@@ -120,6 +133,92 @@ more details on the ``emulate_tty`` parameter.
     are not captured separately.
 """
 
+async_execute_pipeline.__doc__ = """
+Coroutine to execute a pipeline of commands, like ``cmd1 | cmd2 | cmd3``.
+
+This is the asynchronous equivalent of
+:py:func:`osrf_pycommon.process_utils.execute_pipeline`, and is used like
+:py:func:`async_execute_process`, except that it takes a list of commands.
+The ``stdout`` of each command is connected directly to the ``stdin`` of
+the next one with an OS pipe, so no shell is needed and the data passed
+between them never goes through Python.
+
+The protocol receives the output of the last command, and ``stderr`` of all
+of them, and its ``stdin`` attribute is the ``stdin`` of the first command.
+Its ``complete`` future is set when the last command exits, and an
+additional ``pipeline_complete`` future is set once all of the commands
+have exited, to a :py:class:`osrf_pycommon.process_utils.ReturnCode` whose
+``returncodes`` attribute is the list of return codes of each command.
+The transport returned is that of the last command, except that closing,
+killing or signaling it does so for all of the commands, and the
+transports of the other commands are closed once they have all exited:
+
+.. code-block:: python
+
+    async def run(cmds):
+        transport, protocol = await async_execute_pipeline(
+            AsyncSubprocessProtocol, cmds)
+        returncode = await protocol.pipeline_complete
+        return returncode.returncodes
+
+:param protocol_class: Protocol class which handles subprocess callbacks
+:type protocol_class: :py:class:`AsyncSubprocessProtocol` or a subclass
+:param list cmds: list of commands, each like the ``cmd`` parameter of
+    :py:func:`async_execute_process`
+:raises: ValueError if ``cmds`` is empty
+
+For all other parameters see :py:func:`async_execute_process`.
+"""
+
+async_wait_for_output.__doc__ = """
+Coroutine to execute a subprocess and wait until its output matches a pattern.
+
+This is the asynchronous equivalent of
+:py:func:`osrf_pycommon.process_utils.wait_for_output`, e.g. for starting a
+server in a test fixture and waiting until it is ready, rather than sleeping.
+The subprocess is started like with :py:func:`async_execute_process`, and its
+output, from either stream, is searched as it is received, with
+:py:func:`re.search` and :py:data:`re.MULTILINE`, for ``pattern``, which is a
+regular expression as :py:class:`bytes`, or as :py:class:`str` which is
+encoded as UTF-8.
+
+All of the output is passed on to the protocol as usual, also before the
+match, and once there is a match the output is no longer searched, so the
+protocol receives it directly, and the subprocess keeps running.
+The coroutine then returns a tuple of the transport, the protocol and an
+:py:class:`osrf_pycommon.process_utils.OutputReady` with the match and the
+``time_to_ready`` in seconds:
+
+.. code-block:: python
+
+    async def start_server():
+        transport, protocol, ready = await async_wait_for_output(
+            AsyncSubprocessProtocol, ['my_server'], b'Listening on port',
+            timeout=10)
+        print('ready after', ready.time_to_ready, 'seconds')
+        return transport, protocol
+
+If the output does not match within ``timeout`` seconds, the subprocess is
+closed, which kills it, and a
+:py:exc:`osrf_pycommon.process_utils.NotReadyError` is raised with a
+``reason`` of ``'timeout'``.
+If the subprocess exits before its output matches, its transport is closed
+and the error is raised with a ``reason`` of ``'exited'`` and its
+``returncode``.
+
+:param protocol_class: Protocol class which handles subprocess callbacks
+:type protocol_class: :py:class:`AsyncSubprocessProtocol` or a subclass
+:param list cmd: list of arguments where the executable is the first item
+:param pattern: regular expression to search the output for
+:param float timeout: seconds to wait for the output to match, defaults to
+    None which means there is no limit
+:raises: :py:exc:`osrf_pycommon.process_utils.NotReadyError` if the output
+    does not match in time or the subprocess exits before it does
+:raises: ValueError if ``timeout`` is negative
+
+For all other parameters see :py:func:`async_execute_process`.
+"""
+
 
 class AsyncSubprocessProtocol(asyncio.SubprocessProtocol):
     """
@@ -150,6 +249,60 @@ class AsyncSubprocessProtocol(asyncio.SubprocessProtocol):
     Additionally, the data received will not be stripped of new lines, so take
     that into consideration when printing the result.
 
+    By default data is passed on as soon as it is read, so it may contain
+    partial lines.
+    If ``line_buffered`` is True, then data is only passed on once it forms
+    complete lines, using the same
+    :py:class:`osrf_pycommon.process_utils.line_assembler.LineAssembler`
+    as :py:func:`osrf_pycommon.process_utils.execute_process`, and any
+    incomplete last line is passed on when the stream is closed.
+    Since the protocol is instantiated by :py:func:`async_execute_process`,
+    pass it through a factory, e.g.
+    ``functools.partial(AsyncSubprocessProtocol, line_buffered=True)``.
+    The memory used for incomplete lines can be bounded with the
+    ``max_line_bytes`` and ``overflow`` options, and records other than
+    lines can be passed on with the ``delimiter`` option, which are passed
+    to the
+    :py:class:`osrf_pycommon.process_utils.line_assembler.LineAssembler` and
+    have the same meaning as for
+    :py:func:`osrf_pycommon.process_utils.execute_process`.
+
+    When line buffered, progress redrawn with ``\\r`` can be collapsed with
+    ``collapse_cr``, and repeated lines folded with ``fold_repeats``, like
+    for :py:func:`osrf_pycommon.process_utils.execute_process`, using a
+    :py:class:`osrf_pycommon.process_utils.line_normalizer.LineNormalizer`
+    for each stream.
+
+    When line buffered, the rate of lines passed on can be limited with a
+    :py:class:`osrf_pycommon.process_utils.RateLimiter` given as
+    ``rate_limit``, so a subprocess which outputs more lines than can be
+    handled does not swamp the event loop, and lines above the rate are
+    suppressed and summarized as for
+    :py:func:`osrf_pycommon.process_utils.execute_process`.
+    A limiter can be shared by several protocols, to limit their combined
+    rate, and the total number of suppressed lines is counted in its
+    ``suppressed_lines`` attribute.
+
+    On Linux, if ``resource_interval`` is given, the resource use of the
+    process, or of all of the commands of a pipeline, and their descendants
+    is sampled from ``/proc`` every
+    ``resource_interval`` seconds, on the loop of :py:func:`get_loop`, while
+    it runs, and each
+    :py:class:`osrf_pycommon.process_utils.ResourceSample` is passed to the
+    ``on_resource_sample`` function, which can be overridden:
+
+    .. code-block:: python
+
+        class MyProtocol(AsyncSubprocessProtocol):
+            def on_resource_sample(self, sample):
+                if sample.swap:
+                    print('{0} is swapping'.format(sample.pid))
+
+    If an :py:class:`osrf_pycommon.process_utils.OutputTimeline` is given as
+    ``timeline``, then the time at which each piece of data was received,
+    and from which stream, is recorded in it before it is passed on, see
+    :py:func:`osrf_pycommon.process_utils.execute_process_split`.
+
     You can also override these less commonly used functions:
 
     .. code-block:: python
@@ -178,6 +331,13 @@ class AsyncSubprocessProtocol(asyncio.SubprocessProtocol):
     The ``stdout`` and ``stderr`` attributes also reference their PipeProto.
     The ``complete`` attribute is a :py:class:`asyncio.Future` which is set to
     complete when the process exits and its result is the return code.
+    The ``run_result`` attribute is a :py:class:`asyncio.Future` which is set
+    once the process has exited and its output has been closed, so all of it
+    was counted, to a :py:class:`osrf_pycommon.process_utils.RunResult` with
+    the process' timings and output counts, see
+    :py:func:`osrf_pycommon.process_utils.execute_process`.
+    As the process is reaped by the child watcher of :py:mod:`asyncio`, its
+    CPU times and ``max_rss`` are not known, and are None.
 
     The ``complete`` attribute can be used like this:
 
@@ -200,11 +360,55 @@ class AsyncSubprocessProtocol(asyncio.SubprocessProtocol):
         get_loop().close()
 
     """
-    def __init__(self, stdin=None, stdout=None, stderr=None):
+    def __init__(
+        self, stdin=None, stdout=None, stderr=None, line_buffered=False,
+        max_line_bytes=None, overflow='split', timeline=None, rate_limit=None,
+        collapse_cr=False, fold_repeats=False, delimiter=None,
+        resource_interval=None
+    ):
+        for name, value in [
+            ('rate_limit', rate_limit is not None),
+            ('collapse_cr', collapse_cr), ('fold_repeats', fold_repeats)
+        ]:
+            if value and not line_buffered:
+                raise ValueError(
+                    "{0} can only be used when line_buffered".format(name))
+            if value and delimiter is not None:
+                raise ValueError(
+                    "{0} can not be used with a delimiter".format(name))
+        if delimiter is not None and not line_buffered:
+            raise ValueError("delimiter can only be used when line_buffered")
+        if resource_interval is not None and resource_interval <= 0:
+            raise ValueError("resource_interval must be positive, got '{0}'"
+                             .format(resource_interval))
         self.stdin = stdin
         self.stdout = stdout
         self.stderr = stderr
         self.complete = asyncio.Future()
+        self.run_result = asyncio.Future()
+        self.timeline = timeline
+        self._stats = _RunStats()
+        # Streams whose output may still be received
+        self._open_streams = set()
+        self._resource_interval = resource_interval
+        # Process ids of the commands of a pipeline before the last one,
+        # which are sampled along with it, set by async_execute_pipeline
+        self._stage_pids = []
+        self._sampler = None
+        self._sample_handle = None
+        # Data which isn't a complete line yet is kept in these
+        self._assemblers = None
+        if line_buffered:
+            self._assemblers = {
+                1: LineAssembler(max_line_bytes, overflow, delimiter),
+                2: LineAssembler(max_line_bytes, overflow, delimiter)}
+        self._normalizers = None
+        if collapse_cr or fold_repeats:
+            self._normalizers = {
+                1: LineNormalizer(collapse_cr, fold_repeats),
+                2: LineNormalizer(collapse_cr, fold_repeats)}
+        # Suppressed lines are kept for each protocol and stream separately
+        self._rate_limit = rate_limit
         asyncio.SubprocessProtocol.__init__(self)
 
     def connection_made(self, transport):
@@ -215,13 +419,70 @@ class AsyncSubprocessProtocol(asyncio.SubprocessProtocol):
             self.stdout = self.transport.get_pipe_transport(1)
         if self.stderr is None:
             self.stderr = self.transport.get_pipe_transport(2)
+        if isinstance(self.stdout, int):
+            # When using pty's, stdout and stderr are their file descriptors
+            self._open_streams = {1} if self.stderr == self.stdout else {1, 2}
+        else:
+            self._open_streams = {
+                fd for fd in (1, 2)
+                if transport.get_pipe_transport(fd) is not None}
+        if self._resource_interval is not None:
+            self._sampler = _ResourceSampler(
+                self._stage_pids + [transport.get_pid()],
+                self._resource_interval)
+            self._sample_handle = get_loop().call_later(
+                self._resource_interval, self._sample_resources)
+
+    def _sample_resources(self):
+        sample = self._sampler.sample()
+        if sample is not None:
+            self.on_resource_sample(sample)
+        if not self.complete.done():
+            self._sample_handle = get_loop().call_later(
+                self._resource_interval, self._sample_resources)
 
     def pipe_data_received(self, fd, data):
-        # This function is only called when pty's are not being used
-        stdout = self.stdout
-        if not isinstance(stdout, int):
-            stdout = 1
-        if fd == stdout:
+        # The fd is 1 for stdout and 2 for stderr, also when using pty's
+        self._stats.count(fd, data)
+        if self._assemblers is not None:
+            data = self._assemblers[fd].feed(data)
+            if data and self._normalizers is not None:
+                data = self._normalizers[fd].feed(data)
+            if data and self._rate_limit is not None:
+                data = self._rate_limit.limit(data, (self, fd))
+            if not data:
+                return
+        self._dispatch_data(fd, data)
+
+    def pipe_connection_lost(self, fd, exc):
+        self._flush(fd)
+        self._open_streams.discard(fd)
+        self._check_run_result()
+
+    def _flush(self, fd):
+        # Deliver any incomplete last line once its stream is closed, before
+        # the run_result is set
+        if self._assemblers is not None and fd in self._assemblers:
+            data = self._assemblers[fd].flush()
+            if self._normalizers is not None:
+                data = self._normalizers[fd].feed(data) or b''
+                data += self._normalizers[fd].flush() or b''
+            if self._rate_limit is not None:
+                data = self._rate_limit.limit(data, (self, fd)) or b''
+                data += self._rate_limit.flush((self, fd)) or b''
+            if data:
+                self._dispatch_data(fd, data)
+
+    def _check_run_result(self):
+        if self.complete.done() and not self._open_streams and \
+                not self.run_result.done():
+            self.run_result.set_result(
+                self._stats.result(self.complete.result()))
+
+    def _dispatch_data(self, fd, data):
+        if self.timeline is not None:
+            self.timeline.record(fd, len(data))
+        if fd == 1:
             if hasattr(self, 'on_stdout_received'):
                 self.on_stdout_received(data)
         else:
@@ -239,13 +500,137 @@ class AsyncSubprocessProtocol(asyncio.SubprocessProtocol):
 
     def process_exited(self):
         retcode = self.transport.get_returncode()
+        self._stats.end = time.monotonic()
+        if self._sample_handle is not None:
+            self._sample_handle.cancel()
         self.complete.set_result(retcode)
         self.on_process_exited(retcode)
+        self._check_run_result()
 
     def on_process_exited(self, returncode):
         # print("Exited with", returncode)
         pass
 
+    def on_resource_sample(self, sample):
+        # print(sample.cpu_percent, sample.rss)
+        pass
+
+
+class DecodedSubprocessProtocol(AsyncSubprocessProtocol):
+    """
+    :py:class:`AsyncSubprocessProtocol` which passes on ``str`` rather than
+    ``bytes``.
+
+    Data is decoded, after any line buffering, with an incremental decoder
+    from :py:func:`codecs.getincrementaldecoder` per stream, so multibyte
+    characters which are split across reads are decoded correctly, and
+    ``on_stdout_received`` and ``on_stderr_received`` are called with
+    :py:class:`str`.
+    Any incomplete character left when a stream is closed is handled by the
+    ``errors`` handler.
+
+    Like the other options, ``encoding`` and ``errors`` can be given through
+    a factory, e.g.
+    ``functools.partial(MyProtocol, encoding='utf-8', line_buffered=True)``.
+
+    :param str encoding: encoding with which to decode the output, defaults
+        to ``'utf-8'``
+    :param str errors: error handler to use when decoding, e.g.
+        ``'replace'``, defaults to ``'strict'``
+    :raises: LookupError if ``encoding`` is unknown
+    """
+
+    def __init__(
+        self, stdin=None, stdout=None, stderr=None, encoding='utf-8',
+        errors='strict', **kwargs
+    ):
+        AsyncSubprocessProtocol.__init__(
+            self, stdin=stdin, stdout=stdout, stderr=stderr, **kwargs)
+        decoder = codecs.getincrementaldecoder(encoding)
+        self._decoders = {1: decoder(errors), 2: decoder(errors)}
+
+    def _flush(self, fd):
+        AsyncSubprocessProtocol._flush(self, fd)
+        if fd in self._decoders:
+            data = self._decoders[fd].decode(b'', True)
+            if data:
+                AsyncSubprocessProtocol._dispatch_data(self, fd, data)
+
+    def _dispatch_data(self, fd, data):
+        data = self._decoders[fd].decode(data)
+        if data:
+            AsyncSubprocessProtocol._dispatch_data(self, fd, data)
+
+    def _on_stdout_received(self, data):
+        print(data, end='')
+
+    def _on_stderr_received(self, data):
+        print(data, end='', file=sys.stderr)
+
+
+class HeadTailProtocol(AsyncSubprocessProtocol):
+    """
+    :py:class:`AsyncSubprocessProtocol` which keeps only the first and last
+    lines of output.
+
+    Output from ``stdout`` and ``stderr`` is line buffered and added, in the
+    order it is received, to the ``capture`` attribute, a
+    :py:class:`osrf_pycommon.process_utils.head_tail.HeadTailCapture`, so
+    the memory used does not grow with the length of the output.
+    See :py:func:`osrf_pycommon.process_utils.execute_process_head_tail`
+    for the synchronous equivalent.
+
+    The last line may only be received after the process has exited, so
+    rather than the ``complete`` future, await the ``captured`` future, which
+    is set to the return code once the process has exited and its output
+    has been closed:
+
+    .. code-block:: python
+
+        import functools
+
+        async def run(cmd):
+            transport, protocol = await async_execute_process(
+                functools.partial(HeadTailProtocol, head=5, tail=20), cmd)
+            returncode = await protocol.captured
+            return returncode, protocol.capture
+
+    :param int head: number of lines to keep from the start of the output,
+        defaults to 10
+    :param int tail: number of lines to keep from the end of the output,
+        defaults to 10
+    :raises: ValueError if ``head`` or ``tail`` are negative
+    """
+
+    def __init__(
+        self, stdin=None, stdout=None, stderr=None, head=10, tail=10,
+        **kwargs
+    ):
+        kwargs['line_buffered'] = True
+        AsyncSubprocessProtocol.__init__(
+            self, stdin=stdin, stdout=stdout, stderr=stderr, **kwargs)
+        self.capture = HeadTailCapture(head, tail)
+        self.captured = asyncio.Future()
+
+    def on_stdout_received(self, data):
+        self.capture.add(data)
+
+    def on_stderr_received(self, data):
+        self.capture.add(data)
+
+    def pipe_connection_lost(self, fd, exc):
+        AsyncSubprocessProtocol.pipe_connection_lost(self, fd, exc)
+        self._check_captured()
+
+    def process_exited(self):
+        AsyncSubprocessProtocol.process_exited(self)
+        self._check_captured()
+
+    def _check_captured(self):
+        if self.complete.done() and not self._open_streams and \
+                not self.captured.done():
+            self.captured.set_result(self.complete.result())
+
 
 get_loop.__doc__ = """\
 This function will return the proper event loop for the subprocess async calls.
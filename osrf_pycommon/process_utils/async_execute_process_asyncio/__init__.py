@@ -18,11 +18,15 @@ try:
     except ImportError:
         pass
     else:
+        from .impl import async_execute_pipeline
         from .impl import async_execute_process
+        from .impl import async_wait_for_output
         from .impl import get_loop
 
         __all__ = [
+            'async_execute_pipeline',
             'async_execute_process',
+            'async_wait_for_output',
             'asyncio',
             'get_loop',
         ]
@@ -14,14 +14,15 @@
 
 import asyncio
 import os
+import time
 
-try:
-    import pty
-    has_pty = True
-except ImportError:
-    has_pty = False
-
+from ..execute_process_nopty import _close_fds
+from ..execute_process_nopty import _pipefail
+from ..execute_process_nopty import ReturnCode
 from ..get_loop_impl import get_loop_impl
+from ..pty_manager import get_pty_manager
+from ..readiness import _ReadinessWatch
+from ..readiness import NotReadyError
 
 
 def get_loop():
@@ -48,27 +49,80 @@ async def _async_execute_process_nopty(
     return transport, protocol
 
 
-if has_pty:
-    # If pty is availabe, use them to emulate the tty
-    async def _async_execute_process_pty(
-        protocol_class, cmd, cwd, env, shell,
-        stderr_to_stdout=True
-    ):
-        loop = get_loop()
-        # Create the PTY's
-        stdout_master, stdout_slave = pty.openpty()
-        if stderr_to_stdout:
-            stderr_master, stderr_slave = stdout_master, stdout_slave
-        else:
-            stderr_master, stderr_slave = pty.openpty()
+async def _connect_read_pipes(
+    protocol, stdout_master, stderr_master, ptys=None
+):
+    # Passes data read from the given file descriptors, i.e. pty masters or
+    # pipes which are not owned by the subprocess transport, to the protocol,
+    # and releases the pty's, if any, once all of them are closed
+    loop = get_loop()
+    open_masters = {stdout_master, stderr_master}
 
-        def protocol_factory():
-            return protocol_class(
-                stdin=None,
-                stdout=stdout_master,
-                stderr=stderr_master
-            )
+    def master_closed(master):
+        open_masters.discard(master)
+        if not open_masters and ptys is not None:
+            ptys.release()
+
+    class PtyStdoutProtocol(asyncio.Protocol):
+        def connection_made(self, transport):
+            if hasattr(protocol, 'on_stdout_open'):
+                protocol.on_stdout_open()
+
+        def data_received(self, data):
+            protocol.pipe_data_received(1, data)
+
+        def connection_lost(self, exc):
+            master_closed(stdout_master)
+            protocol.pipe_connection_lost(1, exc)
+            if hasattr(protocol, 'on_stdout_close'):
+                protocol.on_stdout_close(exc)
+
+    class PtyStderrProtocol(asyncio.Protocol):
+        def connection_made(self, transport):
+            if hasattr(protocol, 'on_stderr_open'):
+                protocol.on_stderr_open()
 
+        def data_received(self, data):
+            protocol.pipe_data_received(2, data)
+
+        def connection_lost(self, exc):
+            master_closed(stderr_master)
+            protocol.pipe_connection_lost(2, exc)
+            if hasattr(protocol, 'on_stderr_close'):
+                protocol.on_stderr_close(exc)
+
+    # Add the pty's to the read loop
+    # Also store the transport, protocol tuple for each call to
+    # connect_read_pipe, to prevent the destruction of the protocol
+    # class instance, otherwise no data is received.
+    protocol.stdout_tuple = await loop.connect_read_pipe(
+        PtyStdoutProtocol, os.fdopen(stdout_master, 'rb', 0))
+    if stderr_master != stdout_master:
+        protocol.stderr_tuple = await loop.connect_read_pipe(
+            PtyStderrProtocol, os.fdopen(stderr_master, 'rb', 0))
+
+
+async def _async_execute_process_pty(
+    protocol_class, cmd, cwd, env, shell,
+    stderr_to_stdout=True
+):
+    # Get the PTY's, or use pipes if there are none to spare, see PtyManager
+    ptys = get_pty_manager().open_ptys(1 if stderr_to_stdout else 2)
+    if ptys is None:
+        return await _async_execute_process_nopty(
+            protocol_class, cmd, cwd, env, shell, stderr_to_stdout)
+    loop = get_loop()
+    stdout_master, stdout_slave = ptys.pairs[0]
+    stderr_master, stderr_slave = ptys.pairs[-1]
+
+    def protocol_factory():
+        return protocol_class(
+            stdin=None,
+            stdout=stdout_master,
+            stderr=stderr_master
+        )
+
+    try:
         # Start the subprocess
         if shell is True:
             transport, protocol = await loop.subprocess_shell(
@@ -78,53 +132,21 @@ if has_pty:
             transport, protocol = await loop.subprocess_exec(
                 protocol_factory, *cmd, cwd=cwd, env=env,
                 stdout=stdout_slave, stderr=stderr_slave, close_fds=False)
+    except BaseException:
+        # Make sure we don't leak file descriptors
+        _close_fds({stdout_master, stdout_slave, stderr_master, stderr_slave})
+        ptys.release()
+        raise
 
-        # Close our copies of the slaves,
-        # the child's copy of the slave remain open until it terminates
-        os.close(stdout_slave)
-        if not stderr_to_stdout:
-            os.close(stderr_slave)
-
-        # Create Protocol classes
-        class PtyStdoutProtocol(asyncio.Protocol):
-            def connection_made(self, transport):
-                if hasattr(protocol, 'on_stdout_open'):
-                    protocol.on_stdout_open()
-
-            def data_received(self, data):
-                if hasattr(protocol, 'on_stdout_received'):
-                    protocol.on_stdout_received(data)
-
-            def connection_lost(self, exc):
-                if hasattr(protocol, 'on_stdout_close'):
-                    protocol.on_stdout_close(exc)
-
-        class PtyStderrProtocol(asyncio.Protocol):
-            def connection_made(self, transport):
-                if hasattr(protocol, 'on_stderr_open'):
-                    protocol.on_stderr_open()
-
-            def data_received(self, data):
-                if hasattr(protocol, 'on_stderr_received'):
-                    protocol.on_stderr_received(data)
-
-            def connection_lost(self, exc):
-                if hasattr(protocol, 'on_stderr_close'):
-                    protocol.on_stderr_close(exc)
-
-        # Add the pty's to the read loop
-        # Also store the transport, protocol tuple for each call to
-        # connect_read_pipe, to prevent the destruction of the protocol
-        # class instance, otherwise no data is received.
-        protocol.stdout_tuple = await loop.connect_read_pipe(
-            PtyStdoutProtocol, os.fdopen(stdout_master, 'rb', 0))
-        if not stderr_to_stdout:
-            protocol.stderr_tuple = await loop.connect_read_pipe(
-                PtyStderrProtocol, os.fdopen(stderr_master, 'rb', 0))
-        # Return the protocol and transport
-        return transport, protocol
-else:
-    _async_execute_process_pty = _async_execute_process_nopty
+    # Close our copies of the slaves,
+    # the child's copy of the slave remain open until it terminates
+    os.close(stdout_slave)
+    if not stderr_to_stdout:
+        os.close(stderr_slave)
+
+    await _connect_read_pipes(protocol, stdout_master, stderr_master, ptys)
+    # Return the protocol and transport
+    return transport, protocol
 
 
 async def async_execute_process(
@@ -140,3 +162,203 @@ async def async_execute_process(
             protocol_class, cmd, cwd, env, shell,
             stderr_to_stdout)
     return transport, protocol
+
+
+def _watch_protocol(protocol, watch, future):
+    # Searches the data received by the protocol until the watch matches,
+    # and then lets it receive data directly again
+    receive = protocol.pipe_data_received
+
+    def pipe_data_received(fd, data):
+        receive(fd, data)
+        if future.done():
+            return
+        if watch.search(fd, data) is not None:
+            del protocol.pipe_data_received
+            future.set_result(watch.ready())
+
+    protocol.pipe_data_received = pipe_data_received
+
+
+async def async_wait_for_output(
+    protocol_class, cmd, pattern, timeout=None, cwd=None, env=None,
+    shell=False, emulate_tty=False, stderr_to_stdout=True
+):
+    watch = _ReadinessWatch(pattern, timeout)
+    ready = asyncio.Future()
+
+    def protocol_factory(**kwargs):
+        protocol = protocol_class(**kwargs)
+        _watch_protocol(protocol, watch, ready)
+        return protocol
+
+    transport, protocol = await async_execute_process(
+        protocol_factory, cmd, cwd, env, shell, emulate_tty,
+        stderr_to_stdout)
+    remaining = None
+    if watch.deadline is not None:
+        remaining = max(watch.deadline - time.monotonic(), 0)
+    await asyncio.wait(
+        [ready, protocol.complete], timeout=remaining,
+        return_when=asyncio.FIRST_COMPLETED)
+    if ready.done():
+        return transport, protocol, ready.result()
+    ready.cancel()
+    # The transport is not returned, so it is closed here, which also stops
+    # the subprocess, rather than leaving it running
+    transport.close()
+    if protocol.complete.done():
+        raise NotReadyError('exited', protocol.complete.result())
+    raise NotReadyError('timeout')
+
+
+class _StageProtocol(asyncio.SubprocessProtocol):
+    # Protocol for the commands of a pipeline before the last one, whose
+    # output goes to the next command rather than to this process
+
+    def __init__(self):
+        self.complete = asyncio.Future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def process_exited(self):
+        self.complete.set_result(self.transport.get_returncode())
+
+
+class _PipelineTransport(asyncio.SubprocessTransport):
+    # Stands in for the transport of the last command of a pipeline, so
+    # closing, killing or signaling it reaches all of the commands
+
+    def __init__(self, transports):
+        asyncio.SubprocessTransport.__init__(self)
+        self.transports = transports
+
+    def get_pid(self):
+        return self.transports[-1].get_pid()
+
+    def get_returncode(self):
+        return self.transports[-1].get_returncode()
+
+    def get_pipe_transport(self, fd):
+        if fd == 0:
+            return self.transports[0].get_pipe_transport(0)
+        return self.transports[-1].get_pipe_transport(fd)
+
+    def get_extra_info(self, name, default=None):
+        return self.transports[-1].get_extra_info(name, default)
+
+    def send_signal(self, signal):
+        for transport in self.transports:
+            if transport.get_returncode() is None:
+                transport.send_signal(signal)
+
+    def terminate(self):
+        for transport in self.transports:
+            if transport.get_returncode() is None:
+                transport.terminate()
+
+    def kill(self):
+        for transport in self.transports:
+            if transport.get_returncode() is None:
+                transport.kill()
+
+    def is_closing(self):
+        return all(transport.is_closing() for transport in self.transports)
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+
+
+async def _wait_for_pipeline(stages, protocol):
+    returncodes = [await stage.complete for stage in stages]
+    returncodes.append(await protocol.complete)
+    # The transports of the other commands are only reachable from here
+    for stage in stages:
+        stage.transport.close()
+    return ReturnCode(_pipefail(returncodes), returncodes=returncodes)
+
+
+async def async_execute_pipeline(
+    protocol_class, cmds=None, cwd=None, env=None, shell=False,
+    emulate_tty=False, stderr_to_stdout=True
+):
+    if not cmds:
+        raise ValueError("cmds must contain at least one command")
+    loop = get_loop()
+    # The output of the last command, and stderr of all of them, are read
+    # from pipes, or pty's, which are connected to the protocol
+    fds = set()
+    stages = []
+    ptys = None
+    if emulate_tty:
+        ptys = get_pty_manager().open_ptys(1 if stderr_to_stdout else 2)
+    try:
+        if ptys is not None:
+            stdout_r, stdout_w = ptys.pairs[0]
+        else:
+            stdout_r, stdout_w = os.pipe()
+        fds.update([stdout_r, stdout_w])
+        stderr_r, stderr_w = stdout_r, stdout_w
+        if not stderr_to_stdout:
+            if ptys is not None:
+                stderr_r, stderr_w = ptys.pairs[1]
+            else:
+                stderr_r, stderr_w = os.pipe()
+            fds.update([stderr_r, stderr_w])
+
+        async def start(protocol_factory, cmd, stdin, stdout):
+            if shell is True:
+                return await loop.subprocess_shell(
+                    protocol_factory, " ".join(cmd), cwd=cwd, env=env,
+                    stdin=stdin, stdout=stdout, stderr=stderr_w,
+                    close_fds=False)
+            return await loop.subprocess_exec(
+                protocol_factory, *cmd, cwd=cwd, env=env,
+                stdin=stdin, stdout=stdout, stderr=stderr_w, close_fds=False)
+
+        # Each command's stdout is connected to the next one's stdin with an
+        # OS pipe, so the data between them never goes through this process
+        stdin = asyncio.subprocess.PIPE
+        for cmd in cmds[:-1]:
+            link_r, link_w = os.pipe()
+            fds.update([link_r, link_w])
+            _, stage = await start(_StageProtocol, cmd, stdin, link_w)
+            stages.append(stage)
+            # Only the commands on either end need the pipe between them
+            _close_fds({link_w, stdin} & fds)
+            fds.difference_update([link_w, stdin])
+            stdin = link_r
+
+        def protocol_factory():
+            # The protocol can write to the stdin of the first command
+            first_stdin = None
+            if stages:
+                first_stdin = stages[0].transport.get_pipe_transport(0)
+            protocol = protocol_class(
+                stdin=first_stdin, stdout=stdout_r, stderr=stderr_r)
+            # Resources are sampled for all of the commands
+            protocol._stage_pids = [
+                stage.transport.get_pid() for stage in stages]
+            return protocol
+
+        transport, protocol = await start(
+            protocol_factory, cmds[-1], stdin, stdout_w)
+        # Close our copies of the write ends, so the reads end once all of
+        # the commands have exited
+        _close_fds({stdin, stdout_w, stderr_w} & fds)
+        fds.difference_update([stdin, stdout_w, stderr_w])
+        await _connect_read_pipes(protocol, stdout_r, stderr_r, ptys)
+    except BaseException:
+        # Make sure nothing is left running and no file descriptors leak
+        for stage in stages:
+            stage.transport.close()
+        _close_fds(fds)
+        if ptys is not None:
+            ptys.release()
+        raise
+    protocol.pipeline_complete = asyncio.ensure_future(
+        _wait_for_pipeline(stages, protocol))
+    return _PipelineTransport(
+        [stage.transport for stage in stages] + [transport]), protocol
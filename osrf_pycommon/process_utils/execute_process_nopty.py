@@ -12,38 +12,125 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import codecs
 import errno
+import functools
 import os
-import select
+import selectors
+import signal
 
 from subprocess import PIPE
 from subprocess import Popen
 from subprocess import STDOUT
+from subprocess import TimeoutExpired
 
 import sys
+import time
+import weakref
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where output is not spliced
+    fcntl = None
+
+from .line_assembler import LineAssembler
+from .line_filter import LineFilter
+from .line_normalizer import LineNormalizer
+from .output_timeline import _monotonic_ns
+from .resource_sampler import _ResourceSampler
+from .run_result import _RunStats
 
 _is_linux = sys.platform.lower().startswith('linux')
 _is_windows = sys.platform.lower().startswith('win')
 
+# Seconds between checks for the exit of a subprocess which closed its output
+_exit_poll_interval = 0.05
+
+# Number of bytes read at a time from a file given as input
+_input_read_size = 64 * 1024
+
+# Bounds for the adaptive read size, which starts at the minimum and doubles
+# each time a read fills it, i.e. while the pipe stays full
+_min_read_size = 1024
+_max_read_size = 1024 * 1024
+
+_output_modes = ['lines', 'chunks']
+
+# The options of the functions which collect the output of subprocesses, e.g.
+# execute_process, with their defaults, which are passed on to each _Job
+_options = {
+    'mode': 'lines',
+    'read_size': None,
+    'reuse_buffer': False,
+    'max_line_bytes': None,
+    'overflow': 'split',
+    'timeout': None,
+    'idle_timeout': None,
+    'kill_timeout': 5.0,
+    'new_process_group': False,
+    'coalesce_ms': None,
+    'encoding': None,
+    'errors': 'strict',
+    'timeline': None,
+    'input': None,
+    'stdin': None,
+    'mirror': None,
+    'include': None,
+    'exclude': None,
+    'rate_limit': None,
+    'collapse_cr': False,
+    'fold_repeats': False,
+    'delimiter': None,
+    'on_resource_sample': None,
+    'resource_interval': 1.0,
+}
+
+
+class ReturnCode(int):
+    """The return code of a subprocess, along with why it ended.
+
+    This is an :py:class:`int`, so it can be used like any other return code,
+    with an additional ``reason`` attribute which is one of:
+
+    - ``'exited'``: the subprocess exited, or was killed, by itself
+    - ``'timeout'``: the subprocess was stopped because it ran for longer
+      than the ``timeout``
+    - ``'idle_timeout'``: the subprocess was stopped because it did not
+      output anything for longer than the ``idle_timeout``
+    - ``'ready_timeout'``: the subprocess was stopped because it did not
+      output what :py:func:`osrf_pycommon.process_utils.wait_for_output`
+      waited for in time
+
+    For a pipeline, see
+    :py:func:`osrf_pycommon.process_utils.execute_pipeline`, the
+    ``returncodes`` attribute is the list of return codes of each command,
+    and the return code itself is the last of them which is not zero, or
+    zero if they all are, like with ``set -o pipefail`` in bash.
+    Otherwise ``returncodes`` is None.
+
+    When the output was filtered with ``include`` or ``exclude`` patterns,
+    see :py:func:`osrf_pycommon.process_utils.execute_process`, the number
+    of lines which were kept and dropped are in the ``matched_lines`` and
+    ``dropped_lines`` attributes, otherwise they are None.
+
+    The ``result`` attribute is a
+    :py:class:`osrf_pycommon.process_utils.RunResult` with the timings,
+    resource usage and output counts of the subprocess, or None if they
+    were not collected.
+    """
 
-def _process_incoming_lines(incoming, left_over):
-    # This function takes the new data, the left over data from last time
-    # and returns a list of complete lines (separated by sep) as well as
-    # any sep trailing data for the next iteration
-    # This function takes and returns bytes only
-    combined = (left_over + incoming)
-    lines = combined.splitlines(True)
-    if not lines:
-        return None, left_over
-    # Use splitlines because it is magic
-    # comparing against os.linesep is not sufficient
-    if lines[-1].splitlines() != [lines[-1]]:
-        data = b''.join(lines)
-        left_over = b''
-    else:
-        data = b''.join(lines[:-1])
-        left_over = lines[-1]
-    return data, left_over
+    def __new__(
+        cls, returncode, reason='exited', returncodes=None,
+        matched_lines=None, dropped_lines=None, result=None
+    ):
+        self = int.__new__(cls, returncode)
+        self.reason = reason
+        self.returncodes = returncodes
+        self.matched_lines = matched_lines
+        self.dropped_lines = dropped_lines
+        self.result = result
+        return self
 
 
 def _close_fds(fds_to_close):
@@ -60,84 +147,867 @@ def _close_fds(fds_to_close):
                 raise
 
 
-def _yield_data(p, fds, left_overs, linesep, fds_to_close=None):
-    # This function uses select and subprocess.Popen.poll to collect out
-    # from a subprocess until it has finished, yielding it as it goes
-    fds_to_close = [] if fds_to_close is None else fds_to_close
+def _read_stream(fileno, read_size=_min_read_size):
+    # Read what is available from the given fd, returning b'' on EOF
+    try:
+        return os.read(fileno, read_size)
+    except OSError as exc:
+        # On Linux, when using a pty, in order to get select
+        # to return when the subprocess finishes, os.close
+        # must be called on the slave pty fd after forking
+        # the subprocess with popen. On some versions of
+        # the Linux kernel this causes an Errno 5 OSError,
+        # "Input/output error", once the subprocess has closed
+        # its end, which is equivalent to EOF. See:
+        #   http://stackoverflow.com/a/12207447/671658
+        if _is_linux and exc.errno == errno.EIO:
+            return b''
+        raise
 
-    def yield_to_stream(data, stream):
-        if stream == fds[0]:
-            return data, None, None
-        else:
-            return None, data, None
 
+def _read_stream_into(fileno, buffer):
+    # Like _read_stream, but reads into the given writable buffer and
+    # returns the number of bytes read, which is 0 on EOF
     try:
-        while p.poll() is None:
-            # If Windows
-            if _is_windows:
-                for stream in fds:
+        return os.readv(fileno, [buffer])
+    except OSError as exc:
+        # See _read_stream
+        if _is_linux and exc.errno == errno.EIO:
+            return 0
+        raise
+
+
+def _input_chunks(input):
+    # Returns an iterator over the chunks of bytes to write to stdin
+    if isinstance(input, (bytes, bytearray, memoryview)):
+        return iter([input])
+    if hasattr(input, 'read'):
+        return iter(functools.partial(input.read, _input_read_size), b'')
+    return iter(input)
+
+
+class _Mirror(object):
+    # Copies the output of a subprocess to a file descriptor, as it is read.
+    # On Linux, output read from a pipe is moved into the file by the kernel
+    # with os.splice, and then read back from the file for the consumer, so
+    # it is never written from this process. Python has no tee(2), so this
+    # is as close to zero-copy as it gets while still delivering the data.
+    # Otherwise, e.g. for pty's or files which cannot be read back, the data
+    # is written as it is read.
+
+    def __init__(self, mirror):
+        if hasattr(mirror, 'flush'):
+            # Anything buffered in the file object goes first
+            mirror.flush()
+        self.fd = mirror if isinstance(mirror, int) else mirror.fileno()
+        # Offset in the file for reading back spliced data, if spliced
+        self.offset = None
+        if hasattr(os, 'splice') and fcntl is not None:
+            flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+            if flags & os.O_ACCMODE == os.O_RDWR and \
+                    not flags & os.O_APPEND:
+                try:
+                    self.offset = os.lseek(self.fd, 0, os.SEEK_CUR)
+                except OSError:
+                    # Not a regular file, e.g. a pipe or a terminal
+                    pass
+        # Streams which cannot be spliced, e.g. pty's
+        self.unspliceable = set()
+
+    def splice(self, stream, fileno, size, view=None):
+        # Moves up to size bytes from fileno into the file, and returns them,
+        # read into view if given, or returns None if splicing isn't possible
+        if self.offset is None or stream in self.unspliceable:
+            return None
+        try:
+            size = os.splice(fileno, self.fd, size)
+        except OSError as exc:
+            if exc.errno != errno.EINVAL:
+                raise
+            self.unspliceable.add(stream)
+            return None
+        if view is None:
+            data = os.pread(self.fd, size, self.offset)
+        else:
+            data = view[:os.preadv(self.fd, [view[:size]], self.offset)]
+        self.offset += size
+        return data
+
+    def write(self, data):
+        written = 0
+        while written < len(data):
+            written += os.write(self.fd, data[written:])
+        if self.offset is not None:
+            self.offset += written
+
+
+def _check_options(options, names=None):
+    # Checks the given options, along with the defaults of the others, in one
+    # pass, before starting the subprocess, so it isn't left running
+    for name in options:
+        if name not in (_options if names is None else names):
+            raise TypeError(
+                "got an unexpected keyword argument '{0}'".format(name))
+    values = dict(_options)
+    values.update(options)
+    mode = values['mode']
+    delimiter = values['delimiter']
+    if mode not in _output_modes:
+        raise ValueError("mode must be one of {0}, got '{1}'".format(
+            _output_modes, mode))
+    if values['read_size'] is not None and values['read_size'] < 1:
+        raise ValueError("read_size must be at least 1, got '{0}'".format(
+            values['read_size']))
+    for name in ['coalesce_ms', 'timeout', 'idle_timeout', 'kill_timeout']:
+        if values[name] is not None and values[name] < 0:
+            raise ValueError("{0} must not be negative, got '{1}'".format(
+                name, values[name]))
+    if values['resource_interval'] <= 0:
+        raise ValueError("resource_interval must be positive, got '{0}'"
+                         .format(values['resource_interval']))
+    if values['input'] is not None and values['stdin'] is not None:
+        raise ValueError("stdin and input cannot both be given")
+    # These work on lines, which are split on \n and \r, so not on records
+    filters = [
+        ('include', values['include'] is not None),
+        ('exclude', values['exclude'] is not None),
+        ('rate_limit', values['rate_limit'] is not None),
+        ('collapse_cr', values['collapse_cr']),
+        ('fold_repeats', values['fold_repeats']),
+    ]
+    for name, value in [
+        ('max_line_bytes', values['max_line_bytes'] is not None),
+        ('delimiter', delimiter is not None),
+    ] + filters:
+        if value and mode != 'lines':
+            raise ValueError(
+                "{0} can only be used in 'lines' mode".format(name))
+    for name, value in filters:
+        if value and delimiter is not None:
+            raise ValueError(
+                "{0} can not be used with a delimiter".format(name))
+    # Raises for an invalid max_line_bytes, overflow or delimiter
+    LineAssembler(values['max_line_bytes'], values['overflow'], delimiter)
+    if values['encoding'] is not None:
+        # Raises LookupError for an unknown encoding or error handler
+        codecs.getincrementaldecoder(values['encoding'])
+        codecs.lookup_error(values['errors'])
+    # Raises re.error for an invalid pattern
+    if values['include'] is not None or values['exclude'] is not None:
+        LineFilter(values['include'], values['exclude'])
+
+
+class _Job(object):
+    # State of a subprocess whose output is being collected
+
+    def __init__(
+        self, index, p, fds, fds_to_close=None, mode='lines', read_size=None,
+        reuse_buffer=False, max_line_bytes=None, overflow='split',
+        timeout=None, idle_timeout=None, kill_timeout=5.0,
+        new_process_group=False, encoding=None, errors='strict', input=None,
+        mirror=None, include=None, exclude=None, ready=None, rate_limit=None,
+        collapse_cr=False, fold_repeats=False, delimiter=None,
+        on_resource_sample=None, resource_interval=1.0, ptys=None
+    ):
+        self.index = index
+        self.p = p
+        self.fds = fds
+        self.fds_to_close = [] if fds_to_close is None else fds_to_close
+        # The pty's whose masters are in fds_to_close, if any, which are
+        # released to their manager once closed
+        self.ptys = ptys
+        # Data from a read which isn't a complete line yet is kept in these
+        self.assemblers = {}
+        if mode == 'lines':
+            self.assemblers = {
+                stream: LineAssembler(max_line_bytes, overflow, delimiter)
+                for stream in fds}
+        # Complete lines are normalized, and then filtered, before they are
+        # decoded
+        self.normalizers = {}
+        if mode == 'lines' and (collapse_cr or fold_repeats):
+            self.normalizers = {
+                stream: LineNormalizer(collapse_cr, fold_repeats)
+                for stream in fds}
+        self.line_filter = None
+        if include is not None or exclude is not None:
+            self.line_filter = LineFilter(include, exclude)
+        # Shared by all jobs, with the suppressed lines of each stream kept
+        # separately
+        self.rate_limit = rate_limit
+        # Output is decoded after line assembly, and the decoders keep any
+        # incomplete multibyte character until the next piece of data
+        self.decoders = {}
+        if encoding is not None:
+            decoder = codecs.getincrementaldecoder(encoding)
+            self.decoders = {stream: decoder(errors) for stream in fds}
+        self.adaptive_read_size = read_size is None
+        self.read_sizes = dict.fromkeys(fds, read_size or _min_read_size)
+        # Buffers which are read into, and reused for, each read if requested
+        self.buffers = {} if reuse_buffer else None
+        self.open_streams = set(fds)
+        self.new_process_group = new_process_group
+        # Monotonic times at which the subprocess gets stopped
+        self.last_output = time.monotonic()
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = self.last_output + timeout
+        self.idle_timeout = idle_timeout
+        # Readiness which is waited for, until its deadline, if any, which
+        # refers back to this job, so that it can be stopped once ready
+        self.ready = ready
+        if ready is not None:
+            ready.job = self
+        self.kill_timeout = kill_timeout
+        self.kill_deadline = None
+        self.reason = 'exited'
+        self.closed = False
+        # Chunks still to be written to stdin, and what is left of the
+        # current one
+        self.input = None if input is None else _input_chunks(input)
+        self.input_pending = memoryview(b'')
+        self.mirror = None if mirror is None else _Mirror(mirror)
+        self.pidfd = None
+        self.exited = False
+        # Output counts, and resource usage once reaped, for the RunResult
+        self.stats = _RunStats()
+        # Samples of the resource use while running, passed to the callback
+        self.on_resource_sample = on_resource_sample
+        self.sampler = None
+        if on_resource_sample is not None:
+            self.sampler = _ResourceSampler(
+                [p.pid for p in getattr(p, 'processes', [p])],
+                resource_interval)
+
+    def read(self, stream, fileno):
+        read_size = self.read_sizes[stream]
+        view = None
+        if self.buffers is not None:
+            buffer = self.buffers.get(stream)
+            if buffer is None or len(buffer) < read_size:
+                # Replace rather than resize, as the consumer may still
+                # hold a memoryview of the previous buffer
+                buffer = self.buffers[stream] = bytearray(read_size)
+            view = memoryview(buffer)[:read_size]
+        incoming = None
+        if self.mirror is not None:
+            incoming = self.mirror.splice(stream, fileno, read_size, view)
+        if incoming is None:
+            if view is None:
+                incoming = _read_stream(fileno, read_size)
+            else:
+                incoming = view[:_read_stream_into(fileno, view)]
+            if incoming and self.mirror is not None:
+                self.mirror.write(incoming)
+        number = 1 if stream == self.fds[0] else 2
+        if view is None:
+            self.stats.count(number, incoming)
+        else:
+            self.stats.count(number, self.buffers[stream], len(incoming))
+        if incoming and self.idle_timeout is not None:
+            self.last_output = time.monotonic()
+        if self.adaptive_read_size:
+            if len(incoming) == read_size:
+                self.read_sizes[stream] = min(read_size * 2, _max_read_size)
+            elif len(incoming) < read_size // 4:
+                self.read_sizes[stream] = max(read_size // 2, _min_read_size)
+        return incoming
+
+    def search_ready(self, stream, data):
+        # Searches the output as it is read, so also incomplete lines, for
+        # the readiness which is waited for, until it matches or the
+        # subprocess is being stopped, returning True once it matches
+        if self.ready is None or self.ready.match is not None or \
+                self.reason != 'exited' or not data:
+            return False
+        number = 1 if stream == self.fds[0] else 2
+        return self.ready.search(number, data) is not None
+
+    def feed(self, stream, data):
+        # Returns the data to be yielded, if any, for newly read data
+        if stream in self.assemblers:
+            if self.buffers is not None:
+                data = self.assemblers[stream].feed_from(
+                    self.buffers[stream], len(data))
+            else:
+                data = self.assemblers[stream].feed(data)
+            data = self.process_lines(stream, data)
+        return self.decode(stream, data)
+
+    def flush(self, stream):
+        # Returns the data to be yielded, if any, once a stream is closed
+        data = None
+        if stream in self.assemblers:
+            data = self.assemblers[stream].flush()
+            data = self.process_lines(stream, data, final=True)
+        return self.decode(stream, data, final=True)
+
+    def process_lines(self, stream, data, final=False):
+        # Normalizes, filters and rate limits complete lines, in that order,
+        # and at the end of the stream adds anything which was held back
+        normalizer = self.normalizers.get(stream)
+        if normalizer is not None:
+            data = normalizer.feed(data)
+            if final:
+                data = (data or b'') + (normalizer.flush() or b'')
+        if data and self.line_filter is not None:
+            data = self.line_filter.filter(data)
+        if self.rate_limit is not None:
+            key = (self.index, stream)
+            data = self.rate_limit.limit(data, key)
+            if final:
+                # The suppressed lines are summarized at the end of output
+                data = (data or b'') + (self.rate_limit.flush(key) or b'')
+        return data
+
+    def decode(self, stream, data, final=False):
+        if stream not in self.decoders:
+            return data
+        return self.decoders[stream].decode(data or b'', final)
+
+    def event(self, stream, data, timeline=None, time_ns=None):
+        # Returns the tuple to be yielded, recording it in the timeline
+        number = 1 if stream == self.fds[0] else 2
+        if timeline is not None:
+            timeline.record(number, len(data), self.index, time_ns)
+        if number == 1:
+            return self.index, data, None, None
+        return self.index, None, data, None
+
+    def write_input(self):
+        # Writes as much input as stdin takes without blocking, returning
+        # True once all of it is written, or the subprocess closed stdin
+        fileno = self.p.stdin.fileno()
+        try:
+            while True:
+                if not self.input_pending:
+                    chunk = next(self.input, None)
+                    if chunk is None:
+                        return True
+                    self.input_pending = memoryview(chunk)
+                    continue
+                written = os.write(fileno, self.input_pending)
+                self.input_pending = self.input_pending[written:]
+        except BlockingIOError:
+            return False
+        except BrokenPipeError:
+            return True
+
+    def close_input(self):
+        # Closing stdin lets the subprocess see the end of its input
+        self.input = None
+        self.input_pending = memoryview(b'')
+        self.p.stdin.close()
+
+    def open_pidfd(self):
+        # On Linux 5.3 or newer, with Python 3.9 or newer, a pidfd becomes
+        # readable when the subprocess exits, so its exit can be waited for
+        # along with its output rather than polling for it with waitpid
+        if not hasattr(os, 'pidfd_open'):
+            return False
+        try:
+            self.pidfd = os.pidfd_open(self.p.pid)
+        except OSError:
+            # e.g. ENOSYS on older kernels, then fallback to polling
+            return False
+        return True
+
+    def send_signal(self, sig, fallback):
+        # Signals the whole process group if the subprocess has its own,
+        # otherwise calls fallback, e.g. Popen.terminate, for the subprocess
+        if not self.new_process_group or not hasattr(os, 'killpg'):
+            fallback()
+            return
+        try:
+            os.killpg(getattr(self.p, 'pgid', self.p.pid), sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM, self.p.terminate)
+
+    def kill(self):
+        self.send_signal(getattr(signal, 'SIGKILL', None), self.p.kill)
+
+    def check_deadlines(self, now):
+        # Terminates, and later kills, the subprocess once a timeout has
+        # expired, returning the time of its next deadline, if any
+        if self.reason != 'exited':
+            if self.kill_deadline is not None and now >= self.kill_deadline:
+                self.kill()
+                self.kill_deadline = None
+            return self.kill_deadline
+        deadlines = []
+        if self.deadline is not None:
+            deadlines.append((self.deadline, 'timeout'))
+        if self.idle_timeout is not None:
+            deadlines.append(
+                (self.last_output + self.idle_timeout, 'idle_timeout'))
+        if self.ready is not None and self.ready.deadline is not None and \
+                self.ready.match is None:
+            deadlines.append((self.ready.deadline, 'ready_timeout'))
+        if not deadlines:
+            return None
+        deadline, reason = min(deadlines)
+        if now < deadline:
+            return deadline
+        self.reason = reason
+        if self.kill_timeout:
+            self.terminate()
+            self.kill_deadline = now + self.kill_timeout
+        else:
+            self.kill()
+        return self.kill_deadline
+
+    def sample_resources(self, now):
+        # Passes a sample of the resource use to the callback if one is due,
+        # returning the time of the next one, if any
+        if self.sampler is None:
+            return None
+        sample = self.sampler.due(now)
+        if sample is not None:
+            self.on_resource_sample(sample)
+        return self.sampler.deadline
+
+    def poll(self):
+        # Reaps the subprocess, or all commands of a pipeline, once exited,
+        # so that their resource usage is recorded
+        for p in getattr(self.p, 'processes', [self.p]):
+            self.stats.reap(p)
+        return self.p.poll()
+
+    def returncode(self):
+        if self.reason != 'exited' and self.new_process_group:
+            # Make sure nothing is left running in the process group
+            self.kill()
+        matched_lines = dropped_lines = None
+        if self.line_filter is not None:
+            matched_lines = self.line_filter.matched_lines
+            dropped_lines = self.line_filter.dropped_lines
+        result = self.stats.result(
+            self.p.returncode, getattr(self.p, 'processes', [self.p]))
+        return ReturnCode(
+            self.p.returncode, self.reason,
+            getattr(self.p, 'returncodes', None), matched_lines,
+            dropped_lines, result)
+
+    def close(self):
+        # Make sure we don't leak file descriptors, but only once, as by the
+        # next time the fd numbers may have been reused
+        if self.closed:
+            return
+        self.closed = True
+        for f in (self.p.stdin, self.p.stdout, self.p.stderr):
+            if f is not None:
+                f.close()
+        _close_fds(self.fds_to_close + [self.pidfd])
+        if self.ptys is not None:
+            self.ptys.release()
+
+    def cancel(self):
+        # Stops the subprocess if it is still running, e.g. because the
+        # generator collecting its output was closed, and waits for it,
+        # for at most kill_timeout before killing it
+        if self.closed:
+            return
+        try:
+            if self.p.poll() is None:
+                if self.kill_timeout:
+                    self.terminate()
+                    try:
+                        self.p.wait(self.kill_timeout)
+                    except TimeoutExpired:
+                        pass
+                self.kill()
+                self.p.wait()
+            elif self.new_process_group:
+                # Make sure nothing is left running in the process group
+                self.kill()
+        finally:
+            self.close()
+
+
+def _multiplex_data_windows(jobs, timeline=None):
+    # Run each subprocess in turn, since select cannot be used on pipes
+    for job in jobs:
+        try:
+            if job.input is not None:
+                # Without select the input is written before reading output
+                job.write_input()
+                job.close_input()
+            while job.poll() is None:
+                for stream in job.fds:
                     # This will not produce the best results, but at least
                     # it will function on Windows. A True IOCP implementation
                     # would be required to get streaming from Windows streams.
-                    data = stream.readline()
+                    if job.assemblers:
+                        data = stream.readline()
+                    else:
+                        data = stream.read1(job.read_sizes[stream])
+                    if data and job.mirror is not None:
+                        job.mirror.write(data)
+                    job.stats.count(1 if stream == job.fds[0] else 2, data)
+                    ready = job.search_ready(stream, data)
+                    if job.assemblers:
+                        data = job.process_lines(stream, data)
+                    data = job.decode(stream, data)
                     if data:
-                        yield yield_to_stream(data, stream)
+                        yield job.event(stream, data, timeline)
+                    if ready:
+                        yield job.index, None, None, None
+            for stream in job.fds:
+                data = None
+                if job.assemblers:
+                    data = job.process_lines(stream, None, final=True)
+                data = job.decode(stream, data, final=True)
+                if data:
+                    yield job.event(stream, data, timeline)
+            yield job.index, None, None, job.returncode()
+        finally:
+            job.cancel()
+
+
+def _multiplex_data(
+    jobs, max_parallel=None, coalesce_ms=None, timeline=None
+):
+    # This function uses a single selector, and pidfd's or
+    # subprocess.Popen.poll, to collect output from any number of
+    # subprocesses, yielding (index, stdout, stderr, returncode) tuples as it
+    # goes.
+    # Jobs are only taken from the given iterable, which may start the
+    # subprocess lazily, when fewer than max_parallel are running.
+    # With coalesce_ms, output of each stream is gathered for that long after
+    # it first arrives and is then yielded at once.
+    # Each yielded piece of output is recorded in the timeline, if any.
+    if _is_windows:
+        yield from _multiplex_data_windows(jobs, timeline)
+        return
+    jobs = iter(jobs)
+    running = []
+    # Each fd is registered once with a selector (epoll on Linux),
+    # so it is not limited by FD_SETSIZE like select
+    selector = selectors.DefaultSelector()
+    # Output gathered, by job and stream, until the coalescing window ends
+    gathered = {}
+    window = None if coalesce_ms is None else coalesce_ms / 1000.0
+    window_end = None
+
+    def output(job, stream, data):
+        if window is None:
+            yield job.event(stream, data, timeline)
+            return
+        if isinstance(data, memoryview):
+            # Copied right away, as it is a view of a reused buffer
+            data = bytes(data)
+        if (job, stream) not in gathered:
+            # Gathered output is timed by when its first part arrived
+            gathered[job, stream] = [
+                None if timeline is None else _monotonic_ns()]
+        gathered[job, stream].append(data)
+
+    def release(job=None):
+        # Yields the gathered output, of only the given job if any
+        for key in [key for key in gathered if job in (None, key[0])]:
+            time_ns, *parts = gathered.pop(key)
+            yield key[0].event(
+                key[1], parts[0][:0].join(parts), timeline, time_ns)
+
+    def read_streams(keys):
+        # Read from each given ready stream once, unregistering it on EOF
+        for key in keys:
+            job, stream = key.data
+            if stream is None:
+                # The pidfd is readable once the subprocess has exited, and
+                # stays readable, so it is only needed until then
+                selector.unregister(key.fileobj)
+                job.exited = True
                 continue
-            # Otherwise Unix
-            try:
-                rlist, wlist, xlist = select.select(fds, [], [])
-            except select.error as exc:
-                # Ignore EINTR
-                try:
-                    errnum = exc.errno
-                except AttributeError:
-                    errnum = exc[0]
-                if errnum == errno.EINTR:
-                    continue
-                raise
-            for stream in rlist:
-                left_over = left_overs[stream]
-                fileno = getattr(stream, 'fileno', lambda: stream)()
-                try:
-                    incoming = os.read(fileno, 1024)
-                except OSError as exc:
-                    # On Linux, when using a pty, in order to get select
-                    # to return when the subprocess finishes, os.close
-                    # must be called on the slave pty fd after forking
-                    # the subprocess with popen. On some versions of
-                    # the Linux kernel this causes an Errno 5 OSError,
-                    # "Input/output error". Therefore, I am explicitly
-                    # catching and passing on this error. In my testing
-                    # this error does not occur repeatedly (it does not
-                    # become a busy wait). See:
-                    #   http://stackoverflow.com/a/12207447/671658
-                    if _is_linux and "Input/output error" in "{0}".format(exc):
-                        continue
-                    raise
-                if not incoming:
-                    # In this case, EOF has been reached, see docs for os.read
-                    if left_over:
-                        yield yield_to_stream(left_over, stream)
-                    continue
-                data, left_over = _process_incoming_lines(incoming, left_over)
-                left_overs[stream] = left_over
-                yield yield_to_stream(data, stream)
-        # Done
-        yield None, None, p.returncode
+            if stream is job.p.stdin:
+                # stdin can take more input
+                if job.write_input():
+                    selector.unregister(key.fileobj)
+                    job.close_input()
+                continue
+            incoming = job.read(stream, key.fd)
+            ready = job.search_ready(stream, incoming)
+            if not incoming:
+                # In this case, EOF has been reached, see docs for os.read
+                selector.unregister(key.fileobj)
+                job.open_streams.discard(stream)
+                data = job.flush(stream)
+            else:
+                data = job.feed(stream, incoming)
+            if data:
+                yield from output(job, stream, data)
+            if ready:
+                # Lets the consumer know right away, after the complete
+                # lines of this read but without any other output, as what
+                # matched may not be a complete line yet
+                yield job.index, None, None, None
+
+    def finish(job):
+        # The subprocess has exited, drain whatever it wrote before exiting
+        # without waiting on pipes which may be held open by its children
+        while job.open_streams:
+            keys = [
+                key for key, _ in selector.select(0)
+                if key.data[0] is job and key.data[1] in job.open_streams]
+            if not keys:
+                break
+            yield from read_streams(keys)
+        if job.pidfd is not None and not job.exited:
+            selector.unregister(job.pidfd)
+        if job.input is not None:
+            # The subprocess exited without reading all of its input
+            selector.unregister(job.p.stdin)
+            job.close_input()
+        for stream in list(job.open_streams):
+            selector.unregister(stream)
+            data = job.flush(stream)
+            if data:
+                yield from output(job, stream, data)
+        job.open_streams.clear()
+        yield from release(job)
+        running.remove(job)
+        job.close()
+        yield job.index, None, None, job.returncode()
+
+    try:
+        while True:
+            while max_parallel is None or len(running) < max_parallel:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                running.append(job)
+                for stream in job.fds:
+                    selector.register(
+                        stream, selectors.EVENT_READ, (job, stream))
+                if job.open_pidfd():
+                    selector.register(
+                        job.pidfd, selectors.EVENT_READ, (job, None))
+                if job.input is not None:
+                    os.set_blocking(job.p.stdin.fileno(), False)
+                    selector.register(
+                        job.p.stdin, selectors.EVENT_WRITE,
+                        (job, job.p.stdin))
+            if not running:
+                break
+            # Block until there is output, an exit or the next deadline, and
+            # poll for the exit of any subprocess which has closed all of its
+            # streams, without a pidfd or, for a pipeline, after the last
+            # command has exited
+            now = time.monotonic()
+            deadlines = [job.check_deadlines(now) for job in running]
+            deadlines += [job.sample_resources(now) for job in running]
+            deadlines = [d for d in deadlines if d is not None]
+            timeout = max(min(deadlines) - now, 0) if deadlines else None
+            if any(
+                (job.pidfd is None or job.exited) and not job.open_streams
+                for job in running
+            ):
+                timeout = _exit_poll_interval if timeout is None else \
+                    min(timeout, _exit_poll_interval)
+            if window_end is not None:
+                timeout = max(window_end - now, 0) if timeout is None else \
+                    min(timeout, max(window_end - now, 0))
+            yield from read_streams(key for key, _ in selector.select(timeout))
+            if gathered:
+                now = time.monotonic()
+                if window_end is None:
+                    window_end = now + window
+                if now >= window_end:
+                    yield from release()
+            for job in list(running):
+                # With a pidfd, the subprocess is only reaped once it exited
+                if job.pidfd is None or job.exited:
+                    if job.poll() is not None:
+                        yield from finish(job)
+            if not gathered:
+                window_end = None
     finally:
-        # Make sure we don't leak file descriptors
-        _close_fds(fds_to_close)
+        selector.close()
+        # If the generator was closed early, e.g. the consumer stopped
+        # iterating, the remaining subprocesses are stopped
+        for job in running:
+            job.cancel()
+
 
+def _yield_job_data(job, coalesce_ms=None, timeline=None):
+    for _, out, err, ret in _multiplex_data(
+        [job], coalesce_ms=coalesce_ms, timeline=timeline
+    ):
+        yield out, err, ret
 
-def _execute_process_nopty(cmd, cwd, env, shell, stderr_to_stdout=True):
+
+def _yield_data(
+    p, fds, fds_to_close=None, coalesce_ms=None, timeline=None, **kwargs
+):
+    # This function returns a generator which collects output from a single
+    # subprocess until it has finished, yielding (stdout, stderr, returncode)
+    # tuples as it goes.
+    # Closing the generator early stops the subprocess, but if it was never
+    # started its cleanup never runs, so the subprocess is also stopped when
+    # the generator is garbage collected.
+    job = _Job(0, p, fds, fds_to_close, **kwargs)
+    generator = _yield_job_data(job, coalesce_ms, timeline)
+    weakref.finalize(generator, job.cancel)
+    return generator
+
+
+class _Pipeline(object):
+    # Stands in for the subprocess.Popen of a single command, for a pipeline
+    # of commands, which is only done once all of them have exited
+
+    def __init__(self, processes, stdout=None, stderr=None, pgid=None):
+        self.processes = processes
+        self.stdin = processes[0].stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        # The exit of the last command is waited for with its pidfd
+        self.pid = processes[-1].pid
+        self.pgid = pgid
+        self.returncodes = None
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            returncodes = [p.poll() for p in self.processes]
+            if None not in returncodes:
+                self.returncodes = returncodes
+                self.returncode = _pipefail(returncodes)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if timeout is not None:
+            end = time.monotonic() + timeout
+        for p in self.processes:
+            p.wait(None if timeout is None else max(end - time.monotonic(), 0))
+        return self.poll()
+
+    def terminate(self):
+        for p in self.processes:
+            if p.poll() is None:
+                p.terminate()
+
+    def kill(self):
+        for p in self.processes:
+            if p.poll() is None:
+                p.kill()
+
+
+def _pipefail(returncodes):
+    # The last return code which is not zero, or zero if they all are
+    return next((rc for rc in reversed(returncodes) if rc), 0)
+
+
+def _process_group_kwargs(new_process_group, pgid=None):
+    # Returns the keyword arguments for subprocess.Popen which start the
+    # subprocess in a new process group, or in the one of pgid if given,
+    # within the session of this process, like a shell does for a job
+    if not new_process_group or _is_windows:
+        return {}
+    if sys.version_info >= (3, 11):
+        return {'process_group': pgid or 0}
+    return {'preexec_fn': functools.partial(os.setpgid, 0, pgid or 0)}
+
+
+def _popen_stages(
+    cmds, cwd, env, shell, stdin, stdout, stderr, new_process_group=False
+):
+    # Starts each command with its stdout connected to the stdin of the next
+    # one by an OS pipe, so the data between them never passes through this
+    # process, returning the started subprocesses and their process group
+    processes = []
+    pgid = None
+    try:
+        for i, cmd in enumerate(cmds):
+            # The first command starts a new process group, which is joined
+            # by the others
+            last = i == len(cmds) - 1
+            processes.append(Popen(
+                cmd, stdin=stdin, stdout=stdout if last else PIPE,
+                stderr=stderr, cwd=cwd, env=env, shell=shell,
+                close_fds=False,
+                **_process_group_kwargs(new_process_group, pgid)))
+            if new_process_group and pgid is None:
+                pgid = processes[0].pid
+            if i:
+                # Only the commands on either end need the pipe between them
+                stdin.close()
+            stdin = processes[-1].stdout
+    except BaseException:
+        for p in processes:
+            if p.stdout is not None:
+                p.stdout.close()
+            p.kill()
+            p.wait()
+        raise
+    return processes, pgid
+
+
+def _popen_nopty(
+    cmd, cwd, env, shell, stderr_to_stdout=True, new_process_group=False,
+    stdin=None
+):
     stderr = STDOUT if stderr_to_stdout else PIPE
-    with Popen(
-        cmd, stdin=PIPE, stdout=PIPE, stderr=stderr,
-        cwd=cwd, env=env, shell=shell, close_fds=False
-    ) as p:
-        # Left over data from read which isn't a complete line yet
-        left_overs = {p.stdout: b'', p.stderr: b''}
+    return Popen(
+        cmd, stdin=PIPE if stdin is None else stdin, stdout=PIPE,
+        stderr=stderr,
+        cwd=cwd, env=env, shell=shell, close_fds=False,
+        **_process_group_kwargs(new_process_group))
+
 
+def _start_job_nopty(
+    index, cmd, cwd, env, shell, stderr_to_stdout=True,
+    new_process_group=False, stdin=None, **kwargs
+):
+    p = _popen_nopty(
+        cmd, cwd, env, shell, stderr_to_stdout, new_process_group, stdin)
+    fds = list(filter(None, [p.stdout, p.stderr]))
+    return _Job(index, p, fds, new_process_group=new_process_group, **kwargs)
+
+
+def _execute_pipeline_nopty(
+    cmds, cwd, env, shell, stderr_to_stdout=True, new_process_group=False,
+    stdin=None, **kwargs
+):
+    if kwargs.get('input') is not None:
+        stdin = PIPE
+    # The output of the last command, and stderr of all of them, go to
+    # pipes like the ones subprocess.Popen would create for a single command
+    fds = []
+    try:
+        stdout_r, stdout_w = os.pipe()
+        fds += [stdout_r, stdout_w]
+        stderr_r, stderr_w = stdout_r, stdout_w
+        if not stderr_to_stdout:
+            stderr_r, stderr_w = os.pipe()
+            fds += [stderr_r, stderr_w]
+        processes, pgid = _popen_stages(
+            cmds, cwd, env, shell, PIPE if stdin is None else stdin,
+            stdout_w, stderr_w, new_process_group)
+    except BaseException:
+        _close_fds(fds)
+        raise
+    _close_fds({stdout_w, stderr_w})
+    p = _Pipeline(
+        processes, open(stdout_r, 'rb'),
+        None if stderr_to_stdout else open(stderr_r, 'rb'), pgid)
+    fds = list(filter(None, [p.stdout, p.stderr]))
+    return _yield_data(
+        p, fds, new_process_group=new_process_group, **kwargs)
+
+
+def _execute_process_nopty(
+    cmd, cwd, env, shell, stderr_to_stdout=True, new_process_group=False,
+    stdin=None, **kwargs
+):
+    if kwargs.get('input') is not None:
+        stdin = PIPE
+    with _popen_nopty(
+        cmd, cwd, env, shell, stderr_to_stdout, new_process_group, stdin
+    ) as p:
         fds = list(filter(None, [p.stdout, p.stderr]))
 
-        yield from _yield_data(p, fds, left_overs, os.linesep)
+        yield from _yield_data(
+            p, fds, new_process_group=new_process_group, **kwargs)
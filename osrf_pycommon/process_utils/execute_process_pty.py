@@ -14,40 +14,54 @@
 
 import os
 
-try:
-    import pty
-except ImportError:
-    # to support --cover-inclusive on Windows
-    if os.name not in ['nt']:
-        raise
-
+from subprocess import PIPE
 from subprocess import Popen
-from subprocess import STDOUT
 
 import time
 
 from .execute_process_nopty import _close_fds
+from .execute_process_nopty import _execute_pipeline_nopty
+from .execute_process_nopty import _execute_process_nopty
+from .execute_process_nopty import _Job
+from .execute_process_nopty import _Pipeline
+from .execute_process_nopty import _popen_stages
+from .execute_process_nopty import _process_group_kwargs
+from .execute_process_nopty import _start_job_nopty
 from .execute_process_nopty import _yield_data
+from .pty_manager import get_pty_manager
 
 
-def _execute_process_pty(cmd, cwd, env, shell, stderr_to_stdout=True):
-    stdout_master, stdout_slave = None, None
-    stderr_master, stderr_slave = None, None
-    fds_to_close = [stdout_master, stdout_slave, stderr_master, stderr_slave]
-    try:
-        stdout_master, stdout_slave = pty.openpty()
-        if stderr_to_stdout:
-            stderr_master, stderr_slave = stdout_master, stdout_slave
-        else:
-            stderr_master, stderr_slave = pty.openpty()
+def _open_ptys(stderr_to_stdout=True):
+    # Returns the pty's for a subprocess, or None if pipes are to be used
+    # instead, see PtyManager
+    return get_pty_manager().open_ptys(1 if stderr_to_stdout else 2)
+
+
+def _pty_pairs(ptys):
+    # Returns the master and slave for stdout, and for stderr
+    stdout_master, stdout_slave = ptys.pairs[0]
+    stderr_master, stderr_slave = ptys.pairs[-1]
+    return stdout_master, stdout_slave, stderr_master, stderr_slave
 
+
+def _popen_pty(
+    cmd, cwd, env, shell, stderr_to_stdout=True, new_process_group=False,
+    stdin=None, ptys=None
+):
+    # Returns the subprocess, the pty masters to read from, and the fds
+    # which should be closed once the subprocess is done
+    stdout_master, stdout_slave, stderr_master, stderr_slave = \
+        _pty_pairs(ptys)
+    try:
         p = None
         while p is None:
             try:
                 p = Popen(
                     cmd,
-                    stdin=stdout_slave, stdout=stderr_slave, stderr=STDOUT,
-                    cwd=cwd, env=env, shell=shell, close_fds=False)
+                    stdin=stdout_slave if stdin is None else stdin,
+                    stdout=stdout_slave, stderr=stderr_slave,
+                    cwd=cwd, env=env, shell=shell, close_fds=False,
+                    **_process_group_kwargs(new_process_group))
             except OSError as exc:
                 # This can happen if a file you are trying to execute is being
                 # written to simultaneously on Linux
@@ -60,22 +74,93 @@ def _execute_process_pty(cmd, cwd, env, shell, stderr_to_stdout=True):
                     time.sleep(0.01)
                     continue
                 raise
-        # This causes the below select to exit when the subprocess closes.
-        # On Linux, this sometimes causes Errno 5 OSError's when os.read
-        # is called from within _yield_data, so on Linux _yield_data
-        # catches and passes on that particular OSError.
-        os.close(stdout_slave)
-        if not stderr_to_stdout:
-            os.close(stderr_slave)
-
-        left_overs = {stdout_master: b'', stderr_master: b''}
-
-        fds = [stdout_master]
-        if stderr_master != stdout_master:
-            fds.append(stderr_master)
-    finally:
+    except BaseException:
+        # Make sure we don't leak file descriptors
+        _close_fds({
+            stdout_master, stdout_slave, stderr_master, stderr_slave})
+        ptys.release()
+        raise
+    # This causes the select on the masters to return when the subprocess
+    # closes. On Linux, this sometimes causes Errno 5 OSError's when os.read
+    # is called from within _yield_data, so on Linux _yield_data
+    # treats that particular OSError as EOF.
+    os.close(stdout_slave)
+    if not stderr_to_stdout:
+        os.close(stderr_slave)
+
+    fds = [stdout_master]
+    if stderr_master != stdout_master:
+        fds.append(stderr_master)
+    return p, fds, list(fds)
+
+
+def _start_job_pty(
+    index, cmd, cwd, env, shell, stderr_to_stdout=True,
+    new_process_group=False, stdin=None, **kwargs
+):
+    ptys = _open_ptys(stderr_to_stdout)
+    if ptys is None:
+        return _start_job_nopty(
+            index, cmd, cwd, env, shell, stderr_to_stdout, new_process_group,
+            stdin, **kwargs)
+    p, fds, fds_to_close = _popen_pty(
+        cmd, cwd, env, shell, stderr_to_stdout, new_process_group, stdin,
+        ptys)
+    return _Job(
+        index, p, fds, fds_to_close, new_process_group=new_process_group,
+        ptys=ptys, **kwargs)
+
+
+def _execute_process_pty(
+    cmd, cwd, env, shell, stderr_to_stdout=True, new_process_group=False,
+    stdin=None, **kwargs
+):
+    ptys = _open_ptys(stderr_to_stdout)
+    if ptys is None:
+        return _execute_process_nopty(
+            cmd, cwd, env, shell, stderr_to_stdout, new_process_group, stdin,
+            **kwargs)
+    if kwargs.get('input') is not None:
+        stdin = PIPE
+    p, fds, fds_to_close = _popen_pty(
+        cmd, cwd, env, shell, stderr_to_stdout, new_process_group, stdin,
+        ptys)
+    return _yield_data(
+        p, fds, fds_to_close, new_process_group=new_process_group,
+        ptys=ptys, **kwargs)
+
+
+def _execute_pipeline_pty(
+    cmds, cwd, env, shell, stderr_to_stdout=True, new_process_group=False,
+    stdin=None, **kwargs
+):
+    ptys = _open_ptys(stderr_to_stdout)
+    if ptys is None:
+        return _execute_pipeline_nopty(
+            cmds, cwd, env, shell, stderr_to_stdout, new_process_group, stdin,
+            **kwargs)
+    if kwargs.get('input') is not None:
+        stdin = PIPE
+    stdout_master, stdout_slave, stderr_master, stderr_slave = \
+        _pty_pairs(ptys)
+    try:
+        processes, pgid = _popen_stages(
+            cmds, cwd, env, shell, stdout_slave if stdin is None else stdin,
+            stdout_slave, stderr_slave, new_process_group)
+    except BaseException:
         # Make sure we don't leak file descriptors
-        _close_fds(fds_to_close)
+        _close_fds({
+            stdout_master, stdout_slave, stderr_master, stderr_slave})
+        ptys.release()
+        raise
+    # See _popen_pty
+    os.close(stdout_slave)
+    if not stderr_to_stdout:
+        os.close(stderr_slave)
 
-    # The linesep with pty's always seems to be "\r\n", even on OS X
-    return _yield_data(p, fds, left_overs, "\r\n", fds_to_close)
+    fds = [stdout_master]
+    if stderr_master != stdout_master:
+        fds.append(stderr_master)
+    return _yield_data(
+        _Pipeline(processes, pgid=pgid), fds, list(fds),
+        new_process_group=new_process_group, ptys=ptys, **kwargs)
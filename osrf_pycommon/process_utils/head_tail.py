@@ -0,0 +1,84 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import re
+
+# Lines end in \n, \r or \r\n only, unlike with str.splitlines, and the last
+# one may be missing its line ending
+_line = br'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+'
+_split_bytes = re.compile(_line).findall
+_split_str = re.compile(_line.decode()).findall
+
+
+class HeadTailCapture(object):
+    """Keeps the first and last lines of output, eliding the middle.
+
+    The first ``head`` lines are kept in the ``head`` list, and the last
+    ``tail`` lines in the ``tail`` :py:class:`collections.deque`, which has
+    a ``maxlen`` of ``tail``, so lines in between are dropped as the output
+    grows.
+    The number of lines, and bytes, which were dropped are counted in
+    ``elided_lines`` and ``elided_bytes``, where the latter counts
+    characters when the output is decoded.
+    The memory used is therefore bounded by the number of lines kept, and
+    their length, however long the output is.
+
+    Lines are split after each ``\\n``, ``\\r`` or ``\\r\\n`` only, the same
+    for ``bytes`` and decoded ``str`` output, and keep their line endings,
+    so data given to :py:meth:`add` should be complete lines, as yielded by
+    :py:func:`osrf_pycommon.process_utils.execute_process`, or passed on by
+    a line buffered
+    :py:class:`osrf_pycommon.process_utils.AsyncSubprocessProtocol`.
+
+    :param int head: number of lines to keep from the start of the output
+    :param int tail: number of lines to keep from the end of the output
+    :raises: ValueError if ``head`` or ``tail`` are negative
+    """
+
+    def __init__(self, head=10, tail=10):
+        for name, value in [('head', head), ('tail', tail)]:
+            if value < 0:
+                raise ValueError(
+                    "{0} must not be negative, got '{1}'".format(name, value))
+        self._head_lines = head
+        self.head = []
+        self.tail = collections.deque(maxlen=tail)
+        self.elided_lines = 0
+        self.elided_bytes = 0
+
+    def add(self, data):
+        """Adds one or more lines of output.
+
+        :param data: lines of output, as ``bytes`` or decoded ``str``
+        """
+        if isinstance(data, str):
+            lines = _split_str(data)
+        else:
+            lines = _split_bytes(data)
+        room = self._head_lines - len(self.head)
+        if room > 0:
+            self.head.extend(lines[:room])
+            lines = lines[room:]
+        if not lines:
+            return
+        # Lines which do not fit in the tail, oldest first, are elided
+        keep = min(len(lines), self.tail.maxlen)
+        dropped = lines[:len(lines) - keep]
+        for _ in range(len(self.tail) + keep - self.tail.maxlen):
+            dropped.append(self.tail.popleft())
+        self.elided_lines += len(dropped)
+        self.elided_bytes += sum(len(line) for line in dropped)
+        if keep:
+            self.tail.extend(lines[-keep:])
@@ -12,23 +12,53 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import functools
 import os
 import sys
+import threading
+import weakref
 
+from .execute_process_nopty import _check_options
+from .execute_process_nopty import _execute_pipeline_nopty
 from .execute_process_nopty import _execute_process_nopty
+from .execute_process_nopty import _multiplex_data
+from .execute_process_nopty import _options
+from .execute_process_nopty import _start_job_nopty
+from .head_tail import HeadTailCapture
+from .readiness import _ReadinessWatch
+from .readiness import NotReadyError
 try:
+    from .execute_process_pty import _execute_pipeline_pty
     from .execute_process_pty import _execute_process_pty
+    from .execute_process_pty import _start_job_pty
 except ImportError:
     # pty doesn't work on Windows, it will fail to import
     # so fallback to non pty implementation
+    _execute_pipeline_pty = None
     _execute_process_pty = None
+    _start_job_pty = None
 
+# execute_processes can not write input to, or mirror the output of, all of
+# its commands
+_parallel_options = set(_options) - {'input', 'mirror'}
 
-def execute_process(cmd, cwd=None, env=None, shell=False, emulate_tty=False):
+# execute_process_head_tail keeps lines, as they are split by
+# HeadTailCapture, until the subprocess has finished
+_head_tail_options = set(_options) - {'mode', 'reuse_buffer', 'delimiter'}
+
+# wait_for_output keeps the output read until the subprocess is ready, and
+# its timeout is the one of the readiness
+_wait_options = set(_options) - {'reuse_buffer', 'timeout'}
+
+
+def execute_process(
+    cmd, cwd=None, env=None, shell=False, emulate_tty=False, **options
+):
     """Executes a command with arguments and returns output line by line.
 
-    All arguments, except ``emulate_tty``, are passed directly to
-    :py:class:`subprocess.Popen`.
+    All arguments, except ``emulate_tty`` and the output ``options``, are
+    passed directly to :py:class:`subprocess.Popen`.
 
     ``execute_process`` returns a generator which yields the output, line by
     line, until the subprocess finishes at which point the return code
@@ -68,39 +98,17 @@ def execute_process(cmd, cwd=None, env=None, shell=False, emulate_tty=False):
 
     ``emulate_tty`` works by using psuedo-terminals on Unix machines, and so
     if you are running this command many times in parallel (like hundreds
-    of times) then you may get one of a few different :py:exc:`OSError`'s.
-    For example, "OSError: [Errno 24] Too many open files: '/dev/ttyp0'" or
+    of times) then you may run out of them, e.g. with
     "OSError: out of pty devices".
     You should also be aware that you share pty devices with the rest of the
-    system, so even if you are not using a lot, it is possible to get
-    this error.
-    You can catch this error before getting data from the generator, so when
-    using ``emulate_tty`` you might want to do something like this:
-
-    .. code-block:: python
-
-        from __future__ import print_function
-        from osrf_pycommon.process_utils import execute_process
-
-        cmd = ['ls', '-G', '/usr']
-        try:
-            output = execute_process(cmd, emulate_tty=True)
-        except OSError:
-            output = execute_process(cmd, emulate_tty=False)
-        for line in output:
-            if isinstance(line, int):
-                print("'{0}' exited with: {1}".format(' '.join(cmd), line))
-                continue
-            # In Python 3, it will be a bytes array which needs to be decoded
-            if not isinstance(line, str):
-                line = line.decode('utf-8')
-            print(line, end='')
-
-    This way if a pty cannot be opened in order to emulate the tty then you
-    can try again without emulation, and any other :py:exc:`OSError` should
-    raise again with ``emulate_tty`` set to ``False``.
-    Obviously, you only want to do this if emulating the tty is non-critical
-    to your processing, like when you are using it to capture color.
+    system, so even if you are not using a lot, it is possible to run out.
+    When the pty's can not be opened, or when more than the maximum set in
+    the :py:class:`osrf_pycommon.process_utils.PtyManager` returned by
+    :py:func:`osrf_pycommon.process_utils.get_pty_manager` would be in use
+    at once, the command is run with pipes instead, as if ``emulate_tty``
+    was False, and the manager counts how often this happened.
+    So emulating the tty should be non-critical to your processing, like
+    when you are using it to capture color.
 
     Any color information that the command outputs as ANSI escape sequences
     is captured by this command.
@@ -119,12 +127,28 @@ def execute_process(cmd, cwd=None, env=None, shell=False, emulate_tty=False):
 
     :py:func:`osrf_pycommon.terminal_color.remove_ansi_escape_sequences`
 
+    How the output is read, split, filtered and decoded, and when the
+    subprocess is stopped, can be changed with keyword ``options``, which
+    are shared by the other synchronous functions of this module and are
+    described in `Output Options`_.
+    The final return code is an
+    :py:class:`osrf_pycommon.process_utils.ReturnCode`, with the reason the
+    subprocess ended and a :py:class:`osrf_pycommon.process_utils.RunResult`
+    of its timings and output counts.
+
+    If the generator is closed before the subprocess has finished, e.g. by
+    breaking out of a ``for`` loop over it and then calling ``close()`` on it
+    or letting it be garbage collected, then the subprocess is stopped,
+    waiting at most ``kill_timeout`` seconds before killing it, and then it
+    is reaped and all of its file descriptors are closed.
+
     Exceptions can be raised by functions called by the implementation,
     for example, :py:class:`subprocess.Popen` can raise an :py:exc:`OSError`
     when the given command is not found.
     If you want to check for the existence of an executable on the path,
     see: :py:func:`which`.
-    However, this function itself does not raise any special exceptions.
+    However, this function itself does not raise any special exceptions,
+    other than for invalid ``options``.
 
     :param list cmd: list of strings with the first item being a command
         and subsequent items being any arguments to that command;
@@ -143,13 +167,22 @@ def execute_process(cmd, cwd=None, env=None, shell=False, emulate_tty=False):
         useful for capturing colorized output from commands. This does not
         work on Windows (no pty's), so it is considered False even when True.
         Defaults to False.
+    :param options: keyword arguments for the output options, see
+        `Output Options`_
     :returns: a generator which yields output from the command line by line
     :rtype: generator which yields strings
+    :raises: TypeError if an option is unknown
+    :raises: ValueError if any of the options are invalid, or conflict
+    :raises: LookupError if ``encoding`` or ``errors`` are unknown
+    :raises: :py:exc:`re.error` if ``include`` or ``exclude`` are invalid
     """
+    _check_options(options)
     exp_func = _execute_process_nopty
     if emulate_tty and _execute_process_pty is not None:
         exp_func = _execute_process_pty
-    for out, err, ret in exp_func(cmd, cwd, env, shell, stderr_to_stdout=True):
+    for out, err, ret in exp_func(
+        cmd, cwd, env, shell, stderr_to_stdout=True, **options
+    ):
         if ret is None:
             yield out
             continue
@@ -157,7 +190,7 @@ def execute_process(cmd, cwd=None, env=None, shell=False, emulate_tty=False):
 
 
 def execute_process_split(
-    cmd, cwd=None, env=None, shell=False, emulate_tty=False
+    cmd, cwd=None, env=None, shell=False, emulate_tty=False, **options
 ):
     """:py:func:`execute_process`, except ``stderr`` is returned separately.
 
@@ -201,13 +234,541 @@ def execute_process_split(
     For situations where output ordering between ``stdout`` and ``stderr`` are
     critical, they should not be returned separately and instead should share
     one buffer, and so :py:func:`execute_process` should be used.
+    Otherwise, the order in which the output was read, and when, is recorded
+    in the ``timeline``, if one is given.
+    With ``coalesce_ms``, the ``stdout`` and ``stderr`` gathered at the same
+    time are yielded one after the other, so their relative order is lost.
 
     For all other parameters and documentation see: :py:func:`execute_process`
     """
+    _check_options(options)
     exp_func = _execute_process_nopty
     if emulate_tty and _execute_process_pty is not None:
         exp_func = _execute_process_pty
-    return exp_func(cmd, cwd, env, shell, stderr_to_stdout=False)
+    return exp_func(
+        cmd, cwd, env, shell, stderr_to_stdout=False, **options)
+
+
+def execute_processes(
+    cmds, max_parallel=None, cwd=None, env=None, shell=False,
+    emulate_tty=False, stderr_to_stdout=False, **options
+):
+    """Executes several commands in parallel, multiplexing their output.
+
+    All of the subprocesses are serviced by a single selector loop in the
+    calling thread, so no thread is needed per command.
+    At most ``max_parallel`` subprocesses are running at any one time, and
+    the remaining commands are started, in order, as running ones finish.
+
+    The returned generator yields ``(job_index, stdout, stderr, returncode)``
+    tuples as output arrives, where ``job_index`` is the index of the command
+    in ``cmds`` and the other three items are as for
+    :py:func:`execute_process_split`.
+    Once a non-None return code is yielded for a ``job_index`` there will be
+    no more output for it.
+
+    .. code-block:: python
+
+        from __future__ import print_function
+        from osrf_pycommon.process_utils import execute_processes
+
+        cmds = [['ls', '/usr'], ['ls', '/opt']]
+        for index, out, err, ret in execute_processes(cmds, max_parallel=2):
+            if ret is not None:
+                print("{0} exited with: {1}".format(cmds[index], ret))
+                continue
+            print(index, (out or err).decode('utf-8'), end='')
+
+    On Windows the commands are run one after another, see
+    :py:func:`execute_process` for details on the lack of streaming there.
+
+    A ``rate_limit`` is shared by all of the commands, so it limits the rate
+    of their combined output, while their suppressed lines are summarized
+    separately.
+    The ``on_resource_sample`` callback is called with the ``job_index`` of
+    each running command and a sample of its resource use, i.e.
+    ``on_resource_sample(job_index, sample)``.
+    All of the output options apply to each command, except ``input`` and
+    ``mirror``, which can not be used.
+
+    :param list cmds: list of commands, each like the ``cmd`` parameter of
+        :py:func:`execute_process`
+    :param int max_parallel: maximum number of subprocesses running at once,
+        defaults to None which means all of them are started immediately
+    :param bool stderr_to_stdout: if True, stderr is directed to stdout, so
+        they are not captured separately, defaults to False
+    :returns: a generator which yields output from all commands as it arrives
+    :rtype: generator which yields tuples
+    :raises: ValueError if ``max_parallel`` is less than 1, or if any of the
+        output options or timeouts are invalid
+
+    For all other parameters and documentation see: :py:func:`execute_process`
+    """
+    if max_parallel is not None and max_parallel < 1:
+        raise ValueError(
+            "max_parallel must be at least 1, got '{0}'".format(max_parallel))
+    _check_options(options, _parallel_options)
+    start_job = _start_job_nopty
+    if emulate_tty and _start_job_pty is not None:
+        start_job = _start_job_pty
+    # The output of all of the jobs is gathered and recorded together
+    coalesce_ms = options.pop('coalesce_ms', None)
+    timeline = options.pop('timeline', None)
+    on_resource_sample = options.pop('on_resource_sample', None)
+    jobs = (
+        start_job(
+            index, cmd, cwd, env, shell, stderr_to_stdout,
+            on_resource_sample=None if on_resource_sample is None else
+            functools.partial(on_resource_sample, index),
+            **options)
+        for index, cmd in enumerate(cmds))
+    return _multiplex_data(jobs, max_parallel, coalesce_ms, timeline)
+
+
+def execute_pipeline(
+    cmds, cwd=None, env=None, shell=False, emulate_tty=False,
+    stderr_to_stdout=True, **options
+):
+    """Executes a pipeline of commands, like ``cmd1 | cmd2 | cmd3``.
+
+    The ``stdout`` of each command is connected directly to the ``stdin`` of
+    the next one with an OS pipe, so, unlike running the pipeline with
+    ``shell=True``, no shell is needed and the data passed between the
+    commands never goes through Python.
+    Only the output of the last command is read, along with ``stderr`` of
+    all of the commands, and it is yielded in the same way as by
+    :py:func:`execute_process_split`, as ``(stdout, stderr, returncode)``
+    triplets, unless ``stderr_to_stdout`` is True, which it is by default,
+    in which case ``stderr`` is always None.
+    Any ``input`` or ``stdin`` is given to the first command.
+
+    The pipeline has finished once all of its commands have exited, and
+    then the return code is yielded as a
+    :py:class:`osrf_pycommon.process_utils.ReturnCode`, whose
+    ``returncodes`` attribute is the list of the return codes of each
+    command, and whose value is the last of them which is not zero, like
+    with ``set -o pipefail`` in bash:
+
+    .. code-block:: python
+
+        from osrf_pycommon.process_utils import execute_pipeline
+
+        cmds = [['find', '/usr/include'], ['grep', 'stdio'], ['sort']]
+        for out, err, ret in execute_pipeline(cmds):
+            if ret is not None:
+                print('return codes:', ret.returncodes)
+                break
+            print(out.decode(), end='')
+
+    If ``new_process_group`` is True, all of the commands are started in
+    one new process group, so a timeout stops all of them.
+
+    :param list cmds: list of commands, each like the ``cmd`` parameter of
+        :py:func:`execute_process`
+    :param bool stderr_to_stdout: if True, stderr is directed to stdout, so
+        they are not captured separately, defaults to True
+    :returns: a generator which yields output from the last command
+    :rtype: generator which yields tuples
+    :raises: ValueError if ``cmds`` is empty, or if any of the options are
+        invalid
+
+    For all other parameters and documentation see: :py:func:`execute_process`
+    """
+    if not cmds:
+        raise ValueError("cmds must contain at least one command")
+    _check_options(options)
+    exp_func = _execute_pipeline_nopty
+    if emulate_tty and _execute_pipeline_pty is not None:
+        exp_func = _execute_pipeline_pty
+    return exp_func(
+        cmds, cwd, env, shell, stderr_to_stdout=stderr_to_stdout,
+        **options)
+
+
+SpoolResult = collections.namedtuple('SpoolResult', [
+    'returncode', 'stdout_bytes', 'stdout_lines', 'stderr_bytes',
+    'stderr_lines'])
+
+
+class _Spool(object):
+    # Collects output for a file descriptor and writes it in large blocks
+
+    def __init__(self, fd, buffer_size):
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.bytes = 0
+        self.lines = 0
+        self.ends_with_newline = True
+
+    def write(self, data):
+        start = len(self.buffer)
+        self.buffer += data
+        self.bytes += len(self.buffer) - start
+        self.lines += self.buffer.count(b'\n', start)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.ends_with_newline = self.buffer.endswith(b'\n')
+        with memoryview(self.buffer) as view:
+            written = 0
+            while written < len(view):
+                written += os.write(self.fd, view[written:])
+        del self.buffer[:]
+
+    @property
+    def total_lines(self):
+        # A last line without a new line still counts
+        return self.lines + (0 if self.ends_with_newline else 1)
+
+
+def execute_process_to_file(
+    cmd, path, stderr_path=None, cwd=None, env=None, shell=False,
+    emulate_tty=False, append=False, buffer_size=1024 * 1024
+):
+    """Executes a command and writes its output to a file.
+
+    Output is read from the subprocess in large chunks into a reused buffer
+    and written to the file in blocks of about ``buffer_size`` bytes, so
+    memory use stays flat however much output the command produces, and
+    there is not a write for every line.
+
+    If ``stderr_path`` is given, then ``stderr`` is written to that file
+    separately, otherwise it is combined with ``stdout`` in ``path``.
+
+    This function blocks until the command finishes and returns a
+    ``SpoolResult`` named tuple with the fields ``returncode``,
+    ``stdout_bytes``, ``stdout_lines``, ``stderr_bytes``, and
+    ``stderr_lines``, where the ``stderr_*`` fields are ``0`` when ``stderr``
+    is combined with ``stdout``.
+    A last line without a new line is included in the line counts.
+
+    .. code-block:: python
+
+        from osrf_pycommon.process_utils import execute_process_to_file
+
+        result = execute_process_to_file(['make'], '/tmp/build.log')
+        print("make exited with {0}, after writing {1} lines".format(
+            result.returncode, result.stdout_lines))
+
+    :param str path: path of the file to which output is written
+    :param str stderr_path: path of the file to which ``stderr`` is written,
+        defaults to None which means ``stderr`` is written to ``path``
+    :param bool append: if True, append to the files rather than truncating
+        them, defaults to False
+    :param int buffer_size: number of bytes collected before they are written
+        to a file, defaults to 1 MiB
+    :returns: the return code and the number of bytes and lines written
+    :rtype: SpoolResult
+
+    For all other parameters and documentation see: :py:func:`execute_process`
+    """
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+    flags |= getattr(os, 'O_BINARY', 0)
+    split = stderr_path is not None
+    fds = []
+    try:
+        fds.append(os.open(path, flags, 0o666))
+        stdout = stderr = _Spool(fds[-1], buffer_size)
+        if split:
+            fds.append(os.open(stderr_path, flags, 0o666))
+            stderr = _Spool(fds[-1], buffer_size)
+        exp_func = _execute_process_nopty
+        if emulate_tty and _execute_process_pty is not None:
+            exp_func = _execute_process_pty
+        for out, err, ret in exp_func(
+            cmd, cwd, env, shell, stderr_to_stdout=not split,
+            mode='chunks', reuse_buffer=True
+        ):
+            if out is not None:
+                stdout.write(out)
+            if err is not None:
+                stderr.write(err)
+            if ret is not None:
+                returncode = ret
+        stdout.flush()
+        stderr.flush()
+    finally:
+        for fd in fds:
+            os.close(fd)
+    if not split:
+        return SpoolResult(
+            returncode, stdout.bytes, stdout.total_lines, 0, 0)
+    return SpoolResult(
+        returncode, stdout.bytes, stdout.total_lines,
+        stderr.bytes, stderr.total_lines)
+
+
+HeadTailResult = collections.namedtuple('HeadTailResult', [
+    'returncode', 'head', 'tail', 'elided_lines', 'elided_bytes'])
+
+
+def execute_process_head_tail(
+    cmd, head=10, tail=10, cwd=None, env=None, shell=False,
+    emulate_tty=False, **options
+):
+    """Executes a command and keeps only the first and last lines of output.
+
+    The first ``head`` and the last ``tail`` lines of the combined ``stdout``
+    and ``stderr`` are kept, using a
+    :py:class:`osrf_pycommon.process_utils.head_tail.HeadTailCapture`, and
+    any lines in between are only counted, so the memory used does not grow
+    with the length of the output, e.g. when collecting the output of a
+    failed build for a report.
+    To also bound the memory used by a single long line, pass
+    ``max_line_bytes``.
+    All of the output options apply, see `Output Options`_, except
+    ``mode``, ``reuse_buffer`` and ``delimiter``, which can not be used,
+    so the output can, e.g., be filtered, normalized or decoded before the
+    first and last lines of it are kept.
+
+    This function blocks until the command finishes and returns a
+    ``HeadTailResult`` named tuple with the fields ``returncode``, ``head``
+    and ``tail``, which are lists of lines, and ``elided_lines`` and
+    ``elided_bytes``, which count the lines dropped between them, where
+    ``elided_bytes`` counts characters when the output is decoded.
+
+    .. code-block:: python
+
+        from osrf_pycommon.process_utils import execute_process_head_tail
+
+        result = execute_process_head_tail(['make'], head=5, tail=20)
+        if result.returncode:
+            report = b''.join(result.head)
+            if result.elided_lines:
+                report += '... {0} lines elided ...\\n'.format(
+                    result.elided_lines).encode()
+            report += b''.join(result.tail)
+
+    :param int head: number of lines to keep from the start of the output,
+        defaults to 10
+    :param int tail: number of lines to keep from the end of the output,
+        defaults to 10
+    :returns: the return code, the kept lines and the number elided
+    :rtype: HeadTailResult
+    :raises: TypeError if an option is unknown, or can not be used
+    :raises: ValueError if ``head`` or ``tail`` are negative, or if any of
+        the output options are invalid
+
+    For all other parameters and documentation see: :py:func:`execute_process`
+    """
+    capture = HeadTailCapture(head, tail)
+    _check_options(options, _head_tail_options)
+    for line in execute_process(
+        cmd, cwd, env, shell, emulate_tty, **options
+    ):
+        if isinstance(line, int):
+            returncode = line
+            continue
+        capture.add(line)
+    return HeadTailResult(
+        returncode, capture.head, list(capture.tail), capture.elided_lines,
+        capture.elided_bytes)
+
+
+class _ReadyOutput(object):
+    # Iterates over the lines read until the command was ready, and then
+    # over the rest of its output, and stops the command once closed, or
+    # garbage collected, also if it was never iterated, unlike a generator
+    # whose finally is only run once it was started
+
+    def __init__(self, lines, rest, stop):
+        self._lines = iter(lines)
+        self._rest = rest
+        self._stop = weakref.finalize(self, stop)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._stop.alive:
+            raise StopIteration
+        line = next(self._lines, None)
+        if line is not None:
+            return line
+        return next(self._rest)
+
+    def close(self):
+        """Stops the command, if it is still running."""
+        self._stop()
+
+
+class _Drain(object):
+    # Reads, and discards, the output of a command in a background thread,
+    # so it does not block on writing to a full pipe while its output is
+    # not iterated
+
+    def __init__(self, output, job):
+        self.output = output
+        self.job = job
+        self.returncode = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            for line in self.output:
+                if isinstance(line, int):
+                    self.returncode = line
+        except BaseException as exc:
+            self.error = exc
+        finally:
+            self.output.close()
+
+    def result(self):
+        # Waits for the command to exit and returns its return code
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.returncode
+
+    def stop(self, kill_timeout):
+        # Stops the command, if it is still running, in the same way as
+        # closing its output would, and waits for the thread to finish
+        if self.thread.is_alive() and kill_timeout:
+            self.job.terminate()
+            self.thread.join(kill_timeout)
+        if self.thread.is_alive():
+            self.job.kill()
+        self.thread.join()
+
+
+def _drained_result(drain):
+    # Yields the return code once the command has exited
+    yield drain.result()
+
+
+def wait_for_output(
+    cmd, pattern, timeout=None, cwd=None, env=None, shell=False,
+    emulate_tty=False, drain=False, **options
+):
+    """Executes a command and returns once its output matches a pattern.
+
+    This is meant for starting a server, or any other long running command,
+    and waiting until it is ready, e.g. until it prints a line like
+    ``Listening on port 8080``, without guessing how long to sleep for.
+    The output is searched as it is read, with :py:func:`re.search` and
+    :py:data:`re.MULTILINE`, for ``pattern``, which is a regular expression
+    as :py:class:`bytes`, or as :py:class:`str` which is encoded as UTF-8.
+    A match may be within an incomplete line, e.g. a prompt, but not span
+    more than one line.
+
+    Once there is a match, this function returns a tuple of an
+    :py:class:`osrf_pycommon.process_utils.OutputReady`, with the match and
+    the ``time_to_ready`` in seconds, and an iterator which yields the
+    output like :py:func:`execute_process`, from the start, including the
+    output which was already searched, and keeps the command running while
+    it is iterated:
+
+    .. code-block:: python
+
+        from osrf_pycommon.process_utils import wait_for_output
+
+        ready, output = wait_for_output(
+            ['my_server'], br'Listening on port (\\d+)', timeout=10)
+        print('ready after {0:.3f} seconds on port {1}'.format(
+            ready.time_to_ready, int(ready.match.group(1))))
+        for line in output:
+            if isinstance(line, int):
+                print('the server exited with', line)
+                break
+            print(line.decode(), end='')
+
+    The command is stopped when the ``close()`` method of the iterator is
+    called, whether or not it was iterated, or when it is garbage collected.
+
+    The output has to be read, by iterating the iterator, for as long as
+    the command is running, as otherwise the command blocks once it has
+    written enough output to fill the pipe, or pty, to this process, which
+    is only about 64 KiB.
+    If the output after the command is ready is not needed, e.g. while
+    running tests against a server, pass ``drain`` as True, and then the
+    rest of the output is read, and discarded, by a background thread, and
+    the iterator only yields the output up to the line in which the
+    pattern matched, including it if it was complete, and then the return
+    code once the command has exited:
+
+    .. code-block:: python
+
+        ready, output = wait_for_output(
+            ['my_server'], 'Listening on port', timeout=10, drain=True)
+        try:
+            run_tests()
+        finally:
+            # Stops the server
+            output.close()
+
+    All of the output options apply, see `Output Options`_, except
+    ``reuse_buffer``, which can not be used, and ``timeout``, which is the
+    time to wait for the output to match, while the output is always
+    searched as it is read, before it is e.g. filtered or decoded.
+
+    If the output does not match within ``timeout`` seconds, the command is
+    stopped, in the same way as for the ``timeout`` of
+    :py:func:`execute_process`, and a
+    :py:exc:`osrf_pycommon.process_utils.NotReadyError` is raised with a
+    ``reason`` of ``'timeout'``.
+    If the command exits before its output matches, the error is raised
+    with a ``reason`` of ``'exited'`` and its ``returncode``.
+
+    :param pattern: regular expression to search the output for
+    :param float timeout: seconds to wait for the output to match, defaults
+        to None which means there is no limit
+    :param bool drain: if True, the output after the command is ready is
+        read, and discarded, by a background thread, defaults to False
+    :returns: the readiness and an iterator which yields the output
+    :rtype: tuple
+    :raises: :py:exc:`osrf_pycommon.process_utils.NotReadyError` if the
+        output does not match in time or the command exits before it does
+    :raises: TypeError if an option is unknown, or can not be used
+    :raises: ValueError if ``timeout`` is negative, or if any of the output
+        options are invalid
+
+    For all other parameters and documentation see: :py:func:`execute_process`
+    """
+    watch = _ReadinessWatch(pattern, timeout)
+    _check_options(options, _wait_options)
+    exp_func = _execute_process_nopty
+    if emulate_tty and _execute_process_pty is not None:
+        exp_func = _execute_process_pty
+
+    def generate():
+        for out, err, ret in exp_func(
+            cmd, cwd, env, shell, stderr_to_stdout=True, ready=watch,
+            **options
+        ):
+            yield out if ret is None else ret
+
+    output = generate()
+    lines = []
+    try:
+        for line in output:
+            if isinstance(line, int):
+                if line.reason != 'exited':
+                    # e.g. the readiness, or the idle_timeout, expired
+                    raise NotReadyError('timeout', line)
+                raise NotReadyError('exited', line)
+            if line is None:
+                # The output is searched as it is read, and this is yielded,
+                # without any output, once it matches, which it no longer
+                # can once the command is being stopped
+                break
+            lines.append(line)
+    except BaseException:
+        output.close()
+        raise
+    if not drain:
+        return watch.ready(), _ReadyOutput(lines, output, output.close)
+    kill_timeout = options.get('kill_timeout', _options['kill_timeout'])
+    drain = _Drain(output, watch.job)
+    return watch.ready(), _ReadyOutput(
+        lines, _drained_result(drain),
+        functools.partial(drain.stop, kill_timeout))
 
 
 try:
@@ -0,0 +1,280 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+_overflow_policies = ['split', 'truncate']
+# A complete line, which only ends in \n, \r or \r\n, like in _end
+_line = re.compile(br'[^\r\n]*(?:\r\n|\r|\n)')
+
+
+class LineAssembler(object):
+    """Incrementally assembles complete lines from chunks of output.
+
+    Data is given to :py:meth:`feed` as it is read, and only the new data is
+    scanned for line endings, so a line which arrives over many reads costs
+    time linear in its length.
+    Incomplete data is kept in a :py:class:`bytearray` until the rest of the
+    line arrives or :py:meth:`flush` is called.
+
+    Line endings are the same as for :py:meth:`bytes.splitlines`, i.e.
+    ``\\n``, ``\\r`` and ``\\r\\n``, and they are preserved in the output.
+    A line ending in ``\\r`` at the end of the data is only returned with the
+    next data, or when flushed, so a ``\\r\\n`` which is split between reads
+    still ends a single line, e.g. progress redrawn with ``\\r`` is returned
+    one read late.
+    Alternatively, a ``delimiter`` can be given, e.g. ``b'\\0'`` for the
+    output of ``find -print0`` or ``git ls-files -z``, or ``b'\\n'`` to
+    not split on ``\\r``, in which case only that exact sequence of bytes
+    ends a line, or record, and is preserved.
+    A delimiter of a single byte is found with :py:meth:`bytes.rfind`, so
+    it is as fast as the default.
+
+    Without a limit, a line which never ends, e.g. a binary blob, is kept in
+    memory until the end of the output.
+    Setting ``max_line_bytes`` bounds the memory used, with the ``overflow``
+    policy deciding what happens to longer lines:
+
+    - ``'split'``: once more than ``max_line_bytes`` of an incomplete line
+      are kept, they are returned in pieces of ``max_line_bytes``, keeping
+      the rest, and the rest of the line is treated as a new line.
+      This only bounds the data kept between reads, so a line which is
+      complete within the data given is returned whole however long it is,
+      and where a longer line is split depends on how it was read.
+    - ``'truncate'``: only the first ``max_line_bytes`` of any line are kept,
+      and when the line ends they are returned followed by a marker like
+      ``b' [1234 bytes truncated]'`` and the line ending.
+
+    :param int max_line_bytes: maximum length of a line, defaults to None
+        which means there is no limit
+    :param str overflow: either ``'split'`` or ``'truncate'``, defaults to
+        ``'split'``
+    :param bytes delimiter: bytes which end a line, defaults to None which
+        means the line endings of :py:meth:`bytes.splitlines` are used
+    :raises: ValueError if ``max_line_bytes``, ``overflow`` or ``delimiter``
+        are invalid
+    """
+
+    def __init__(self, max_line_bytes=None, overflow='split', delimiter=None):
+        if max_line_bytes is not None and max_line_bytes < 1:
+            raise ValueError("max_line_bytes must be at least 1, got '{0}'"
+                             .format(max_line_bytes))
+        if overflow not in _overflow_policies:
+            raise ValueError("overflow must be one of {0}, got '{1}'"
+                             .format(_overflow_policies, overflow))
+        if delimiter is not None and (
+            not isinstance(delimiter, bytes) or not delimiter
+        ):
+            raise ValueError(
+                "delimiter must be non-empty bytes, got '{0}'".format(
+                    delimiter))
+        self._max_line_bytes = max_line_bytes
+        self._delimiter = delimiter
+        self._overflow = overflow
+        self._pending = bytearray()
+        # Whether the pending line is followed by a \r, which may be followed
+        # by the \n of a \r\n in the next read, so its line is only complete
+        # once that is known
+        self._held_cr = False
+        # The last bytes of the pending line, which may be the start of a
+        # delimiter of more than one byte which ends in the next read, so
+        # they are kept apart from it, which may have been truncated
+        self._tail = b''
+        # Number of bytes dropped from the pending line when truncating
+        self._truncated = 0
+
+    @property
+    def pending(self):
+        """Number of bytes waiting for the end of their line."""
+        return len(self._pending) + self._held_cr + len(self._tail)
+
+    def _hold_cr(self, data, size):
+        # Returns size without a \r which ends data[:size], which is held
+        if self._delimiter is None and data.endswith(b'\r', 0, size):
+            self._held_cr = True
+            return size - 1
+        return size
+
+    def _end(self, data, size=None):
+        # Returns the end of the last complete line in data[:size], or 0
+        if size is None:
+            size = len(data)
+        if self._delimiter is None:
+            return max(
+                data.rfind(b'\n', 0, size), data.rfind(b'\r', 0, size)) + 1
+        end = data.rfind(self._delimiter, 0, size)
+        return 0 if end < 0 else end + len(self._delimiter)
+
+    def _split(self, data):
+        # Splits complete lines, keeping their endings
+        if self._delimiter is None:
+            return _line.findall(data)
+        delimiter = self._delimiter
+        return [line + delimiter for line in data.split(delimiter)[:-1]]
+
+    def _content(self, line):
+        # Returns the line without its ending
+        if self._delimiter is None:
+            return line.rstrip(b'\r\n')
+        if line.endswith(self._delimiter):
+            return line[:-len(self._delimiter)]
+        return line
+
+    def feed(self, data):
+        """Adds data and returns any lines which it completes.
+
+        :param bytes data: newly read data
+        :returns: all complete lines, joined, or None if there are none
+        :rtype: bytes
+        """
+        if self._held_cr:
+            # The held \r ends the pending line, along with a \n if the new
+            # data starts with one
+            data = b'\r' + data
+            self._held_cr = False
+        elif self._tail:
+            # The delimiter may be split between the incomplete line and
+            # the new data, so the end of the incomplete line is searched
+            # again along with the new data
+            data = self._tail + data
+            self._tail = b''
+        size = self._hold_cr(data, len(data))
+        end = self._end(data, size)
+        if self._delimiter is not None and len(self._delimiter) > 1:
+            size = max(size - len(self._delimiter) + 1, end)
+            self._tail = bytes(data[size:])
+        if size < len(data):
+            data = data[:size]
+        if self._max_line_bytes is not None:
+            return self._feed_limited(data, end)
+        if not end:
+            self._pending += data
+            return None
+        if self._pending:
+            self._pending += data[:end]
+            lines = bytes(self._pending)
+            del self._pending[:]
+        else:
+            lines = data[:end]
+        self._pending += data[end:]
+        return lines
+
+    def feed_from(self, buffer, size):
+        """Like :py:meth:`feed`, for data at the start of a reused buffer.
+
+        This avoids copying the read data into a new :py:class:`bytes` when
+        a :py:class:`bytearray` is reused for each read.
+        If there is no incomplete line from before, the complete lines are
+        returned as a :py:class:`memoryview` of ``buffer``, which is only
+        valid until the buffer is next written to.
+
+        :param bytearray buffer: buffer into which data was read
+        :param int size: number of bytes read into the start of ``buffer``
+        :returns: all complete lines, joined, or None if there are none
+        :rtype: memoryview or bytes
+        """
+        if self._max_line_bytes is not None or self._held_cr or (
+            self._delimiter is not None and len(self._delimiter) > 1
+        ):
+            return self.feed(bytes(buffer[:size]))
+        size = self._hold_cr(buffer, size)
+        view = memoryview(buffer)[:size]
+        end = self._end(buffer, size)
+        if not end:
+            self._pending += view
+            return None
+        if self._pending:
+            self._pending += view[:end]
+            lines = bytes(self._pending)
+            del self._pending[:]
+        else:
+            lines = view[:end]
+        self._pending += view[end:]
+        return lines
+
+    def flush(self):
+        """Returns and clears any incomplete line.
+
+        :returns: the incomplete line, or ``b''`` if there is none
+        :rtype: bytes
+        """
+        tail = self._tail
+        self._tail = b''
+        data = b''
+        if self._max_line_bytes is None:
+            self._pending += tail
+        else:
+            data = self._add_pending(tail) or b''
+        data += bytes(self._pending) + self._truncation_marker()
+        if self._held_cr:
+            data += b'\r'
+        del self._pending[:]
+        self._held_cr = False
+        self._truncated = 0
+        return data
+
+    def _truncation_marker(self):
+        if not self._truncated:
+            return b''
+        return b' [%d bytes truncated]' % self._truncated
+
+    def _add_pending(self, data):
+        # Adds to the incomplete line, returning any of it which has to be
+        # returned early because of the 'split' policy
+        if self._overflow == 'truncate':
+            room = max(self._max_line_bytes - len(self._pending), 0)
+            self._pending += data[:room]
+            self._truncated += max(len(data) - room, 0)
+            return None
+        self._pending += data
+        if len(self._pending) <= self._max_line_bytes:
+            return None
+        # The last piece is kept, as it gets the line ending if the line
+        # ends right after it
+        keep = (len(self._pending) - 1) % self._max_line_bytes + 1
+        split = bytes(self._pending[:len(self._pending) - keep])
+        del self._pending[:len(self._pending) - keep]
+        return split
+
+    def _truncate(self, line):
+        # Truncates a complete line, keeping its line ending
+        content = self._content(line)
+        if len(content) <= self._max_line_bytes and not self._truncated:
+            return line
+        self._truncated += max(len(content) - self._max_line_bytes, 0)
+        line = content[:self._max_line_bytes] + self._truncation_marker() + \
+            line[len(content):]
+        self._truncated = 0
+        return line
+
+    def _feed_limited(self, data, end):
+        # Like feed, but with the max_line_bytes limit and overflow policy
+        if not end:
+            return self._add_pending(data)
+        if self._overflow == 'split':
+            lines = bytes(self._pending) + data[:end]
+        elif not self._pending and not self._truncated and \
+                end <= self._max_line_bytes:
+            # None of these lines can be too long
+            lines = data[:end]
+        else:
+            lines = self._split(data[:end])
+            # The first line completes the pending line, which may already
+            # have been truncated
+            content = self._content(lines[0])
+            self._add_pending(content)
+            lines[0] = bytes(self._pending) + lines[0][len(content):]
+            lines = b''.join([self._truncate(line) for line in lines])
+        del self._pending[:]
+        return lines + (self._add_pending(data[end:]) or b'')
@@ -0,0 +1,190 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+# The content of a line and then its line ending, if any
+_line = br'[^\r\n]*(?:\r\n|\r|\n|\Z)'
+
+# Replacements for the special characters of the patterns which refer to
+# line endings, so they apply to \r and \r\n as well as to \n
+_line_anchors = {
+    b'^': br'(?<![^\r\n])',
+    b'$': br'(?![^\r\n])',
+    b'.': br'[^\r\n]',
+}
+
+
+def _anchor_to_lines(pattern):
+    # Rewrites ^, $ and . outside of escapes and character classes, so that
+    # the pattern stays within, and is anchored to, the line it is searched
+    # in whatever its line ending is, and returns it, searched for from the
+    # start of the line, or only matched there if it starts with ^
+    result = []
+    i = 0
+    in_class = False
+    depth = 0
+    alternation = False
+    while i < len(pattern):
+        char = pattern[i:i + 1]
+        if char == b'\\':
+            result.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if char == b']':
+                in_class = False
+        elif char == b'[':
+            in_class = True
+            # A ] right after the [, or after [^, is part of the class
+            end = i + 1
+            if pattern[end:end + 1] == b'^':
+                end += 1
+            if pattern[end:end + 1] == b']':
+                end += 1
+            result.append(pattern[i:end])
+            i = end
+            continue
+        elif char == b'(':
+            depth += 1
+        elif char == b')':
+            depth -= 1
+        elif char == b'|' and depth == 0:
+            alternation = True
+        elif char in _line_anchors:
+            char = _line_anchors[char]
+        result.append(char)
+        i += 1
+    if pattern.startswith(b'^') and not alternation:
+        # Only at the start of the line, which is where it is matched
+        return b'(?:' + b''.join(result[1:]) + b')'
+    return br'[^\r\n]*?(?:' + b''.join(result) + b')'
+
+
+def _count_lines(data):
+    # Counts the lines in data, including a last line without a line ending
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    lines = data.count(b'\n')
+    if b'\r' in data:
+        lines += data.count(b'\r') - data.count(b'\r\n')
+    if not data.endswith((b'\n', b'\r')):
+        lines += 1
+    return lines
+
+
+def _alternation(patterns):
+    # Joins one or more patterns into a single alternation
+    if isinstance(patterns, (bytes, str)):
+        patterns = [patterns]
+    patterns = [
+        p.encode('utf-8') if isinstance(p, str) else p for p in patterns]
+    if not patterns:
+        return None
+    return b'|'.join(b'(?:' + _anchor_to_lines(p) + b')' for p in patterns)
+
+
+class LineFilter(object):
+    """Keeps only the lines of output which match some patterns.
+
+    A line is kept if it matches any of the ``include`` patterns, or if
+    there are none, and does not match any of the ``exclude`` patterns.
+    The patterns are regular expressions, as :py:class:`bytes`, or as
+    :py:class:`str` which are encoded as UTF-8, and are searched for
+    anywhere in the line, like with :py:func:`re.search`.
+
+    All of the patterns are compiled once, into a single regular
+    expression which skips the lines to be dropped, and matches each line
+    to be kept, and it is applied to each batch of complete lines as read,
+    with :py:func:`re.finditer`, so lines which are dropped never become
+    Python objects of their own, and runs of consecutive lines which are
+    kept are returned as one slice of the batch.
+
+    Line endings are ``\\n``, ``\\r`` and ``\\r\\n``, as for the lines
+    yielded by :py:func:`osrf_pycommon.process_utils.execute_process`, and
+    ``^``, ``$`` and ``.`` are rewritten so that ``^`` and ``$`` match at the
+    start and end of each line whatever its line ending is, e.g. also for
+    the ``\\r\\n`` of the output read from a pty when using
+    ``emulate_tty``, and ``.`` does not match a line ending.
+
+    The number of lines kept and dropped so far are counted in
+    ``matched_lines`` and ``dropped_lines``.
+
+    :param include: pattern, or list of patterns, of lines to keep, defaults
+        to None which means all lines are kept unless excluded
+    :param exclude: pattern, or list of patterns, of lines to drop, defaults
+        to None which means no lines are excluded
+    :raises: :py:exc:`re.error` if any of the patterns are invalid
+    """
+
+    def __init__(self, include=None, exclude=None):
+        include = None if include is None else _alternation(include)
+        exclude = None if exclude is None else _alternation(exclude)
+        # Lookaheads, at the start of a line, for whether it is kept, or
+        # dropped
+        keep = b''
+        drop = []
+        if exclude is not None:
+            keep += b'(?!' + exclude + b')'
+            drop.append(b'(?=' + exclude + b')')
+        if include is not None:
+            keep += b'(?=' + include + b')'
+            drop.append(b'(?!' + include + b')')
+        drop = b'(?:' + (b'|'.join(drop) or b'(?!)') + b')'
+        # Each match is a run of lines which are dropped, and then a line
+        # which is kept, in group 1, or the end of the data, so the dropped
+        # lines are skipped by the regular expression, a whole line at once
+        self._pattern = re.compile(
+            b'(?:' + drop + _line + b')*' +
+            br'(?:((?!\Z)' + keep + _line + br')|\Z)')
+        self.matched_lines = 0
+        self.dropped_lines = 0
+
+    def filter(self, data):
+        """Returns the lines in data which are kept.
+
+        :param bytes data: complete lines, except that the last may be
+            missing its line ending at the end of the output
+        :returns: the lines which are kept, joined, or None if there are none
+        :rtype: bytes, or the given :py:class:`memoryview` if all of the
+            lines are kept
+        """
+        if not data:
+            return None
+        original = data
+        if isinstance(data, memoryview):
+            # One copy of the batch, to be able to search and count it
+            data = data.tobytes()
+        lines = _count_lines(data)
+        pieces = []
+        start = end = 0
+        matched = 0
+        for match in self._pattern.finditer(data):
+            if match.start(1) < 0:
+                # Only dropped lines until the end of the data
+                break
+            matched += 1
+            if match.start(1) != end:
+                # Lines were dropped between this line and the kept ones
+                if end > start:
+                    pieces.append(data[start:end])
+                start = match.start(1)
+            end = match.end(1)
+        self.matched_lines += matched
+        self.dropped_lines += lines - matched
+        if matched == lines:
+            return original
+        if end > start:
+            pieces.append(data[start:end])
+        return b''.join(pieces) or None
@@ -0,0 +1,117 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class LineNormalizer(object):
+    """Collapses progress redrawn with ``\\r`` and folds repeated lines.
+
+    Tools which show progress in a terminal, e.g. pip or wget, redraw it by
+    writing ``\\r`` and then the new state over the old one, so, with
+    ``emulate_tty``, every redraw arrives as a line ending in ``\\r``.
+    With ``collapse_cr``, such a run of overwritten lines is collapsed to
+    the last of them which is not empty, which is kept, and given the line
+    ending of the line which ends the run if that line is empty, e.g.
+    ``b'10%\\r20%\\r30%\\r\\n'`` becomes ``b'30%\\r\\n'``.
+    The last state of the run is only returned once the run ends, or when
+    the output ends.
+
+    With ``fold_repeats``, a line which is the same as the line before it
+    is not returned, but counted, and once a different line arrives, or
+    the output ends, a single line like
+    ``b'[last line repeated 12 times]\\n'`` is returned in its place.
+
+    The data given to :py:meth:`feed` should be complete lines, as
+    assembled by a
+    :py:class:`osrf_pycommon.process_utils.line_assembler.LineAssembler`,
+    from one stream, and is handled as :py:class:`bytes`, so before any
+    decoding.
+
+    :param bool collapse_cr: if True, collapse lines overwritten with
+        ``\\r``, defaults to True
+    :param bool fold_repeats: if True, fold consecutive identical lines,
+        defaults to True
+    """
+
+    def __init__(self, collapse_cr=True, fold_repeats=True):
+        self._collapse_cr = collapse_cr
+        self._fold_repeats = fold_repeats
+        # The last line of a run of lines ending in \r, while the run lasts
+        self._overwritten = None
+        # The last line returned, and how many times it was repeated since
+        self._last = None
+        self._repeats = 0
+
+    def _repeated(self):
+        ending = self._last[len(self._last.rstrip(b'\r\n')):] or b'\n'
+        data = b'[last line repeated %d time%s]' % (
+            self._repeats, b's' if self._repeats > 1 else b'') + ending
+        self._repeats = 0
+        return data
+
+    def _add(self, line, lines):
+        # Adds a line to the lines to be returned, unless it's a repeat
+        if self._fold_repeats:
+            if line == self._last:
+                self._repeats += 1
+                return
+            if self._repeats:
+                lines.append(self._repeated())
+            self._last = line
+        lines.append(line)
+
+    def feed(self, data):
+        """Returns the normalized lines for newly assembled lines.
+
+        :param bytes data: complete lines
+        :returns: the normalized lines, joined, or None if there are none
+        :rtype: bytes
+        """
+        if not data:
+            return None
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not self._fold_repeats and self._overwritten is None and \
+                data.count(b'\r') == data.count(b'\r\n'):
+            # There is no \r on its own, so nothing is overwritten
+            return data
+        lines = []
+        for line in data.splitlines(True):
+            if self._collapse_cr:
+                if line.endswith(b'\r'):
+                    if len(line) > 1 or self._overwritten is None:
+                        self._overwritten = line
+                    continue
+                if self._overwritten is not None:
+                    if not line.rstrip(b'\r\n'):
+                        # Only a line ending, which ends the run of lines
+                        line = self._overwritten[:-1] + line
+                    self._overwritten = None
+            self._add(line, lines)
+        return b''.join(lines) or None
+
+    def flush(self):
+        """Returns any lines held back, once the output has ended.
+
+        :returns: the last state of overwritten lines and the count of
+            repeated lines, if any, or None if there are none
+        :rtype: bytes
+        """
+        lines = []
+        if self._overwritten is not None:
+            self._add(self._overwritten, lines)
+            self._overwritten = None
+        if self._repeats:
+            lines.append(self._repeated())
+        self._last = None
+        return b''.join(lines) or None
@@ -0,0 +1,92 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+import time
+
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:
+    # time.monotonic_ns is only available in Python 3.7 or greater
+    def _monotonic_ns():
+        return int(time.monotonic() * 1e9)
+
+
+class OutputTimeline(object):
+    """Records when, and from which stream, each piece of output arrived.
+
+    When given to :py:func:`osrf_pycommon.process_utils.execute_process`,
+    or one of the other functions which take a ``timeline``, a record is
+    added for each line, or chunk, of output as it is yielded, so the
+    ``n``-th record is for the ``n``-th piece of output.
+    The record number is its sequence number, which is global to the
+    timeline, so when ``stdout`` and ``stderr`` are captured separately,
+    or when one timeline is shared by several subprocesses, their order of
+    arrival and timing can be rebuilt afterwards:
+
+    .. code-block:: python
+
+        timeline = OutputTimeline()
+        output = [(out, err) for out, err, ret in execute_process_split(
+            cmd, timeline=timeline) if ret is None]
+        for (seq, time_ns, job, stream, size), (out, err) in zip(
+            timeline, output
+        ):
+            print(time_ns, 'stdout' if stream == 1 else 'stderr', out or err)
+
+    The records are kept in parallel :py:class:`array.array` columns, rather
+    than as a tuple per record, which each take 8 bytes per record, or 1 for
+    the stream, and can be used directly:
+
+    - ``times``: :py:func:`time.monotonic_ns` at which the output was read,
+      or :py:func:`time.monotonic` in nanoseconds before Python 3.7
+    - ``jobs``: index of the subprocess, see
+      :py:func:`osrf_pycommon.process_utils.execute_processes`, or 0
+    - ``streams``: 1 for ``stdout`` and 2 for ``stderr``
+    - ``sizes``: length of the output, in bytes, or characters if decoded
+    """
+
+    def __init__(self):
+        self.times = array('q')
+        self.jobs = array('q')
+        self.streams = array('b')
+        self.sizes = array('q')
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        """Iterates over ``(sequence, time_ns, job, stream, size)`` tuples."""
+        return zip(
+            range(len(self.times)), self.times, self.jobs, self.streams,
+            self.sizes)
+
+    def record(self, stream, size, job=0, time_ns=None):
+        """Adds a record, returning its sequence number.
+
+        :param int stream: 1 for ``stdout`` and 2 for ``stderr``
+        :param int size: length of the output
+        :param int job: index of the subprocess, defaults to 0
+        :param int time_ns: time at which the output was read, defaults to
+            None which means :py:func:`time.monotonic_ns` is used
+        :returns: sequence number of the record
+        :rtype: int
+        """
+        if time_ns is None:
+            time_ns = _monotonic_ns()
+        self.times.append(time_ns)
+        self.jobs.append(job)
+        self.streams.append(stream)
+        self.sizes.append(size)
+        return len(self.times) - 1
@@ -0,0 +1,148 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+
+try:
+    import pty
+except ImportError:
+    # Not available on Windows, where emulate_tty has no effect
+    pty = None
+
+
+class _PtyLease(object):
+    # pty's opened for one subprocess, which count towards the maximum of
+    # their manager until they are released, once their masters are closed
+
+    def __init__(self, manager, pairs):
+        self.manager = manager
+        self.pairs = pairs
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        with self.manager._lock:
+            self.manager.in_use -= len(self.pairs)
+
+
+class PtyManager(object):
+    """Opens the pty's used by ``emulate_tty``, up to a maximum at once.
+
+    Each subprocess run with ``emulate_tty`` needs one pty, or two if its
+    ``stderr`` is captured separately, until its output is closed, and the
+    number of pty's is limited for the whole system, so running many
+    subprocesses in parallel can run out of them.
+    When a subprocess would take more than ``max_ptys`` pty's in use at
+    once, or when they can not be opened, e.g. with "out of pty devices",
+    it falls back to using pipes instead, as if ``emulate_tty`` was False,
+    so its output is still captured, just without a terminal.
+    It does not wait for a pty to be released, as the output of the
+    subprocesses which use them may only be read after it returns.
+
+    One manager, returned by :py:func:`get_pty_manager`, is shared by
+    :py:func:`osrf_pycommon.process_utils.execute_process`, the other
+    synchronous functions and :py:func:`async_execute_process`, so its
+    ``max_ptys`` applies to all of them:
+
+    .. code-block:: python
+
+        from osrf_pycommon.process_utils import get_pty_manager
+
+        get_pty_manager().max_ptys = 64
+        ...
+        if get_pty_manager().fallbacks:
+            print('{0} subprocesses ran without a pty'.format(
+                get_pty_manager().fallbacks))
+
+    The number of pty's in use, the most which were in use at once, and the
+    total opened are in the ``in_use``, ``peak`` and ``opened`` attributes.
+    The number of subprocesses which fell back to pipes is counted in
+    ``fallbacks``, of which ``errors`` is the number which did so because
+    the pty's could not be opened, with the last such error in
+    ``last_error``.
+
+    :param int max_ptys: maximum number of pty's in use at once, defaults
+        to None which means there is no maximum other than that of the
+        system
+    :raises: ValueError if ``max_ptys`` is less than 1
+    """
+
+    def __init__(self, max_ptys=None):
+        if max_ptys is not None and max_ptys < 1:
+            raise ValueError(
+                "max_ptys must be at least 1, got '{0}'".format(max_ptys))
+        self.max_ptys = max_ptys
+        self.in_use = 0
+        self.peak = 0
+        self.opened = 0
+        self.fallbacks = 0
+        self.errors = 0
+        self.last_error = None
+        # The synchronous functions may be used from several threads
+        self._lock = threading.Lock()
+
+    def open_ptys(self, count):
+        """Opens ``count`` pty's for one subprocess, if the maximum allows.
+
+        The returned lease has the ``(master, slave)`` file descriptors of
+        the pty's in its ``pairs`` attribute, which the caller closes, and
+        counts towards ``in_use`` until its ``release()`` method is called,
+        once the masters are closed; calling it again has no effect.
+
+        :param int count: number of pty's to open
+        :returns: a lease of the opened pty's, or None if pipes are to be
+            used instead, because the pty's would exceed ``max_ptys``, can
+            not be opened, or are not supported on this platform
+        """
+        if pty is None:
+            return None
+        with self._lock:
+            if self.max_ptys is not None and \
+                    self.in_use + count > self.max_ptys:
+                self.fallbacks += 1
+                return None
+            # Reserved before opening, so other threads see them in use
+            self.in_use += count
+        pairs = []
+        try:
+            for _ in range(count):
+                pairs.append(pty.openpty())
+        except OSError as exc:
+            for pair in pairs:
+                for fd in pair:
+                    os.close(fd)
+            with self._lock:
+                self.in_use -= count
+                self.fallbacks += 1
+                self.errors += 1
+                self.last_error = exc
+            return None
+        with self._lock:
+            self.opened += count
+            self.peak = max(self.peak, self.in_use)
+        return _PtyLease(self, pairs)
+
+
+_pty_manager = PtyManager()
+
+
+def get_pty_manager():
+    """Returns the :py:class:`PtyManager` shared by all ``emulate_tty`` use.
+
+    :rtype: :py:class:`PtyManager`
+    """
+    return _pty_manager
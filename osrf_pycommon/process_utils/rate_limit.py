@@ -0,0 +1,219 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import math
+import time
+
+from .line_filter import _count_lines
+
+_rate_limit_policies = ['drop', 'sample']
+
+
+class _Suppressed(object):
+    # Lines of a stream suppressed since it was last within the limit
+
+    def __init__(self, tail):
+        self.lines = 0
+        self.tail = collections.deque(maxlen=tail)
+        self.line_ending = b'\n'
+
+
+class RateLimiter(object):
+    """Limits the rate of lines of output, suppressing lines above it.
+
+    The rate is limited to ``lines_per_second`` and, or, to
+    ``bytes_per_second`` with a token bucket, which holds up to ``burst``
+    seconds worth of output, so short bursts pass unchanged.
+    Once the bucket is empty, lines are suppressed, until it is refilled
+    over time, according to the ``policy``:
+
+    - ``'drop'``: the lines which fit in the bucket, from the start of each
+      batch of lines as it is read, are kept and the rest are dropped.
+    - ``'sample'``: the lines which fit in the bucket are spread evenly over
+      each batch of lines, so every ``n``-th line is kept, which gives a
+      sample of the whole output.
+
+    Once a batch of lines is within the limit again, and when the output
+    ends, a summary line like ``b'[1234 lines suppressed]\\n'`` is added,
+    followed by the last ``tail`` lines which were suppressed, so the lines
+    just before the output slows down, or ends, e.g. an error, are not lost.
+    Only the lines suppressed after the last line which was kept are in the
+    tail, so the lines stay in order, e.g. with the ``'sample'`` policy the
+    tail is at most the lines after the last sampled one.
+    The summary counts the suppressed lines which are not in the tail.
+
+    The same limiter can be used for several streams, or subprocesses, in
+    which case their output shares the limit, but the suppressed lines are
+    summarized for each stream separately.
+    The total number of lines, and bytes, suppressed so far, including
+    those in the tail, are counted in ``suppressed_lines`` and
+    ``suppressed_bytes``.
+
+    :param float lines_per_second: maximum rate of lines, defaults to None
+        which means there is no limit on the number of lines
+    :param float bytes_per_second: maximum rate of bytes, defaults to None
+        which means there is no limit on the number of bytes
+    :param float burst: number of seconds worth of output which can pass at
+        once, defaults to 1
+    :param str policy: either ``'drop'`` or ``'sample'``, defaults to
+        ``'drop'``
+    :param int tail: number of the last suppressed lines to keep, and add
+        after the summary, defaults to 10
+    :raises: ValueError if neither rate is given, or if any of the options
+        are invalid
+    """
+
+    def __init__(
+        self, lines_per_second=None, bytes_per_second=None, burst=1.0,
+        policy='drop', tail=10
+    ):
+        if lines_per_second is None and bytes_per_second is None:
+            raise ValueError(
+                "lines_per_second or bytes_per_second must be given")
+        for name, value in [
+            ('lines_per_second', lines_per_second),
+            ('bytes_per_second', bytes_per_second), ('burst', burst)
+        ]:
+            if value is not None and value <= 0:
+                raise ValueError(
+                    "{0} must be positive, got '{1}'".format(name, value))
+        if policy not in _rate_limit_policies:
+            raise ValueError("policy must be one of {0}, got '{1}'".format(
+                _rate_limit_policies, policy))
+        if tail < 0:
+            raise ValueError("tail must not be negative, got '{0}'".format(
+                tail))
+        self._rates = (lines_per_second, bytes_per_second)
+        # Tokens for lines and bytes, the bucket starts full
+        self._capacity = tuple(
+            None if rate is None else rate * burst for rate in self._rates)
+        self._tokens = list(self._capacity)
+        self._refilled = None
+        self._policy = policy
+        self._tail = tail
+        self._suppressed = {}
+        self.suppressed_lines = 0
+        self.suppressed_bytes = 0
+
+    def _refill(self, now):
+        if self._refilled is not None:
+            elapsed = max(now - self._refilled, 0)
+            for i, rate in enumerate(self._rates):
+                if rate is not None:
+                    self._tokens[i] = min(
+                        self._tokens[i] + rate * elapsed, self._capacity[i])
+        self._refilled = now
+
+    def _take(self, lines, size):
+        # Takes tokens for the given lines and bytes, if there are enough
+        lines_tokens, bytes_tokens = self._tokens
+        if lines_tokens is not None and lines_tokens < lines:
+            return False
+        if bytes_tokens is not None and bytes_tokens < size:
+            return False
+        if lines_tokens is not None:
+            self._tokens[0] -= lines
+        if bytes_tokens is not None:
+            self._tokens[1] -= size
+        return True
+
+    def _sample_step(self, lines):
+        # Every how many lines one is kept, so that the kept lines are spread
+        # over the batch, rather than all being from its start
+        if self._policy != 'sample':
+            return 1
+        allowed = len(lines)
+        if self._tokens[0] is not None:
+            allowed = min(allowed, self._tokens[0])
+        if self._tokens[1] is not None:
+            average = sum(len(line) for line in lines) / len(lines)
+            allowed = min(allowed, self._tokens[1] / average)
+        if allowed < 1:
+            return len(lines)
+        return math.ceil(len(lines) / allowed)
+
+    def _summary(self, stream):
+        suppressed = self._suppressed.pop(stream)
+        data = b''
+        elided = suppressed.lines - len(suppressed.tail)
+        if elided:
+            data = b'[%d lines suppressed]' % elided + suppressed.line_ending
+        return data + b''.join(suppressed.tail)
+
+    def limit(self, data, stream=None, now=None):
+        """Returns the lines in data which are within the limit.
+
+        :param bytes data: complete lines, except that the last may be
+            missing its line ending at the end of the output
+        :param stream: key of the stream the lines are from, defaults to None
+        :param float now: time at which the lines were read, defaults to None
+            which means :py:func:`time.monotonic` is used
+        :returns: the lines which are kept, joined, and preceded by a summary
+            of any suppressed lines, or None if there are none
+        :rtype: bytes, or the given :py:class:`memoryview` if all of the
+            lines are kept
+        """
+        if not data:
+            return None
+        self._refill(time.monotonic() if now is None else now)
+        if stream not in self._suppressed and \
+                self._take(_count_lines(data), len(data)):
+            return data
+        lines = bytes(data).splitlines(True)
+        step = self._sample_step(lines)
+        kept = []
+        suppressed = None
+        for i, line in enumerate(lines):
+            if i % step == 0 and self._take(1, len(line)):
+                kept.append(line)
+                if suppressed is not None:
+                    # The suppressed lines before a kept line are only
+                    # counted, as they can not be added after it
+                    suppressed.tail.clear()
+                continue
+            if suppressed is None:
+                suppressed = self._suppressed.get(stream)
+                if suppressed is None:
+                    suppressed = self._suppressed[stream] = \
+                        _Suppressed(self._tail)
+                elif kept:
+                    # Lines were kept after those suppressed before
+                    suppressed.tail.clear()
+            suppressed.lines += 1
+            suppressed.tail.append(line)
+            self.suppressed_lines += 1
+            self.suppressed_bytes += len(line)
+        if suppressed is not None:
+            last = suppressed.tail[-1] if suppressed.tail else lines[-1]
+            ending = last[len(last.rstrip(b'\r\n')):]
+            if ending:
+                suppressed.line_ending = ending
+        elif stream in self._suppressed:
+            # All of these lines are within the limit, so the output has
+            # slowed down, and the suppressed lines are summarized first
+            kept.insert(0, self._summary(stream))
+        return b''.join(kept) or None
+
+    def flush(self, stream=None):
+        """Returns the summary of any suppressed lines, at the end of output.
+
+        :param stream: key of the stream which ended, defaults to None
+        :returns: the summary and the last suppressed lines, or None if no
+            lines were suppressed
+        :rtype: bytes
+        """
+        if stream not in self._suppressed:
+            return None
+        return self._summary(stream)
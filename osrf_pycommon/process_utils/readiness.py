@@ -0,0 +1,99 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import re
+import time
+
+# Number of bytes at the end of an incomplete line which are kept, and
+# searched again along with the next read, so a match which spans reads has
+# to be within that many bytes before the next read
+_max_pending = 64 * 1024
+
+OutputReady = collections.namedtuple(
+    'OutputReady', ['match', 'time_to_ready'])
+OutputReady.__doc__ = """\
+Result of waiting for a subprocess to be ready.
+
+``match`` is the :py:class:`re.Match` of the pattern in the output, and
+``time_to_ready`` is the number of seconds from starting the subprocess
+until the match was seen.
+"""
+
+
+class NotReadyError(Exception):
+    """Raised when a subprocess did not output what it was waited for.
+
+    The ``reason`` attribute is ``'timeout'`` if the subprocess did not
+    output a match in time, and was stopped, or ``'exited'`` if it exited
+    before outputting a match.
+    The ``returncode`` attribute is its return code, if it is known.
+    """
+
+    def __init__(self, reason, returncode=None):
+        self.reason = reason
+        self.returncode = returncode
+        message = "subprocess did not become ready in time"
+        if reason == 'exited':
+            message = "subprocess exited with '{0}' before becoming ready" \
+                .format(returncode)
+        Exception.__init__(self, message)
+
+
+class _ReadinessWatch(object):
+    # Searches output for a pattern, from the start of the subprocess until
+    # the pattern is found, or until its timeout expires
+
+    def __init__(self, pattern, timeout=None):
+        if timeout is not None and timeout < 0:
+            raise ValueError(
+                "timeout must not be negative, got '{0}'".format(timeout))
+        if isinstance(pattern, str):
+            pattern = pattern.encode('utf-8')
+        self.pattern = re.compile(pattern, re.MULTILINE)
+        self.start = time.monotonic()
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = self.start + timeout
+        self.match = None
+        self.time_to_ready = None
+        # The job whose output is searched, if any, which sets this
+        self.job = None
+        # The end of the incomplete last line of each stream, searched
+        # again along with the rest of the line, so a match may span reads,
+        # and the position from which it is searched
+        self._pending = {}
+
+    def search(self, stream, data):
+        # Returns the first match, if any, in the output so far
+        if self.match is not None:
+            return self.match
+        pending, start = self._pending.pop(stream, (b'', 0))
+        data = pending + bytes(data)
+        self.match = self.pattern.search(data, start)
+        if self.match is not None:
+            self.time_to_ready = time.monotonic() - self.start
+            return self.match
+        end = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+        if len(data) - end > _max_pending:
+            # Only the end of a long line is kept, so it is not searched
+            # over and over, after one byte which is not searched again so
+            # that ^ does not match where the line was cut
+            self._pending[stream] = (data[-_max_pending - 1:], 1)
+        elif end < len(data):
+            self._pending[stream] = (data[end:], 0)
+        return None
+
+    def ready(self):
+        return OutputReady(self.match, self.time_to_ready)
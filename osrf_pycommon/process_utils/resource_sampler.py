@@ -0,0 +1,176 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import time
+
+ResourceSample = collections.namedtuple('ResourceSample', [
+    'pid', 'elapsed', 'processes', 'user_time', 'system_time',
+    'cpu_percent', 'rss', 'swap'])
+ResourceSample.__doc__ = """\
+Resource use of a running subprocess and its descendants at one time.
+
+``pid`` is the process id of the subprocess, or for a pipeline of its last
+command, and ``elapsed`` is the number of seconds since sampling started,
+i.e. since the subprocess was started.
+``processes`` is the number of processes sampled, i.e. the subprocess, or
+the commands of a pipeline, and all of their running descendants.
+
+``user_time`` and ``system_time`` are the number of seconds of CPU time
+used by these processes, including by their descendants which have exited
+and were waited for, and ``cpu_percent`` is the CPU use since the previous
+sample, where 100 is one CPU fully used.
+``rss`` and ``swap`` are the memory of these processes which is resident,
+and swapped out, in bytes, where memory shared between them is counted
+once for each process.
+
+Samples are read from ``/proc``, so they are only available on Linux.
+"""
+
+_clock_ticks = None
+_proc = '/proc'
+
+
+def _read_stat(pid):
+    # Returns the parent process id and the CPU times of the process, and of
+    # its children which it waited for, in clock ticks
+    with open('{0}/{1}/stat'.format(_proc, pid), 'rb') as f:
+        data = f.read()
+    # The command name, in parentheses, may contain spaces or parentheses
+    fields = data[data.rindex(b')') + 2:].split()
+    utime, stime, cutime, cstime = (int(f) for f in fields[11:15])
+    return int(fields[1]), utime + cutime, stime + cstime
+
+
+def _read_status(pid):
+    # Returns the resident and swapped out memory of the process in bytes,
+    # which are not in the status of a process which has exited
+    rss = swap = 0
+    with open('{0}/{1}/status'.format(_proc, pid), 'rb') as f:
+        for line in f:
+            if line.startswith(b'VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith(b'VmSwap:'):
+                swap = int(line.split()[1]) * 1024
+    return rss, swap
+
+
+def _children(pid):
+    # Returns the process ids of the children of the process, from the
+    # children files of each of its threads, or None if the kernel doesn't
+    # provide these files
+    try:
+        tids = os.listdir('{0}/{1}/task'.format(_proc, pid))
+    except OSError:
+        return []
+    children = []
+    for tid in tids:
+        try:
+            with open('{0}/{1}/task/{2}/children'.format(
+                _proc, pid, tid
+            ), 'rb') as f:
+                children.extend(int(child) for child in f.read().split())
+        except FileNotFoundError:
+            if tid == str(pid):
+                return None
+        except OSError:
+            # The thread has exited
+            pass
+    return children
+
+
+def _descendants_by_parent(pids):
+    # Returns the given processes and all of their descendants, by reading
+    # the parent of every process
+    children = collections.defaultdict(list)
+    for name in os.listdir(_proc):
+        if name.isdigit():
+            try:
+                children[_read_stat(name)[0]].append(int(name))
+            except (OSError, ValueError, IndexError):
+                # The process has exited
+                pass
+    found = list(pids)
+    for pid in found:
+        found.extend(children.get(pid, []))
+    return found
+
+
+def _descendants(pids):
+    # Returns the given processes and all of their descendants
+    found = list(pids)
+    for pid in found:
+        children = _children(pid)
+        if children is None:
+            return _descendants_by_parent(pids)
+        found.extend(children)
+    return found
+
+
+class _ResourceSampler(object):
+    # Samples the CPU and memory use of processes and their descendants
+
+    def __init__(self, pids, interval=1.0):
+        global _clock_ticks
+        if _clock_ticks is None and hasattr(os, 'sysconf'):
+            _clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.pids = pids
+        self.interval = interval
+        self.start = time.monotonic()
+        self.deadline = self.start + interval
+        self._last = (self.start, 0)
+
+    def due(self, now):
+        # Returns a sample if one is due, and schedules the next one
+        if now < self.deadline:
+            return None
+        self.deadline += self.interval
+        if self.deadline <= now:
+            # Samples which were missed, e.g. while output was consumed
+            # slowly, are skipped
+            self.deadline = now + self.interval
+        return self.sample(now)
+
+    def sample(self, now=None):
+        # Returns a ResourceSample, or None if the processes can't be read,
+        # e.g. because they have exited, or there is no /proc
+        now = time.monotonic() if now is None else now
+        processes = user = system = rss = swap = 0
+        for pid in _descendants(self.pids):
+            try:
+                _, process_user, process_system = _read_stat(pid)
+                process_rss, process_swap = _read_status(pid)
+            except (OSError, ValueError, IndexError):
+                # The process has exited
+                continue
+            processes += 1
+            user += process_user
+            system += process_system
+            rss += process_rss
+            swap += process_swap
+        if not processes:
+            return None
+        last_time, last_ticks = self._last
+        self._last = (now, user + system)
+        cpu_percent = 0.0
+        if now > last_time:
+            # The CPU time of descendants which exited without being waited
+            # for is lost, so the total may go down
+            cpu_percent = max(user + system - last_ticks, 0) * 100.0 / \
+                _clock_ticks / (now - last_time)
+        return ResourceSample(
+            self.pids[-1], now - self.start, processes,
+            user / _clock_ticks, system / _clock_ticks, cpu_percent, rss,
+            swap)
@@ -0,0 +1,134 @@
+# Copyright 2026 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import sys
+import time
+
+RunResult = collections.namedtuple('RunResult', [
+    'returncode', 'signal', 'core_dumped', 'wall_time', 'user_time',
+    'system_time', 'max_rss', 'stdout_bytes', 'stdout_lines', 'stderr_bytes',
+    'stderr_lines'])
+RunResult.__doc__ = """\
+Timings, resource usage and output counts of a finished subprocess.
+
+``returncode`` is its return code, and ``signal`` is the number of the
+signal which terminated it, or None if it exited by itself, in which case
+``core_dumped`` is False, or None if it is not known.
+
+``wall_time`` is the number of seconds from starting the subprocess until
+its exit was noticed, and ``user_time`` and ``system_time`` are the number
+of seconds of CPU time it used, and ``max_rss`` is its peak resident set
+size in bytes, as reported by :py:func:`os.wait4`.
+These three are None where the subprocess is not reaped with
+:py:func:`os.wait4`, e.g. on Windows, or with ``asyncio``, whose child
+watcher reaps it.
+For a pipeline, the CPU times are those of all of its commands together,
+and ``max_rss`` is the largest of any of them, and ``returncode``,
+``signal`` and ``core_dumped`` are those of the last command which did not
+exit with zero, like for
+:py:func:`osrf_pycommon.process_utils.execute_pipeline`.
+
+``stdout_bytes``, ``stdout_lines``, ``stderr_bytes`` and ``stderr_lines``
+count the output of each stream as it was read, so before any filtering,
+where lines end with ``\\n`` and a last line without one is also counted.
+With ``stderr_to_stdout`` or ``emulate_tty``, output which goes to the same
+stream is all counted as ``stdout``.
+"""
+
+# ru_maxrss is in kilobytes, except on macOS where it is in bytes
+_max_rss_scale = 1 if sys.platform == 'darwin' else 1024
+
+
+def _exit_from_returncode(returncode):
+    # What can be told from a return code alone, as given by subprocess
+    if returncode < 0:
+        return returncode, -returncode, None, None
+    return returncode, None, False, None
+
+
+def _exit_from_status(status, rusage):
+    if os.WIFSIGNALED(status):
+        signal = os.WTERMSIG(status)
+        return -signal, signal, os.WCOREDUMP(status), rusage
+    return os.WEXITSTATUS(status), None, False, rusage
+
+
+class _RunStats(object):
+    # Counts the output of a subprocess and reaps it, with os.wait4 where
+    # available, to describe it in a RunResult once it has exited
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.end = None
+        self.bytes = {1: 0, 2: 0}
+        self.lines = {1: 0, 2: 0}
+        # Whether the output of each stream so far ends in an incomplete line
+        self.partial = {1: False, 2: False}
+        # Return code, signal, core dump and rusage of each reaped process
+        self.exits = {}
+
+    def count(self, number, data, size=None):
+        # Counts size bytes, at the start of data, read from stream number
+        if size is None:
+            size = len(data)
+        if not size:
+            return
+        self.bytes[number] += size
+        self.lines[number] += data.count(b'\n', 0, size)
+        self.partial[number] = not data.endswith(b'\n', 0, size)
+
+    def reap(self, p):
+        # Reaps the subprocess.Popen p if it has exited, without blocking,
+        # and returns its return code, or None if it is still running
+        if p.returncode is not None:
+            return p.returncode
+        if hasattr(os, 'wait4'):
+            try:
+                pid, status, rusage = os.wait4(p.pid, os.WNOHANG)
+            except ChildProcessError:
+                # Reaped elsewhere, which subprocess.Popen.poll handles
+                pid = 0
+            if pid:
+                self.exits[p.pid] = _exit_from_status(status, rusage)
+                # subprocess.Popen doesn't wait for it again once it is set
+                p.returncode = self.exits[p.pid][0]
+        if p.poll() is None:
+            return None
+        self.end = time.monotonic()
+        return p.returncode
+
+    def result(self, returncode, processes=None):
+        # Returns the RunResult of the given exited processes, or of a
+        # process which was reaped elsewhere and exited with returncode
+        exits = [_exit_from_returncode(returncode)]
+        if processes is not None:
+            exits = [
+                self.exits.get(p.pid) or _exit_from_returncode(p.returncode)
+                for p in processes]
+        _, signal, core_dumped, _ = next(
+            (e for e in reversed(exits) if e[0]), exits[-1])
+        user_time = system_time = max_rss = None
+        rusages = [e[3] for e in exits]
+        if None not in rusages:
+            user_time = sum(r.ru_utime for r in rusages)
+            system_time = sum(r.ru_stime for r in rusages)
+            max_rss = max(r.ru_maxrss for r in rusages) * _max_rss_scale
+        end = time.monotonic() if self.end is None else self.end
+        return RunResult(
+            int(returncode), signal, core_dumped, end - self.start,
+            user_time, system_time, max_rss,
+            self.bytes[1], self.lines[1] + self.partial[1],
+            self.bytes[2], self.lines[2] + self.partial[2])
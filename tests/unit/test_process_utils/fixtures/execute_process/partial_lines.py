@@ -0,0 +1,11 @@
+import sys
+import time
+
+sys.stdout.write("out ")
+sys.stdout.flush()
+time.sleep(0.05)
+sys.stdout.write("1\nout 2\nout")
+sys.stdout.flush()
+time.sleep(0.05)
+sys.stdout.write(" 3")
+sys.stdout.flush()
@@ -1,8 +1,21 @@
+import asyncio
 import atexit
+import functools
 import os
 import sys
 import unittest
 
+from osrf_pycommon.process_utils import async_execute_pipeline
+from osrf_pycommon.process_utils import async_execute_process
+from osrf_pycommon.process_utils import async_wait_for_output
+from osrf_pycommon.process_utils import AsyncSubprocessProtocol
+from osrf_pycommon.process_utils import DecodedSubprocessProtocol
+from osrf_pycommon.process_utils import get_pty_manager
+from osrf_pycommon.process_utils import HeadTailProtocol
+from osrf_pycommon.process_utils import NotReadyError
+from osrf_pycommon.process_utils import OutputTimeline
+from osrf_pycommon.process_utils import RateLimiter
+
 from .impl_aep_asyncio import run
 from .impl_aep_asyncio import loop
 
@@ -14,9 +27,63 @@ test_script = os.path.join(
     'execute_process',
     'stdout_stderr_ordering.py')
 test_script_quoted = '"%s"' % test_script if ' ' in test_script else test_script
+partial_lines_script = os.path.join(
+    this_dir,
+    'fixtures',
+    'execute_process',
+    'partial_lines.py')
 python = sys.executable
 
 
+class ChunkProtocol(AsyncSubprocessProtocol):
+    def __init__(self, **kwargs):
+        self.stdout_chunks = []
+        AsyncSubprocessProtocol.__init__(self, **kwargs)
+        self.stdout_closed = asyncio.Future()
+
+    def on_stdout_received(self, data):
+        self.stdout_chunks.append(data)
+
+    def pipe_connection_lost(self, fd, exc):
+        AsyncSubprocessProtocol.pipe_connection_lost(self, fd, exc)
+        if fd == 1:
+            self.stdout_closed.set_result(None)
+
+
+class DecodedChunkProtocol(DecodedSubprocessProtocol):
+    def __init__(self, **kwargs):
+        self.stdout_chunks = []
+        DecodedSubprocessProtocol.__init__(self, errors='replace', **kwargs)
+        self.stdout_closed = asyncio.Future()
+
+    def on_stdout_received(self, data):
+        self.stdout_chunks.append(data)
+
+    def pipe_connection_lost(self, fd, exc):
+        DecodedSubprocessProtocol.pipe_connection_lost(self, fd, exc)
+        if fd == 1:
+            self.stdout_closed.set_result(None)
+
+
+async def run_line_buffered(
+    cmd, protocol_class=ChunkProtocol, line_buffered=True, timeline=None,
+    rate_limit=None, collapse_cr=False, fold_repeats=False, **kwargs
+):
+    def create_protocol(**protocol_kwargs):
+        return protocol_class(
+            line_buffered=line_buffered, timeline=timeline,
+            rate_limit=rate_limit, collapse_cr=collapse_cr,
+            fold_repeats=fold_repeats, **protocol_kwargs)
+
+    transport, protocol = await async_execute_process(
+        create_protocol, cmd, **kwargs)
+    retcode = await protocol.complete
+    # The last line is flushed when stdout is closed
+    await protocol.stdout_closed
+    transport.close()
+    return protocol.stdout_chunks, retcode
+
+
 # This atexit handler ensures the loop is closed after all tests were run.
 @atexit.register
 def close_loop():
@@ -101,3 +168,362 @@ class TestProcessUtilsAsyncExecuteProcess(unittest.TestCase):
         self.assertIn('err 1', stderr)
         self.assertIn('out 2', stdout)
         self.assertEqual(0, retcode)
+
+    def test_async_execute_process_line_buffered(self):
+        chunks, retcode = loop.run_until_complete(run_line_buffered(
+            [python, partial_lines_script]))
+        self.assertEqual(0, retcode)
+        self.assertEqual(b'out 1\nout 2\n', chunks[0])
+        self.assertEqual(b'out 1\nout 2\nout 3', b''.join(chunks))
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.endswith(b'\n'))
+
+    def test_async_execute_process_timeline(self):
+        timeline = OutputTimeline()
+        chunks, retcode = loop.run_until_complete(run_line_buffered(
+            [python, partial_lines_script], timeline=timeline))
+        self.assertEqual(0, retcode)
+        self.assertEqual(len(chunks), len(timeline))
+        self.assertEqual([len(chunk) for chunk in chunks], list(
+            timeline.sizes))
+        self.assertEqual([1] * len(chunks), list(timeline.streams))
+        self.assertEqual(sorted(timeline.times), list(timeline.times))
+
+    def test_async_execute_process_rate_limit(self):
+        cmd = [python, '-c', (
+            'for i in range(100000):\n'
+            '    print("debug %d" % i)\n'
+            'print("error")')]
+        for emulate_tty in (False, True):
+            rate_limit = RateLimiter(
+                lines_per_second=100, policy='sample', tail=1)
+            chunks, retcode = loop.run_until_complete(run_line_buffered(
+                cmd, rate_limit=rate_limit, emulate_tty=emulate_tty))
+            self.assertEqual(0, retcode)
+            lines = b''.join(chunks).splitlines()
+            self.assertLess(len(lines), 1000)
+            # Each line is either yielded or counted in a summary
+            summaries = [
+                int(line[1:].split()[0]) for line in lines
+                if line.endswith(b' lines suppressed]')]
+            self.assertTrue(summaries)
+            self.assertEqual(
+                100001, sum(summaries) + len(lines) - len(summaries))
+            # The sampled lines are in order, and the last line is kept
+            lines = [
+                line for line in lines if not line.endswith(b' suppressed]')]
+            self.assertEqual(b'error', lines[-1])
+            numbers = [int(line.split()[1]) for line in lines[:-1]]
+            self.assertEqual(sorted(numbers), numbers)
+        with self.assertRaises(ValueError):
+            AsyncSubprocessProtocol(rate_limit=rate_limit)
+
+    def test_async_execute_process_normalize(self):
+        cmd = [python, '-c', (
+            'import sys\n'
+            'for i in range(0, 101, 10):\n'
+            '    sys.stdout.write("\\rprogress %d%%" % i)\n'
+            'print()\n'
+            'for i in range(100):\n'
+            '    print("waiting")')]
+        progress = [b'progress %d%%' % i for i in range(0, 101, 10)]
+        for emulate_tty in (False, True):
+            chunks, retcode = loop.run_until_complete(run_line_buffered(
+                cmd, collapse_cr=True, fold_repeats=True,
+                emulate_tty=emulate_tty))
+            self.assertEqual(0, retcode)
+            self.assertEqual(
+                [b'progress 100%', b'waiting',
+                 b'[last line repeated 99 times]'],
+                b''.join(chunks).splitlines())
+            # Each option on its own
+            chunks, retcode = loop.run_until_complete(run_line_buffered(
+                cmd, collapse_cr=True, emulate_tty=emulate_tty))
+            self.assertEqual(0, retcode)
+            self.assertEqual(
+                [b'progress 100%'] + [b'waiting'] * 100,
+                b''.join(chunks).splitlines())
+            chunks, retcode = loop.run_until_complete(run_line_buffered(
+                cmd, fold_repeats=True, emulate_tty=emulate_tty))
+            self.assertEqual(0, retcode)
+            self.assertEqual(
+                [b''] + progress + [
+                    b'waiting', b'[last line repeated 99 times]'],
+                b''.join(chunks).splitlines())
+        with self.assertRaises(ValueError):
+            AsyncSubprocessProtocol(fold_repeats=True)
+
+    def test_async_execute_process_head_tail(self):
+        cmd = [python, '-c', (
+            'import sys\n'
+            'for i in range(1000):\n'
+            '    print(i, file=sys.stderr if i % 2 else sys.stdout)\n'
+            'sys.stdout.write("end")')]
+
+        async def run_head_tail(**kwargs):
+            transport, protocol = await async_execute_process(
+                functools.partial(HeadTailProtocol, head=2, tail=2), cmd,
+                **kwargs)
+            retcode = await protocol.captured
+            transport.close()
+            return retcode, protocol.capture
+
+        for emulate_tty in (False, True):
+            for stderr_to_stdout in (False, True):
+                retcode, capture = loop.run_until_complete(run_head_tail(
+                    emulate_tty=emulate_tty,
+                    stderr_to_stdout=stderr_to_stdout))
+                self.assertEqual(0, retcode)
+                self.assertEqual(2, len(capture.head))
+                self.assertEqual(b'end', capture.tail[-1])
+                self.assertEqual(997, capture.elided_lines)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_async_execute_pipeline(self):
+        cmds = [
+            [python, '-c', 'print("b\\na\\nc")'],
+            [python, '-c', (
+                'import sys\n'
+                'sys.stdout.writelines(sorted(sys.stdin))\n'
+                'print("sorted", file=sys.stderr)')],
+            [python, '-c', (
+                'import sys\n'
+                'sys.stdout.write(sys.stdin.read().upper())\n'
+                'sys.exit(3)')],
+        ]
+
+        async def run_pipeline(**kwargs):
+            transport, protocol = await async_execute_pipeline(
+                ChunkProtocol, cmds, **kwargs)
+            retcode = await protocol.pipeline_complete
+            await protocol.stdout_closed
+            transport.close()
+            return b''.join(protocol.stdout_chunks), retcode
+
+        for emulate_tty in (False, True):
+            output, retcode = loop.run_until_complete(run_pipeline(
+                emulate_tty=emulate_tty))
+            self.assertEqual(
+                [b'A', b'B', b'C', b'sorted'], sorted(output.split()))
+            self.assertEqual(3, retcode)
+            self.assertEqual([0, 0, 3], retcode.returncodes)
+
+    def test_async_execute_pipeline_close(self):
+        # Closing the transport stops all of the commands, not only the last
+        cmds = [
+            [python, '-c', 'import time; time.sleep(60)'],
+            [python, '-c', 'import sys; sys.stdin.read()'],
+        ]
+
+        async def close_pipeline():
+            transport, protocol = await async_execute_pipeline(
+                ChunkProtocol, cmds)
+            self.assertEqual(
+                transport.transports[-1].get_pid(), transport.get_pid())
+            transport.close()
+            return await asyncio.wait_for(protocol.pipeline_complete, 10)
+
+        retcode = loop.run_until_complete(close_pipeline())
+        self.assertEqual(2, len(retcode.returncodes))
+        self.assertNotIn(0, retcode.returncodes)
+
+    def test_async_execute_process_run_result(self):
+        cmd = [python, '-c', (
+            'import sys\n'
+            'for i in range(1000):\n'
+            '    print(i, file=sys.stderr if i % 2 else sys.stdout)\n'
+            'sys.stdout.write("end")\n'
+            'sys.exit(3)')]
+
+        async def run_result(**kwargs):
+            transport, protocol = await async_execute_process(
+                ChunkProtocol, cmd, **kwargs)
+            result = await protocol.run_result
+            transport.close()
+            return result
+
+        for emulate_tty in (False, True):
+            result = loop.run_until_complete(run_result(
+                emulate_tty=emulate_tty, stderr_to_stdout=False))
+            self.assertEqual(3, result.returncode)
+            self.assertIsNone(result.signal)
+            self.assertEqual((501, 500), (
+                result.stdout_lines, result.stderr_lines))
+            self.assertGreater(result.stdout_bytes, 0)
+            self.assertGreater(result.wall_time, 0)
+            self.assertIsNone(result.max_rss)
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), "Linux only")
+    def test_async_execute_process_resource_sample(self):
+        cmd = [python, '-c', (
+            'import time\n'
+            'data = bytearray(32 * 1024 * 1024)\n'
+            'time.sleep(0.5)')]
+
+        class SampleProtocol(ChunkProtocol):
+            def __init__(self, **kwargs):
+                ChunkProtocol.__init__(self, resource_interval=0.1, **kwargs)
+                self.samples = []
+
+            def on_resource_sample(self, sample):
+                self.samples.append(sample)
+
+        async def run_samples():
+            transport, protocol = await async_execute_process(
+                SampleProtocol, cmd)
+            await protocol.run_result
+            transport.close()
+            return transport.get_pid(), protocol.samples
+
+        pid, samples = loop.run_until_complete(run_samples())
+        self.assertGreaterEqual(len(samples), 3)
+        self.assertEqual({pid}, {sample.pid for sample in samples})
+        self.assertGreater(samples[-1].rss, 32 * 1024 * 1024)
+        with self.assertRaises(ValueError):
+            AsyncSubprocessProtocol(resource_interval=0)
+
+        # All of the commands of a pipeline are sampled, here the memory is
+        # used by the first one
+        async def run_pipeline_samples():
+            transport, protocol = await async_execute_pipeline(
+                SampleProtocol,
+                [cmd, [python, '-c', 'import sys; sys.stdin.read()']])
+            await protocol.pipeline_complete
+            await protocol.run_result
+            transport.close()
+            return transport.get_pid(), protocol.samples
+
+        pid, samples = loop.run_until_complete(run_pipeline_samples())
+        self.assertEqual({pid}, {sample.pid for sample in samples})
+        self.assertEqual(2, samples[0].processes)
+        self.assertGreater(samples[0].rss, 32 * 1024 * 1024)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_async_execute_process_pty_fallback(self):
+        cmd = [python, '-c', 'import os; print(os.isatty(1))']
+        manager = get_pty_manager()
+        fallbacks = manager.fallbacks
+
+        async def run_both():
+            # One of them gets the only pty, the other falls back to pipes,
+            # whichever starts first
+            return await asyncio.gather(
+                run_line_buffered(cmd, emulate_tty=True),
+                run_line_buffered(cmd, emulate_tty=True))
+
+        manager.max_ptys = 1
+        try:
+            results = loop.run_until_complete(run_both())
+        finally:
+            manager.max_ptys = None
+        self.assertEqual(
+            [([b'False\n'], 0), ([b'True\r\n'], 0)], sorted(results))
+        self.assertEqual(fallbacks + 1, manager.fallbacks)
+        self.assertEqual(0, manager.in_use)
+
+    def test_async_wait_for_output(self):
+        cmd = [python, '-c', (
+            'import sys, time\n'
+            'print("starting", flush=True)\n'
+            'time.sleep(0.2)\n'
+            'print("listening on 1234", file=sys.stderr, flush=True)\n'
+            'time.sleep(0.2)\n'
+            'print("serving")')]
+
+        async def run_server(cmd, pattern, **kwargs):
+            transport, protocol, ready = await async_wait_for_output(
+                ChunkProtocol, cmd, pattern, **kwargs)
+            ready_chunks = list(protocol.stdout_chunks)
+            retcode = await protocol.complete
+            await protocol.stdout_closed
+            transport.close()
+            return ready, ready_chunks, protocol.stdout_chunks, retcode
+
+        for emulate_tty in (False, True):
+            ready, ready_chunks, chunks, retcode = loop.run_until_complete(
+                run_server(
+                    cmd, br'listening on (\d+)', timeout=10,
+                    emulate_tty=emulate_tty))
+            self.assertEqual(b'1234', ready.match.group(1))
+            self.assertGreaterEqual(ready.time_to_ready, 0.2)
+            self.assertNotIn(b'serving', b''.join(ready_chunks))
+            self.assertEqual(
+                [b'starting', b'listening on 1234', b'serving'],
+                b''.join(chunks).splitlines())
+            self.assertEqual(0, retcode)
+
+        with self.assertRaises(NotReadyError) as context:
+            loop.run_until_complete(run_server(
+                [python, '-c', 'import time; time.sleep(10)'], 'ready',
+                timeout=0.2))
+        self.assertEqual('timeout', context.exception.reason)
+        # The transport is closed, as it is not returned
+        protocols = []
+
+        def create_protocol(**kwargs):
+            protocols.append(ChunkProtocol(**kwargs))
+            return protocols[-1]
+
+        with self.assertRaises(NotReadyError) as context:
+            loop.run_until_complete(async_wait_for_output(
+                create_protocol, [python, '-c', 'exit(2)'], 'ready'))
+        self.assertEqual('exited', context.exception.reason)
+        self.assertTrue(protocols[0].transport.is_closing())
+        self.assertEqual(2, context.exception.returncode)
+
+    def test_async_execute_process_decoded(self):
+        # The e with an acute accent is split across two writes
+        cmd = [python, '-c', (
+            'import sys, time\n'
+            'sys.stdout.buffer.write(b"caf\\xc3")\n'
+            'sys.stdout.flush()\n'
+            'time.sleep(0.1)\n'
+            'sys.stdout.buffer.write(b"\\xa9\\n\\xff")')]
+        for line_buffered in (False, True):
+            chunks, retcode = loop.run_until_complete(run_line_buffered(
+                cmd, DecodedChunkProtocol, line_buffered,
+                stderr_to_stdout=True))
+            self.assertEqual(0, retcode)
+            self.assertEqual('caf\xe9\n\ufffd', ''.join(chunks))
+        with self.assertRaises(LookupError):
+            DecodedSubprocessProtocol(encoding='no-such-encoding')
+
+    def test_async_execute_process_decoded_flush(self):
+        # The incomplete character left at the end is passed on before the
+        # run_result is set, also when the output is only closed after the
+        # process has exited, here by a child which inherited it
+        cmd = [python, '-c', (
+            'import subprocess, sys\n'
+            'sys.stdout.buffer.write(b"ok\\xc3")\n'
+            'sys.stdout.flush()\n'
+            'subprocess.Popen([sys.executable, "-c", '
+            '"import time; time.sleep(0.2)"])')]
+
+        class DoneProtocol(DecodedSubprocessProtocol):
+            def __init__(self, **kwargs):
+                DecodedSubprocessProtocol.__init__(
+                    self, errors='replace', **kwargs)
+                self.received = []
+
+            def on_stdout_received(self, data):
+                self.received.append((data, self.run_result.done()))
+
+        async def run_decoded():
+            transport, protocol = await async_execute_process(
+                DoneProtocol, cmd)
+            await protocol.run_result
+            transport.close()
+            return protocol.received
+
+        received = loop.run_until_complete(run_decoded())
+        self.assertEqual('ok\ufffd', ''.join(data for data, _ in received))
+        self.assertEqual([False], list({done for _, done in received}))
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_async_execute_process_line_buffered_with_emulation(self):
+        chunks, retcode = loop.run_until_complete(run_line_buffered(
+            [python, partial_lines_script], emulate_tty=True))
+        self.assertEqual(0, retcode)
+        self.assertEqual(b'out 1\r\nout 2\r\nout 3', b''.join(chunks))
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.endswith(b'\n'))
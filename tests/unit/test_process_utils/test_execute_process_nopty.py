@@ -1,5 +1,7 @@
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 from osrf_pycommon.process_utils import execute_process_nopty
@@ -19,30 +21,6 @@ nl = os.linesep.encode()
 
 
 class TestProcessUtilsExecuteNoPty(unittest.TestCase):
-    def test__process_incomming_lines(self):
-        pil = execute_process_nopty._process_incoming_lines
-
-        # Test with no left overs and no new incoming
-        left_overs = b''
-        incoming = b''
-        self.assertEqual((None, left_overs), pil(incoming, left_overs))
-
-        # Test with left overs, but no new incoming
-        left_overs = b'something'
-        incoming = b''
-        self.assertEqual((b'', left_overs), pil(incoming, left_overs))
-
-        # Test with no left overs, but new incoming
-        left_overs = b''
-        incoming = nl.join([b'one', b'two'])
-        self.assertEqual((b'one' + nl, b'two'), pil(incoming, left_overs))
-
-        # Test with left overs and new incoming with prefixed nl
-        left_overs = b'something'
-        incoming = (nl + b'else')
-        expected = (b'something' + nl, b'else')
-        self.assertEqual(expected, pil(incoming, left_overs))
-
     def test__execute_process_nopty_combined_unbuffered(self):
         exc_nopty = execute_process_nopty._execute_process_nopty
 
@@ -134,3 +112,80 @@ out 2
         expected = sorted(expected.splitlines(True))
         result = sorted(result.splitlines(True))
         self.assertEqual(expected, result)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test__execute_process_nopty_high_fds(self):
+        import resource
+        exc_nopty = execute_process_nopty._execute_process_nopty
+
+        # Occupy enough fds that the pipes to the subprocess are numbered
+        # above FD_SETSIZE, which select.select cannot handle
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < 1200:
+            self.skipTest("not enough file descriptors available")
+        dups = []
+        try:
+            while not dups or dups[-1] < 1100:
+                dups.append(os.dup(0))
+            cmd = [python, test_script]
+            result = b""
+            for out, err, ret in exc_nopty(cmd, None, None, False, False):
+                if out is not None:
+                    result += out
+                if err is not None:
+                    result += err
+                if ret is not None:
+                    break
+        finally:
+            for fd in dups:
+                os.close(fd)
+        self.assertEqual(0, ret)
+        self.assertIn(b"out 2", result)
+
+    def test__job_adaptive_read_size(self):
+        r, w = os.pipe()
+        try:
+            job = execute_process_nopty._Job(0, None, [r])
+            os.write(w, b'x' * 4096)
+            self.assertEqual(1024, len(job.read(r, r)))
+            self.assertEqual(2048, job.read_sizes[r])
+            self.assertEqual(2048, len(job.read(r, r)))
+            self.assertEqual(4096, job.read_sizes[r])
+            self.assertEqual(1024, len(job.read(r, r)))
+            self.assertEqual(4096, job.read_sizes[r])
+            os.write(w, b'x' * 10)
+            self.assertEqual(10, len(job.read(r, r)))
+            self.assertEqual(2048, job.read_sizes[r])
+        finally:
+            os.close(r)
+            os.close(w)
+
+    @unittest.skipIf(not hasattr(os, 'splice'), "os.splice not available")
+    def test__job_mirror_splice(self):
+        r, w = os.pipe()
+        try:
+            with tempfile.TemporaryFile('w+b') as f:
+                job = execute_process_nopty._Job(
+                    0, None, [r], reuse_buffer=True, mirror=f)
+                self.assertEqual(0, job.mirror.offset)
+                os.write(w, b'abc')
+                self.assertEqual(b'abc', bytes(job.read(r, r)))
+                os.write(w, b'def')
+                self.assertEqual(b'def', bytes(job.read(r, r)))
+                self.assertEqual(6, job.mirror.offset)
+                f.seek(0)
+                self.assertEqual(b'abcdef', f.read())
+            # Files which cannot be read back are written to
+            tmp_dir = tempfile.mkdtemp()
+            path = os.path.join(tmp_dir, 'out.log')
+            with open(path, 'wb') as f:
+                job = execute_process_nopty._Job(0, None, [r], mirror=f)
+                self.assertIsNone(job.mirror.offset)
+                os.write(w, b'abc')
+                self.assertEqual(b'abc', job.read(r, r))
+            with open(path, 'rb') as f:
+                self.assertEqual(b'abc', f.read())
+            shutil.rmtree(tmp_dir)
+        finally:
+            os.close(r)
+            os.close(w)
@@ -0,0 +1,55 @@
+import unittest
+
+from osrf_pycommon.process_utils.head_tail import HeadTailCapture
+
+
+class TestProcessUtilsHeadTail(unittest.TestCase):
+    def test_head_tail(self):
+        capture = HeadTailCapture(head=2, tail=3)
+        for i in range(10):
+            capture.add(b'line %d\n' % i)
+        self.assertEqual([b'line 0\n', b'line 1\n'], capture.head)
+        self.assertEqual(
+            [b'line 7\n', b'line 8\n', b'line 9\n'], list(capture.tail))
+        self.assertEqual(5, capture.elided_lines)
+        self.assertEqual(35, capture.elided_bytes)
+
+    def test_head_tail_joined_lines(self):
+        # Several lines at once, as yielded by execute_process
+        capture = HeadTailCapture(head=2, tail=3)
+        capture.add(b''.join(b'line %d\n' % i for i in range(5)))
+        capture.add(b''.join(b'line %d\n' % i for i in range(5, 10)))
+        capture.add(b'last')
+        self.assertEqual([b'line 0\n', b'line 1\n'], capture.head)
+        self.assertEqual([b'line 8\n', b'line 9\n', b'last'], list(
+            capture.tail))
+        self.assertEqual(6, capture.elided_lines)
+        self.assertEqual(42, capture.elided_bytes)
+
+    def test_head_tail_short(self):
+        capture = HeadTailCapture(head=2, tail=3)
+        capture.add(b'a\nb\nc\n')
+        self.assertEqual([b'a\n', b'b\n'], capture.head)
+        self.assertEqual([b'c\n'], list(capture.tail))
+        self.assertEqual(0, capture.elided_lines)
+
+    def test_head_tail_zero(self):
+        capture = HeadTailCapture(head=0, tail=0)
+        capture.add(b'a\nb\n')
+        self.assertEqual([], capture.head)
+        self.assertEqual([], list(capture.tail))
+        self.assertEqual(2, capture.elided_lines)
+        self.assertEqual(4, capture.elided_bytes)
+        with self.assertRaises(ValueError):
+            HeadTailCapture(head=-1)
+
+    def test_head_tail_line_endings(self):
+        # Only \n, \r and \r\n end a line, also in decoded output, where
+        # elided_bytes counts characters
+        for data in (b'a\x0cb\nc\x0b\r\nd\re', 'a\x0cb\n\u2028\x85\r\nd\re'):
+            capture = HeadTailCapture(head=1, tail=1)
+            capture.add(data)
+            self.assertEqual([data[:4]], capture.head)
+            self.assertEqual([data[-1:]], list(capture.tail))
+            self.assertEqual(2, capture.elided_lines)
+            self.assertEqual(6, capture.elided_bytes)
@@ -1,12 +1,32 @@
 from __future__ import unicode_literals
 
+import io
 import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
+from osrf_pycommon.process_utils import execute_process_nopty
+from osrf_pycommon.process_utils import get_pty_manager
 from osrf_pycommon.process_utils import impl
+from osrf_pycommon.process_utils import NotReadyError
+from osrf_pycommon.process_utils import OutputTimeline
+from osrf_pycommon.process_utils import RateLimiter
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 
+test_script = os.path.join(
+    this_dir,
+    'fixtures',
+    'execute_process',
+    'stdout_stderr_ordering.py')
+python = sys.executable
+nl = os.linesep.encode()
+
 
 class TestProcessUtilsImpl(unittest.TestCase):
     def test_which(self):
@@ -49,3 +69,915 @@ class TestProcessUtilsImpl(unittest.TestCase):
         finally:
             os.environ['PATH'] = orig_path
         which(str("exc1.exe"), path=paths)  # Make sure unicode/str works
+
+    def _run_execute_processes(self, cmds, **kwargs):
+        outputs = [b''] * len(cmds)
+        if kwargs.get('encoding'):
+            outputs = [''] * len(cmds)
+        retcodes = [None] * len(cmds)
+        for index, out, err, ret in impl.execute_processes(cmds, **kwargs):
+            self.assertIsNone(retcodes[index])
+            if ret is not None:
+                retcodes[index] = ret
+                continue
+            outputs[index] += out if out is not None else err
+        return outputs, retcodes
+
+    def test_execute_processes(self):
+        cmds = [[python, test_script]] * 5
+        cmds.append([python, '-c', 'import sys; sys.exit(3)'])
+        outputs, retcodes = self._run_execute_processes(cmds, max_parallel=2)
+        self.assertEqual([0] * 5 + [3], retcodes)
+        for output in outputs[:5]:
+            self.assertEqual(
+                [b'err 1', b'out 1', b'out 2'], sorted(output.splitlines()))
+        self.assertEqual(b'', outputs[5])
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_processes_with_emulation(self):
+        cmds = [[python, test_script]] * 3
+        outputs, retcodes = self._run_execute_processes(
+            cmds, emulate_tty=True, stderr_to_stdout=True)
+        self.assertEqual([0] * 3, retcodes)
+        for output in outputs:
+            self.assertEqual(b'out 1\r\nerr 1\r\nout 2\r\n', output)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_processes_pty_fallback(self):
+        manager = get_pty_manager()
+        fallbacks = manager.fallbacks
+        manager.max_ptys = 1
+        try:
+            cmds = [[python, '-c', 'import os; print(os.isatty(1))']] * 3
+            outputs, retcodes = self._run_execute_processes(
+                cmds, emulate_tty=True, stderr_to_stdout=True)
+        finally:
+            manager.max_ptys = None
+        self.assertEqual([0] * 3, retcodes)
+        # The first one has the only pty, the others fall back to pipes
+        self.assertEqual(
+            [b'True\r\n', b'False\n', b'False\n'], outputs)
+        self.assertEqual(fallbacks + 2, manager.fallbacks)
+        self.assertEqual(0, manager.in_use)
+
+    def test_execute_processes_max_parallel(self):
+        with self.assertRaises(ValueError):
+            impl.execute_processes([['ls']], max_parallel=0)
+
+    def test_execute_process_split_chunks(self):
+        # Binary data, in which new line bytes have no meaning
+        cmd = [python, '-c', (
+            'import sys; '
+            'sys.stdout.buffer.write(bytes(range(256)) * 16384)')]
+        expected = bytes(range(256)) * 16384
+        for read_size in (None, 1000):
+            output = bytearray()
+            reads = 0
+            for out, err, ret in impl.execute_process_split(
+                cmd, mode='chunks', read_size=read_size
+            ):
+                if ret is not None:
+                    self.assertEqual(0, ret)
+                    break
+                self.assertIsNone(err)
+                if read_size is not None:
+                    self.assertLessEqual(len(out), read_size)
+                output += out
+                reads += 1
+            self.assertEqual(expected, output)
+            if read_size is None:
+                # The read size grows while the pipe is full
+                self.assertLess(reads, len(expected) // 1024)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_reuse_buffer(self):
+        for mode in ('lines', 'chunks'):
+            output = b''
+            for line in impl.execute_process(
+                [python, test_script], mode=mode, reuse_buffer=True
+            ):
+                if isinstance(line, int):
+                    self.assertEqual(0, line)
+                    break
+                # Only valid until the next iteration, so copy it
+                output += bytes(line)
+            self.assertEqual(
+                [b'err 1', b'out 1', b'out 2'], sorted(output.splitlines()))
+
+    def test_execute_process_to_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'out.log')
+            result = impl.execute_process_to_file(
+                [python, test_script], path, buffer_size=4)
+            self.assertEqual(0, result.returncode)
+            with open(path, 'rb') as f:
+                output = f.read()
+            self.assertEqual(
+                [b'err 1', b'out 1', b'out 2'], sorted(output.splitlines()))
+            self.assertEqual(len(output), result.stdout_bytes)
+            self.assertEqual(3, result.stdout_lines)
+            self.assertEqual((0, 0), result[3:])
+
+            stderr_path = os.path.join(tmp_dir, 'err.log')
+            cmd = [python, '-c', (
+                'import sys; '
+                'sys.stdout.write("a\\nb"); sys.stderr.write("c\\n"); '
+                'sys.exit(2)')]
+            result = impl.execute_process_to_file(
+                cmd, path, stderr_path=stderr_path, append=True)
+            expected = impl.SpoolResult(
+                2, len(b'a' + nl + b'b'), 2, len(b'c' + nl), 1)
+            self.assertEqual(expected, result)
+            with open(path, 'rb') as f:
+                self.assertTrue(f.read().endswith(output + b'a' + nl + b'b'))
+            with open(stderr_path, 'rb') as f:
+                self.assertEqual(b'c' + nl, f.read())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_to_file_pty(self):
+        # With a pty for each of stdout and stderr, they are kept apart
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'out.log')
+            stderr_path = os.path.join(tmp_dir, 'err.log')
+            cmd = [python, '-c', (
+                'import sys; '
+                'sys.stdout.write("out\\n"); sys.stdout.flush(); '
+                'sys.stderr.write("err\\n")')]
+            result = impl.execute_process_to_file(
+                cmd, path, stderr_path=stderr_path, emulate_tty=True)
+            self.assertEqual(impl.SpoolResult(0, 5, 1, 5, 1), result)
+            with open(path, 'rb') as f:
+                self.assertEqual(b'out\r\n', f.read())
+            with open(stderr_path, 'rb') as f:
+                self.assertEqual(b'err\r\n', f.read())
+            # Also in the output, and its counts, of execute_process_split
+            output = list(impl.execute_process_split(cmd, emulate_tty=True))
+            self.assertEqual(
+                b'out\r\n', b''.join(out for out, _, _ in output if out))
+            self.assertEqual(
+                b'err\r\n', b''.join(err for _, err, _ in output if err))
+            result = output[-1][2].result
+            self.assertEqual((5, 5), (result.stdout_bytes, result.stderr_bytes))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_execute_process_filter(self):
+        cmd = [python, '-c', (
+            'for i in range(1000):\n'
+            '    print("[%3d%%] progress" % (i // 10))\n'
+            '    if i % 100 == 0:\n'
+            '        print("warning %d" % i)')]
+        output = list(impl.execute_process(cmd, exclude=br'^\[ *\d+%\]'))
+        ret = output[-1]
+        self.assertEqual(0, ret)
+        self.assertEqual(
+            [b'warning %d' % i for i in range(0, 1000, 100)],
+            b''.join(output[:-1]).splitlines())
+        self.assertEqual((10, 1000), (ret.matched_lines, ret.dropped_lines))
+        output = list(impl.execute_process(
+            cmd, include=['warning [1-3]00$'], encoding='utf-8'))
+        self.assertEqual(
+            'warning 100\nwarning 200\nwarning 300\n'.replace(
+                '\n', os.linesep), ''.join(output[:-1]))
+        self.assertEqual(
+            (3, 1007), (output[-1].matched_lines, output[-1].dropped_lines))
+        # Lines end in \r\n on a pty, and $ still matches before that
+        output = list(impl.execute_process(
+            cmd, include=['warning [1-3]00$'], emulate_tty=True))
+        self.assertEqual(
+            [b'warning 100', b'warning 200', b'warning 300'],
+            b''.join(output[:-1]).splitlines())
+
+    def test_execute_process_rate_limit(self):
+        cmd = [python, '-c', (
+            'for i in range(100000):\n'
+            '    print("debug %d" % i)\n'
+            'print("error")')]
+        rate_limit = RateLimiter(lines_per_second=100, tail=1)
+        output = list(impl.execute_process(cmd, rate_limit=rate_limit))
+        self.assertEqual(0, output[-1])
+        lines = b''.join(output[:-1]).splitlines()
+        self.assertLess(len(lines), 1000)
+        self.assertEqual(b'debug 0', lines[0])
+        # Each line is either yielded or counted in a summary
+        summaries = [
+            int(line[1:].split()[0]) for line in lines
+            if line.endswith(b' lines suppressed]')]
+        self.assertTrue(summaries)
+        self.assertEqual(
+            100001, sum(summaries) + len(lines) - len(summaries))
+        # The lines are in order, and the last line is kept
+        lines = [
+            line for line in lines if not line.endswith(b' suppressed]')]
+        self.assertEqual(b'error', lines[-1])
+        numbers = [int(line.split()[1]) for line in lines[:-1]]
+        self.assertEqual(sorted(numbers), numbers)
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(
+                cmd, mode='chunks', rate_limit=rate_limit)
+
+    def test_execute_process_normalize(self):
+        cmd = [python, '-c', (
+            'import sys, time\n'
+            'for i in range(0, 101, 10):\n'
+            '    sys.stdout.write("\\rprogress %d%%" % i)\n'
+            '    sys.stdout.flush()\n'
+            '    time.sleep(0.01)\n'
+            'print()\n'
+            'for i in range(100):\n'
+            '    print("waiting")\n'
+            'print("done")')]
+        for emulate_tty in (False, True):
+            output = list(impl.execute_process(
+                cmd, emulate_tty=emulate_tty, collapse_cr=True,
+                fold_repeats=True))
+            self.assertEqual(0, output[-1])
+            self.assertEqual(
+                [b'progress 100%', b'waiting',
+                 b'[last line repeated 99 times]', b'done'],
+                b''.join(output[:-1]).splitlines())
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(cmd, mode='chunks', collapse_cr=True)
+
+    def test_execute_process_progress(self):
+        # Each update is yielded once the next one arrives, not at the end
+        cmd = [python, '-c', (
+            'import sys, time\n'
+            'for i in range(5):\n'
+            '    sys.stdout.write("%d%%\\r" % (i * 25))\n'
+            '    sys.stdout.flush()\n'
+            '    time.sleep(0.3)\n'
+            'print("done")')]
+        start = time.monotonic()
+        arrivals = []
+        for line in impl.execute_process(cmd):
+            arrivals.append((line, time.monotonic() - start))
+        self.assertEqual(0, arrivals.pop()[0])
+        self.assertEqual(
+            [b'0%\r', b'25%\r', b'50%\r', b'75%\r', b'100%\r', b'done\n'],
+            b''.join(line for line, _ in arrivals).splitlines(True))
+        self.assertEqual(b'0%\r', arrivals[0][0])
+        self.assertLess(arrivals[0][1], arrivals[-1][1] - 0.6)
+
+    def test_execute_process_mirror(self):
+        cmd = [python, '-c', (
+            'import sys\n'
+            'for i in range(1000):\n'
+            '    print("line %d" % i)\n'
+            'sys.stdout.write("last")')]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'out.log')
+            # Spliced into a file which can be read back, or written
+            for mode in ('w+b', 'wb'):
+                with open(path, mode) as f:
+                    f.write(b'before\n')
+                    output = list(impl.execute_process(cmd, mirror=f))
+                self.assertEqual(0, output[-1])
+                with open(path, 'rb') as f:
+                    self.assertEqual(
+                        b'before\n' + b''.join(output[:-1]), f.read())
+        finally:
+            shutil.rmtree(tmp_dir)
+        with tempfile.TemporaryFile('w+b') as f:
+            output = list(impl.execute_process_split(
+                [python, test_script], mirror=f.fileno()))
+            f.seek(0)
+            self.assertEqual(
+                sorted(f.read().splitlines()),
+                sorted(b''.join(out or err for out, err, ret in output
+                                if ret is None).splitlines()))
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_mirror_emulate_tty(self):
+        with tempfile.TemporaryFile('w+b') as f:
+            output = list(impl.execute_process(
+                [python, test_script], emulate_tty=True, mirror=f))
+            self.assertEqual(0, output[-1])
+            f.seek(0)
+            self.assertEqual(b''.join(output[:-1]), f.read())
+
+    def test_execute_process_max_line_bytes(self):
+        cmd = [python, '-c', (
+            'import sys; '
+            'sys.stdout.write("x" * 100000 + "\\nshort\\n" + "y" * 50000)')]
+        for overflow in ('split', 'truncate'):
+            lines = []
+            for line in impl.execute_process(
+                cmd, max_line_bytes=1000, overflow=overflow
+            ):
+                if isinstance(line, int):
+                    self.assertEqual(0, line)
+                    break
+                lines.append(line)
+            output = b''.join(lines)
+            if overflow == 'split':
+                self.assertEqual(
+                    b'x' * 100000 + nl + b'short' + nl + b'y' * 50000, output)
+            else:
+                self.assertEqual(b''.join([
+                    b'x' * 1000, b' [99000 bytes truncated]', nl,
+                    b'short', nl,
+                    b'y' * 1000, b' [49000 bytes truncated]']), output)
+
+    def test_execute_process_run_result(self):
+        cmd = [python, '-c', (
+            'import sys\n'
+            'for i in range(1000):\n'
+            '    print("line %d" % i)\n'
+            'print("error", file=sys.stderr)\n'
+            'sys.stdout.write("last")\n'
+            'sys.exit(2)')]
+        output = list(impl.execute_process_split(cmd))
+        ret = output[-1][2]
+        self.assertEqual(2, ret)
+        out = b''.join(o for o, _, r in output if o is not None)
+        result = ret.result
+        self.assertEqual((2, None, False), result[:3])
+        self.assertEqual((len(out), 1001), result[7:9])
+        self.assertEqual((len(b'error' + nl), 1), result[9:])
+        self.assertGreater(result.wall_time, 0)
+        if not sys.platform.startswith("win"):
+            self.assertGreater(result.user_time + result.system_time, 0)
+            self.assertGreater(result.max_rss, 0)
+        # Everything goes to stdout when combined
+        ret = list(impl.execute_process(cmd))[-1]
+        self.assertEqual(1002, ret.result.stdout_lines)
+        self.assertEqual(0, ret.result.stderr_bytes)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_run_result_signal(self):
+        cmd = [python, '-c', 'import time; time.sleep(60)']
+        ret = list(impl.execute_process(cmd, timeout=0.1))[-1]
+        self.assertEqual('timeout', ret.reason)
+        self.assertEqual(signal.SIGTERM, ret.result.signal)
+        self.assertIsNotNone(ret.result.user_time)
+        cmds = [
+            [python, '-c', 'pass'],
+            [python, '-c', 'import os; os.kill(os.getpid(), 9)'],
+            [python, '-c', 'import sys; sys.stdin.read()'],
+        ]
+        ret = list(impl.execute_pipeline(cmds))[-1][2]
+        self.assertEqual([0, -signal.SIGKILL, 0], ret.returncodes)
+        self.assertEqual(signal.SIGKILL, ret.result.signal)
+        self.assertFalse(ret.result.core_dumped)
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), "Linux only")
+    def test_execute_process_resource_sample(self):
+        cmd = [python, '-c', (
+            'import time\n'
+            'data = bytearray(32 * 1024 * 1024)\n'
+            'end = time.time() + 0.5\n'
+            'while time.time() < end:\n'
+            '    pass\n'
+            'print("done")')]
+        samples = []
+        output = list(impl.execute_process(
+            cmd, on_resource_sample=samples.append, resource_interval=0.1))
+        self.assertEqual(0, output[-1])
+        self.assertGreaterEqual(len(samples), 3)
+        self.assertTrue(all(s.pid == samples[0].pid for s in samples))
+        self.assertGreater(samples[-1].rss, 32 * 1024 * 1024)
+        self.assertGreater(max(s.cpu_percent for s in samples), 10)
+        # Each command's samples are passed with its index
+        samples = []
+        output = list(impl.execute_processes(
+            [cmd, cmd], on_resource_sample=lambda *args: samples.append(args),
+            resource_interval=0.1))
+        self.assertEqual({0, 1}, {index for index, _ in samples})
+        self.assertEqual(2, len({sample.pid for _, sample in samples}))
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(
+                cmd, on_resource_sample=print, resource_interval=0)
+
+    def test_execute_process_delimiter(self):
+        cmd = [python, '-c', (
+            'import sys\n'
+            'out = getattr(sys.stdout, "buffer", sys.stdout)\n'
+            'for i in range(1000):\n'
+            '    out.write(b"file %d\\n\\x0b\\r\\0" % i)\n'
+            'out.write(b"last")')]
+        output = list(impl.execute_process(cmd, delimiter=b'\0'))
+        self.assertEqual(0, output[-1])
+        # Each batch of records read ends with a delimiter, except the last
+        batches = [bytes(batch) for batch in output[:-1]]
+        self.assertTrue(all(batch.endswith(b'\0') for batch in batches[:-1]))
+        self.assertEqual(
+            [b'file %d\n\x0b\r' % i for i in range(1000)] + [b'last'],
+            b''.join(batches).split(b'\0'))
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(cmd, mode='chunks', delimiter=b'\0')
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(cmd, delimiter=b'')
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(
+                cmd, delimiter=b'\0', exclude=b'file')
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_coalesce(self):
+        cmd = [python, '-u', '-c', (
+            'import time\n'
+            'for i in range(200):\n'
+            '    print(i)\n'
+            '    time.sleep(0.001)')]
+        expected = b''.join(str(i).encode() + nl for i in range(200))
+        for emulate_tty in (False, True):
+            output = list(impl.execute_process(
+                cmd, emulate_tty=emulate_tty, coalesce_ms=100))
+            self.assertEqual(0, output[-1])
+            self.assertEqual(
+                expected, b''.join(output[:-1]).replace(b'\r\n', nl))
+            # Far fewer items than lines are yielded
+            self.assertLess(len(output), 20)
+        # Gathered output is only timed for a timeline
+        monotonic_ns = execute_process_nopty._monotonic_ns
+        execute_process_nopty._monotonic_ns = None
+        try:
+            outputs, retcodes = self._run_execute_processes(
+                [cmd, cmd], coalesce_ms=100)
+        finally:
+            execute_process_nopty._monotonic_ns = monotonic_ns
+        self.assertEqual([0, 0], retcodes)
+        self.assertEqual([expected, expected], outputs)
+
+    def test_execute_process_timeline(self):
+        timeline = OutputTimeline()
+        output = list(impl.execute_process_split(
+            [python, test_script], timeline=timeline))
+        self.assertEqual(0, output[-1][2])
+        output = output[:-1]
+        self.assertEqual(len(output), len(timeline))
+        records = zip(output, timeline)
+        for i, ((out, err, _), (seq, _, job, stream, size)) in enumerate(
+            records
+        ):
+            self.assertEqual(i, seq)
+            self.assertEqual(0, job)
+            self.assertEqual(1 if out is not None else 2, stream)
+            self.assertEqual(len(out or err), size)
+        self.assertEqual(sorted(timeline.times), list(timeline.times))
+        # Rebuild the merged output
+        lines = b''.join(out or err for out, err, _ in output).splitlines()
+        self.assertEqual([b'err 1', b'out 1', b'out 2'], sorted(lines))
+        # One timeline shared by several subprocesses
+        timeline = OutputTimeline()
+        outputs, retcodes = self._run_execute_processes(
+            [[python, test_script]] * 2, timeline=timeline, coalesce_ms=10)
+        self.assertEqual([0, 1], sorted(set(timeline.jobs)))
+        self.assertEqual(
+            sum(len(output) for output in outputs), sum(timeline.sizes))
+
+    def test_execute_process_head_tail(self):
+        cmd = [python, '-c', (
+            'for i in range(1000):\n'
+            '    print(i)')]
+        result = impl.execute_process_head_tail(cmd, head=3, tail=2)
+        self.assertEqual(0, result.returncode)
+        self.assertEqual([b'0' + nl, b'1' + nl, b'2' + nl], result.head)
+        self.assertEqual([b'998' + nl, b'999' + nl], result.tail)
+        self.assertEqual(995, result.elided_lines)
+        self.assertEqual(
+            sum(len(str(i)) + len(nl) for i in range(3, 998)),
+            result.elided_bytes)
+        # The output options apply before the lines are kept
+        result = impl.execute_process_head_tail(
+            cmd, head=2, tail=2, exclude=br'^\d*[02468]$',
+            encoding='ascii')
+        self.assertEqual(['1' + nl.decode(), '3' + nl.decode()], result.head)
+        self.assertEqual(
+            ['997' + nl.decode(), '999' + nl.decode()], result.tail)
+        self.assertEqual(496, result.elided_lines)
+        self.assertEqual(500, result.returncode.dropped_lines)
+        # Decoded lines are split like the undecoded output, after \n only
+        result = impl.execute_process_head_tail([python, '-c', (
+            'import sys\n'
+            'sys.stdout.buffer.write(b"a\\x0cb\\nc\\nd\\x85e\\n")')],
+            head=1, tail=1, encoding='latin-1')
+        self.assertEqual(['a\x0cb\n'], result.head)
+        self.assertEqual(['d\x85e\n'], result.tail)
+        self.assertEqual(1, result.elided_lines)
+        self.assertEqual(2, result.elided_bytes)
+        with self.assertRaises(TypeError):
+            impl.execute_process_head_tail(cmd, mode='chunks')
+
+    def test_execute_process_input(self):
+        cat = [python, '-c', (
+            'import shutil, sys\n'
+            'shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)')]
+        output = list(impl.execute_process(cat, input=b'one\ntwo'))
+        self.assertEqual([b'one\n', b'two', 0], output)
+        output = list(impl.execute_process(
+            cat, input=io.BytesIO(b'one\ntwo')))
+        self.assertEqual([b'one\n', b'two', 0], output)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_input_streaming(self):
+        # Much more input than fits in the pipes, so it has to be written
+        # while the output is read
+        cat = [python, '-c', (
+            'import shutil, sys\n'
+            'shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)')]
+
+        def chunks():
+            for _ in range(256):
+                yield b'x' * 32 * 1024
+
+        for emulate_tty in (False, True):
+            size = 0
+            for out, err, ret in impl.execute_process_split(
+                cat, emulate_tty=emulate_tty, mode='chunks', input=chunks()
+            ):
+                if ret is None:
+                    size += len(out or err)
+            self.assertEqual(0, ret)
+            self.assertEqual(256 * 32 * 1024, size)
+        # The subprocess does not read its input
+        output = list(impl.execute_process(
+            [python, '-c', 'pass'], input=chunks()))
+        self.assertEqual([0], output)
+
+    def test_execute_process_stdin(self):
+        cmd = [python, '-c', 'import sys; print(len(sys.stdin.read()))']
+        output = list(impl.execute_process(cmd, stdin=subprocess.DEVNULL))
+        self.assertEqual([b'0' + nl, 0], output)
+        outputs, retcodes = self._run_execute_processes(
+            [cmd, cmd], stdin=subprocess.DEVNULL)
+        self.assertEqual([b'0' + nl] * 2, outputs)
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(
+                cmd, input=b'', stdin=subprocess.DEVNULL)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_pipeline(self):
+        cmds = [
+            [python, '-c', 'print("b\\na\\nc")'],
+            [python, '-c', (
+                'import sys\n'
+                'sys.stdout.writelines(sorted(sys.stdin))\n'
+                'print("sorted", file=sys.stderr)')],
+            [python, '-c', (
+                'import sys\n'
+                'sys.stdout.write(sys.stdin.read().upper())\n'
+                'sys.exit(3)')],
+        ]
+        output = list(impl.execute_pipeline(cmds, stderr_to_stdout=False))
+        self.assertEqual(
+            b'A' + nl + b'B' + nl + b'C' + nl,
+            b''.join(out for out, _, _ in output if out is not None))
+        self.assertEqual(
+            b'sorted' + nl,
+            b''.join(err for _, err, _ in output if err is not None))
+        self.assertEqual(3, output[-1][2])
+        self.assertEqual([0, 0, 3], output[-1][2].returncodes)
+        # pipefail, the last failure is returned
+        cmds = [
+            [python, '-c', 'import sys; sys.exit(2)'],
+            [python, '-c', 'import sys; sys.stdin.read()'],
+        ]
+        for emulate_tty in (False, True):
+            ret = list(impl.execute_pipeline(
+                cmds, emulate_tty=emulate_tty))[-1][2]
+            self.assertEqual(2, ret)
+            self.assertEqual([2, 0], ret.returncodes)
+        output = list(impl.execute_pipeline(
+            [[python, '-c', 'import sys; print(sys.stdin.read()[::-1])']],
+            input=b'abc'))
+        self.assertEqual((b'cba' + nl, None, None), output[0])
+        with self.assertRaises(ValueError):
+            impl.execute_pipeline([])
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_pipeline_timeout(self):
+        sleep = [python, '-c', 'import time; time.sleep(30)']
+        for new_process_group in (False, True):
+            start = time.monotonic()
+            ret = list(impl.execute_pipeline(
+                [sleep, sleep], timeout=0.3,
+                new_process_group=new_process_group))[-1][2]
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual('timeout', ret.reason)
+            self.assertEqual([-15, -15], ret.returncodes)
+
+    def test_execute_process_encoding(self):
+        # The e with an acute accent is split across two writes
+        cmd = [python, '-c', (
+            'import sys, time\n'
+            'sys.stdout.buffer.write(b"caf\\xc3")\n'
+            'sys.stdout.flush()\n'
+            'time.sleep(0.1)\n'
+            'sys.stdout.buffer.write(b"\\xa9\\n\\xff")')]
+        for mode in ('lines', 'chunks'):
+            output = list(impl.execute_process(
+                cmd, mode=mode, encoding='utf-8', errors='replace'))
+            self.assertEqual(0, output[-1])
+            for item in output[:-1]:
+                self.assertIsInstance(item, str)
+            self.assertEqual('caf\xe9\n\ufffd', ''.join(output[:-1]))
+        with self.assertRaises(UnicodeDecodeError):
+            list(impl.execute_process(cmd, encoding='utf-8'))
+        with self.assertRaises(LookupError):
+            impl.execute_process_split(cmd, encoding='no-such-encoding')
+        outputs, retcodes = self._run_execute_processes(
+            [cmd], encoding='latin-1', coalesce_ms=500)
+        self.assertEqual(['caf\xc3\xa9\n\xff'], outputs)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_wait_for_output(self):
+        cmd = [python, '-c', (
+            'import sys, time\n'
+            'print("starting", flush=True)\n'
+            'time.sleep(0.2)\n'
+            'sys.stdout.write("listening on 1234")\n'
+            'sys.stdout.flush()\n'
+            'time.sleep(0.2)\n'
+            'print("\\nserving")')]
+        ready, output = impl.wait_for_output(
+            cmd, br'listening on (\d+)', timeout=10)
+        self.assertEqual(b'1234', ready.match.group(1))
+        self.assertGreaterEqual(ready.time_to_ready, 0.2)
+        output = list(output)
+        self.assertEqual(0, output[-1])
+        self.assertEqual(
+            [b'starting', b'listening on 1234', b'serving'],
+            b''.join(output[:-1]).splitlines())
+
+        start = time.monotonic()
+        with self.assertRaises(NotReadyError) as context:
+            impl.wait_for_output(
+                [python, '-c', 'import time; time.sleep(10)'], 'ready',
+                timeout=0.2)
+        self.assertEqual('timeout', context.exception.reason)
+        self.assertEqual('ready_timeout', context.exception.returncode.reason)
+        self.assertLess(time.monotonic() - start, 5)
+
+        with self.assertRaises(NotReadyError) as context:
+            impl.wait_for_output(
+                [python, '-c', 'print("failed"); exit(2)'], 'ready')
+        self.assertEqual('exited', context.exception.reason)
+        self.assertEqual(2, context.exception.returncode)
+
+        # Closing the output stops the subprocess
+        start = time.monotonic()
+        ready, output = impl.wait_for_output([python, '-c', (
+            'import time\n'
+            'print("ready", flush=True)\n'
+            'time.sleep(10)')], '^ready$')
+        output.close()
+        self.assertLess(time.monotonic() - start, 5)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_wait_for_output_drain(self):
+        # Much more output than fits in a pipe, after the command is ready,
+        # is read while the output is not iterated
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            done = os.path.join(tmp_dir, 'done')
+            ready, output = impl.wait_for_output([python, '-c', (
+                'import sys\n'
+                'sys.stdout.write("starting\\n")\n'
+                'sys.stdout.flush()\n'
+                'sys.stdin.readline()\n'
+                'sys.stdout.write("ready\\n")\n'
+                'sys.stdout.flush()\n'
+                'sys.stdout.write("x" * (1024 * 1024))\n'
+                'sys.stdout.flush()\n'
+                'open(sys.argv[1], "w").close()'), done],
+                '^ready', timeout=10, input=b'go\n', drain=True)
+            for _ in range(100):
+                if os.path.exists(done):
+                    break
+                time.sleep(0.05)
+            else:
+                self.fail('the output was not drained')
+            # The output up to the line which matched
+            output = list(output)
+            self.assertEqual(0, output[-1])
+            self.assertEqual(
+                b'starting' + nl + b'ready' + nl, b''.join(output[:-1]))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_wait_for_output_close(self):
+        # Closing the output, without iterating it, or garbage collecting
+        # it, stops and reaps the command
+        cmd = [python, '-c', (
+            'import os, time\n'
+            'print("ready", os.getpid(), flush=True)\n'
+            'time.sleep(30)')]
+        for drain in (False, True):
+            for close in (True, False):
+                start = time.monotonic()
+                ready, output = impl.wait_for_output(
+                    cmd, br'ready (\d+)\s', drain=drain, kill_timeout=0.5)
+                pid = int(ready.match.group(1))
+                if close:
+                    output.close()
+                else:
+                    del output
+                self.assertLess(time.monotonic() - start, 5)
+                with self.assertRaises(ProcessLookupError):
+                    os.kill(pid, 0)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_wait_for_output_options(self):
+        # The output options apply to the output, which is searched before
+        # it is filtered or decoded
+        ready, output = impl.wait_for_output([python, '-c', (
+            'print("debug: starting")\n'
+            'print("listening")\n'
+            'print("debug: serving")\n'
+            'print("done")')], 'starting', exclude='^debug',
+            encoding='utf-8')
+        self.assertEqual(b'starting', ready.match.group(0))
+        output = list(output)
+        self.assertEqual(
+            ['listening', 'done'], ''.join(output[:-1]).splitlines())
+        self.assertEqual(2, output[-1].dropped_lines)
+
+        with self.assertRaises(NotReadyError) as context:
+            impl.wait_for_output(
+                [python, '-c', 'import time; time.sleep(10)'], 'ready',
+                idle_timeout=0.2, kill_timeout=0)
+        self.assertEqual('timeout', context.exception.reason)
+        self.assertEqual('idle_timeout', context.exception.returncode.reason)
+        self.assertEqual(-9, context.exception.returncode)
+
+        with self.assertRaises(TypeError):
+            impl.wait_for_output(['true'], 'ready', reuse_buffer=True)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_wait_for_output_prompt(self):
+        # A prompt without a new line matches as soon as it is read
+        start = time.monotonic()
+        ready, output = impl.wait_for_output([python, '-c', (
+            'import sys, time\n'
+            'sys.stdout.write("password: ")\n'
+            'sys.stdout.flush()\n'
+            'time.sleep(30)')], b'password: $', timeout=10)
+        self.assertEqual(b'password: ', ready.match.group(0))
+        self.assertLess(ready.time_to_ready, 5)
+        output.close()
+        self.assertLess(time.monotonic() - start, 5)
+
+        # Output once the subprocess is being stopped doesn't make it ready
+        with self.assertRaises(NotReadyError) as context:
+            impl.wait_for_output([python, '-c', (
+                'import signal, sys, time\n'
+                'def stop(signum, frame):\n'
+                '    sys.stdout.write("ready")\n'
+                '    sys.exit(1)\n'
+                'signal.signal(signal.SIGTERM, stop)\n'
+                'time.sleep(30)')], 'ready', timeout=0.5)
+        self.assertEqual('timeout', context.exception.reason)
+        self.assertEqual('ready_timeout', context.exception.returncode.reason)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_timeout(self):
+        cmd = [python, '-c', 'import time; time.sleep(30)']
+        start = time.monotonic()
+        output = list(impl.execute_process(cmd, timeout=0.2))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([-15], output)
+        self.assertEqual('timeout', output[-1].reason)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_idle_timeout(self):
+        cmd = [python, '-u', '-c', (
+            'import time\n'
+            'for i in range(3):\n'
+            '    print(i)\n'
+            '    time.sleep(0.1)\n'
+            'time.sleep(30)')]
+        output = list(impl.execute_process(cmd, idle_timeout=0.5))
+        self.assertEqual(b'0' + nl + b'1' + nl + b'2' + nl,
+                         b''.join(output[:-1]))
+        self.assertEqual(-15, output[-1])
+        self.assertEqual('idle_timeout', output[-1].reason)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_timeout_kill(self):
+        # The subprocess ignores SIGTERM, so it has to be killed
+        cmd = [python, '-u', '-c', (
+            'import signal, time\n'
+            'signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+            'print("ready")\n'
+            'time.sleep(30)')]
+        output = list(impl.execute_process(
+            cmd, timeout=0.5, kill_timeout=0.2))
+        self.assertEqual(-9, output[-1])
+        self.assertEqual('timeout', output[-1].reason)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_timeout_process_group(self):
+        # The subprocess starts another which should be killed with it
+        cmd = [python, '-u', '-c', (
+            'import subprocess, sys, time\n'
+            'p = subprocess.Popen([sys.executable, "-c", '
+            '"import time; time.sleep(30)"], stdout=subprocess.DEVNULL)\n'
+            'print(p.pid)\n'
+            'time.sleep(30)')]
+        output = list(impl.execute_process(
+            cmd, timeout=0.5, new_process_group=True, emulate_tty=True))
+        self.assertEqual('timeout', output[-1].reason)
+        pid = int(output[0])
+        for _ in range(100):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                break
+            time.sleep(0.05)
+        else:
+            self.fail('process {0} is still running'.format(pid))
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_new_process_group(self):
+        # A single command and a pipeline both get a new process group, in
+        # the session of the caller
+        cmd = [python, '-c', (
+            'import os\n'
+            'print(os.getsid(0), os.getpgid(0), os.getpid())')]
+        cat = [python, '-c', (
+            'import sys; sys.stdout.write(sys.stdin.read())')]
+        for emulate_tty in (False, True):
+            for output in (
+                list(impl.execute_process(
+                    cmd, new_process_group=True, emulate_tty=emulate_tty)),
+                [out for out, _, ret in impl.execute_pipeline(
+                    [cmd, cat], new_process_group=True,
+                    emulate_tty=emulate_tty) if ret is None],
+            ):
+                sid, pgid, pid = map(int, output[0].split())
+                self.assertEqual(os.getsid(0), sid)
+                self.assertEqual(pid, pgid)
+                self.assertNotEqual(os.getpgid(0), pgid)
+
+    @unittest.skipIf(not hasattr(os, 'pidfd_open'), "pidfd not supported")
+    def test_execute_process_pidfd(self):
+        # The subprocess exits while another it started still has its stdout,
+        # so its exit is only noticed by waiting on its pidfd
+        cmd = [python, '-u', '-c', (
+            'import subprocess, sys\n'
+            'p = subprocess.Popen([sys.executable, "-c", '
+            '"import time; time.sleep(30)"])\n'
+            'print(p.pid)')]
+        start = time.monotonic()
+        output = list(impl.execute_process(cmd))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(0, output[-1])
+        os.kill(int(output[0]), 9)
+
+    def test_execute_process_close_early(self):
+        # A chatty subprocess which would never end on its own
+        cmd = [python, '-u', '-c', (
+            'import os, time\n'
+            'print(os.getpid())\n'
+            'while True:\n'
+            '    print("x" * 100)')]
+        for emulate_tty in (False, True):
+            start = time.monotonic()
+            output = impl.execute_process(cmd, emulate_tty=emulate_tty)
+            pid = int(next(output).splitlines()[0])
+            output.close()
+            self.assertLess(time.monotonic() - start, 5)
+            # The subprocess has been reaped, so it no longer exists
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_execute_process_split_not_started(self):
+        import gc
+        cmd = [python, '-c', 'import time; time.sleep(30)']
+        output = impl.execute_process_split(cmd, emulate_tty=True)
+        # The generator was never started, but the subprocess with its pty
+        # was, and it is stopped when the generator is garbage collected
+        p = output.gi_frame.f_locals['job'].p
+        del output
+        gc.collect()
+        self.assertEqual(-15, p.returncode)
+
+    def test_execute_process_invalid_options(self):
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(['ls'], mode='words')
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(['ls'], read_size=0)
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(
+                ['ls'], mode='chunks', max_line_bytes=10)
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(['ls'], overflow='drop')
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(['ls'], timeout=-1)
+        with self.assertRaises(ValueError):
+            impl.execute_process_split(
+                ['ls'], mode='chunks', include=b'error')
+        with self.assertRaises(TypeError):
+            impl.execute_process_split(['ls'], line_buffered=True)
+        with self.assertRaises(TypeError):
+            impl.execute_processes([['ls']], input=b'')
+        with self.assertRaises(ValueError):
+            impl.execute_pipeline([['ls']], input=b'', stdin=-3)
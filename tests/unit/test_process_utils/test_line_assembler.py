@@ -0,0 +1,162 @@
+import unittest
+
+from osrf_pycommon.process_utils.line_assembler import LineAssembler
+
+
+class TestProcessUtilsLineAssembler(unittest.TestCase):
+    def test_feed(self):
+        assembler = LineAssembler()
+        self.assertIsNone(assembler.feed(b''))
+        self.assertIsNone(assembler.feed(b'one'))
+        self.assertEqual(3, assembler.pending)
+        self.assertEqual(b'one two\n', assembler.feed(b' two\nthr'))
+        self.assertEqual(b'three\r\n', assembler.feed(b'ee\r\nfour\r'))
+        self.assertEqual(5, assembler.pending)
+        self.assertEqual(b'four\r\n', assembler.feed(b'\n'))
+        self.assertEqual(b'five\n', assembler.feed(b'five\nsix'))
+        self.assertEqual(b'six', assembler.flush())
+        self.assertEqual(b'', assembler.flush())
+
+    def test_feed_from(self):
+        assembler = LineAssembler()
+        buffer = bytearray(16)
+        buffer[:9] = b'one\ntwo\nt'
+        lines = assembler.feed_from(buffer, 9)
+        # Returned without a copy when there is nothing pending
+        self.assertIsInstance(lines, memoryview)
+        self.assertEqual(b'one\ntwo\n', lines)
+        buffer[:4] = b'hree'
+        self.assertIsNone(assembler.feed_from(buffer, 4))
+        buffer[:5] = b'\nfour'
+        self.assertEqual(b'three\n', assembler.feed_from(buffer, 5))
+        self.assertEqual(b'four', assembler.flush())
+
+    def test_max_line_bytes_split(self):
+        assembler = LineAssembler(max_line_bytes=4)
+        self.assertEqual(b'abcdefgh', assembler.feed(b'abcdefghij'))
+        self.assertEqual(2, assembler.pending)
+        self.assertEqual(b'ijkl\n', assembler.feed(b'kl\nmn'))
+        self.assertEqual(b'mn', assembler.flush())
+
+    def test_max_line_bytes_split_reads(self):
+        # Only the incomplete line kept between reads is split
+        assembler = LineAssembler(max_line_bytes=10)
+        self.assertEqual(b'x' * 25 + b'\n', assembler.feed(b'x' * 25 + b'\n'))
+        self.assertIsNone(assembler.feed(b'1234567891'))
+        self.assertEqual(b'1234567891', assembler.feed(b'2'))
+        self.assertEqual(b'2345\n', assembler.feed(b'345\nab'))
+        # A line of exactly max_line_bytes keeps its line ending
+        self.assertEqual(b'ab12345678\n', assembler.feed(b'12345678\n'))
+        # Lines only end in \n, \r or \r\n, also when truncated
+        assembler = LineAssembler(max_line_bytes=4, overflow='truncate')
+        self.assertEqual(
+            b'ab\x0cc [3 bytes truncated]\n', assembler.feed(b'ab\x0ccdef\n'))
+
+    def test_max_line_bytes_truncate(self):
+        assembler = LineAssembler(max_line_bytes=4, overflow='truncate')
+        self.assertEqual(b'ab\n', assembler.feed(b'ab\n'))
+        self.assertIsNone(assembler.feed(b'abcdefghij'))
+        self.assertEqual(4, assembler.pending)
+        self.assertEqual(
+            b'abcd [8 bytes truncated]\nmnop [3 bytes truncated]\r\nxy\n',
+            assembler.feed(b'kl\nmnopqrs\r\nxy\nabcdefg'))
+        self.assertEqual(b'abcd [3 bytes truncated]', assembler.flush())
+
+    def test_max_line_bytes_invalid(self):
+        with self.assertRaises(ValueError):
+            LineAssembler(max_line_bytes=0)
+        with self.assertRaises(ValueError):
+            LineAssembler(max_line_bytes=4, overflow='drop')
+
+    def test_split_crlf(self):
+        assembler = LineAssembler()
+        self.assertEqual(b'a\r', assembler.feed(b'a\rb\r'))
+        self.assertEqual(b'b\r\n', assembler.feed(b'\nc\r'))
+        self.assertEqual(b'c\rd\n', assembler.feed(b'd\n'))
+        self.assertIsNone(assembler.feed(b'\r'))
+        self.assertEqual(b'\r', assembler.flush())
+
+    def test_progress(self):
+        # Progress redrawn with \r, one update per read, is returned as the
+        # next update arrives
+        assembler = LineAssembler()
+        self.assertIsNone(assembler.feed(b'10%\r'))
+        self.assertEqual(b'10%\r', assembler.feed(b'20%\r'))
+        self.assertEqual(b'20%\r', assembler.feed(b'30%'))
+        self.assertIsNone(assembler.feed(b'\r'))
+        self.assertEqual(b'30%\r', assembler.feed(b'40'))
+        buffer = bytearray(b'%\rxx')
+        self.assertIsNone(assembler.feed_from(buffer, 2))
+        buffer[:5] = b'50%\r\n'
+        self.assertEqual(b'40%\r50%\r\n', assembler.feed_from(buffer, 5))
+        self.assertIsNone(assembler.feed(b'60%\r'))
+        self.assertEqual(b'60%\r', assembler.flush())
+        assembler = LineAssembler(max_line_bytes=2, overflow='truncate')
+        self.assertIsNone(assembler.feed(b'10%\r'))
+        self.assertEqual(
+            b'10 [1 bytes truncated]\r', assembler.feed(b'20%\r'))
+
+    def test_delimiter(self):
+        assembler = LineAssembler(delimiter=b'\0')
+        self.assertEqual(b'a\rb\n\0', assembler.feed(b'a\rb\n\0c\x0b'))
+        self.assertEqual(b'c\x0bd\0e\0', assembler.feed(b'd\0e\0'))
+        buffer = bytearray(b'f\0g\nxx')
+        self.assertEqual(b'f\0', assembler.feed_from(buffer, 4))
+        self.assertEqual(b'g\n', assembler.flush())
+        # Only \n ends a line, so \r and \x0b are kept within it
+        assembler = LineAssembler(delimiter=b'\n')
+        self.assertEqual(
+            b'a\rb\x0bc\r\n', assembler.feed(b'a\rb\x0bc\r\nd\r'))
+        self.assertEqual(b'd\r', assembler.flush())
+
+    def test_delimiter_multiple_bytes(self):
+        assembler = LineAssembler(delimiter=b'\r\n')
+        self.assertEqual(b'a\nb\r\n', assembler.feed(b'a\nb\r\nc\r'))
+        # The delimiter is split between reads
+        self.assertEqual(b'c\r\n', assembler.feed(b'\nd'))
+        self.assertEqual(b'd\re\r\n', assembler.feed(b'\re\r\n'))
+        self.assertEqual(b'', assembler.flush())
+        assembler = LineAssembler(delimiter=b'--')
+        self.assertIsNone(assembler.feed(b'a'))
+        self.assertIsNone(assembler.feed(b'-'))
+        self.assertEqual(b'a--', assembler.feed(b'-'))
+
+    def test_delimiter_max_line_bytes_truncate(self):
+        assembler = LineAssembler(
+            max_line_bytes=4, overflow='truncate', delimiter=b'\0')
+        self.assertEqual(
+            b'ab\rc\0abcd [4 bytes truncated]\0',
+            assembler.feed(b'ab\rc\0abcdefgh\0ij'))
+        self.assertEqual(b'ij', assembler.flush())
+
+    def test_delimiter_multiple_bytes_truncate(self):
+        assembler = LineAssembler(
+            max_line_bytes=3, overflow='truncate', delimiter=b'\r\n')
+        # A kept \r does not end the line with a later \n
+        self.assertIsNone(assembler.feed(b'ab\r'))
+        self.assertIsNone(assembler.feed(b'cdefg'))
+        self.assertIsNone(assembler.feed(b'\n'))
+        self.assertEqual(b'ab\r [6 bytes truncated]', assembler.flush())
+        # A delimiter split between reads after the line was truncated
+        self.assertIsNone(assembler.feed(b'abcde\r'))
+        self.assertEqual(
+            b'abc [2 bytes truncated]\r\n', assembler.feed(b'\nxy'))
+        self.assertEqual(b'xy', assembler.flush())
+
+    def test_delimiter_invalid(self):
+        for delimiter in (b'', '\0', 0):
+            with self.assertRaises(ValueError):
+                LineAssembler(delimiter=delimiter)
+
+    def test_long_line(self):
+        # A single 16 MiB line delivered in 1024 byte reads, which took
+        # quadratic time when the left over data was rescanned for each read
+        chunk = b'x' * 1024
+        reads = 16 * 1024
+        assembler = LineAssembler()
+        for _ in range(reads):
+            self.assertIsNone(assembler.feed(chunk))
+        self.assertEqual(len(chunk) * reads, assembler.pending)
+        line = assembler.feed(b'\n')
+        self.assertEqual(len(chunk) * reads + 1, len(line))
+        self.assertEqual(0, assembler.pending)
@@ -0,0 +1,90 @@
+import re
+import time
+import unittest
+
+from osrf_pycommon.process_utils.line_filter import LineFilter
+
+
+class TestProcessUtilsLineFilter(unittest.TestCase):
+    def test_line_filter_exclude(self):
+        line_filter = LineFilter(exclude=[br'^\[ *\d+%\]', '^-- '])
+        self.assertEqual(
+            b'keep 1\r\nkeep 2\nlast',
+            line_filter.filter(
+                b'-- config\nkeep 1\r\nkeep 2\n[ 10%] build\nlast'))
+        self.assertEqual(3, line_filter.matched_lines)
+        self.assertEqual(2, line_filter.dropped_lines)
+        self.assertIsNone(line_filter.filter(b'[100%] done\n'))
+        self.assertEqual(3, line_filter.dropped_lines)
+
+    def test_line_filter_include(self):
+        line_filter = LineFilter(include=b'error', exclude='ignored')
+        self.assertEqual(
+            b'error 1\rerror 2\n',
+            line_filter.filter(b'error 1\rok\rerror ignored\n\nerror 2\n'))
+        self.assertEqual(2, line_filter.matched_lines)
+        self.assertEqual(3, line_filter.dropped_lines)
+
+    def test_line_filter_line_endings(self):
+        # ^ and $ match at the start and end of each line, whatever its line
+        # ending is, e.g. the \r\n of a pty
+        line_filter = LineFilter(include=br'^error$')
+        self.assertEqual(
+            b'error\r\nerror\rerror\nerror',
+            line_filter.filter(
+                b'error\r\nno error\r\nerror\rerrors\rerror\nerror'))
+        self.assertEqual(4, line_filter.matched_lines)
+        self.assertEqual(2, line_filter.dropped_lines)
+        line_filter = LineFilter(exclude=[br'\d$', br'^\s*$'])
+        self.assertEqual(
+            b'b\r\n', line_filter.filter(b'a 1\r\n\r\nb\r\n \r2\r'))
+        self.assertEqual(1, line_filter.matched_lines)
+        self.assertEqual(4, line_filter.dropped_lines)
+
+    def test_line_filter_special_characters(self):
+        # Only ^, $ and . outside of escapes and classes refer to lines
+        line_filter = LineFilter(include=[br'^a.c$', br'x|^y', br'[$^.]\$'])
+        self.assertEqual(
+            b'abc\r\nx 1\ry\n.$\r\n',
+            line_filter.filter(
+                b'abc\r\na\rc\nabcd\r\nx 1\ry\nz y\n.$\r\n$\r\n'))
+        self.assertEqual(4, line_filter.matched_lines)
+        self.assertEqual(5, line_filter.dropped_lines)
+
+    def test_line_filter_throughput(self):
+        # Dropped lines are skipped by a single regular expression, so this
+        # is not slower than filtering the lines one by one, as it was when
+        # each line was searched for separately
+        data = b''.join(
+            b'warning: %d\n' % i if i % 20 == 0 else
+            b'[ %2d%%] Building CXX object src/file%d.cpp.o\n' % (i % 100, i)
+            for i in range(200000))
+        pattern = re.compile(br'^\[ *\d+%\]')
+        line_filter = LineFilter(exclude=pattern.pattern)
+
+        def best_of(function):
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                result = function()
+                times.append(time.perf_counter() - start)
+            return result, min(times)
+
+        filtered, filter_time = best_of(lambda: line_filter.filter(data))
+        expected, one_by_one_time = best_of(lambda: b''.join(
+            line for line in data.splitlines(True)
+            if not pattern.search(line)))
+        self.assertEqual(expected, filtered)
+        self.assertLess(filter_time, one_by_one_time * 2)
+
+    def test_line_filter_keep_all(self):
+        line_filter = LineFilter(exclude=b'nothing')
+        data = bytearray(b'a\n\nb\r\n')
+        view = memoryview(data)
+        self.assertIs(view, line_filter.filter(view))
+        self.assertEqual(3, line_filter.matched_lines)
+        self.assertEqual(0, line_filter.dropped_lines)
+
+    def test_line_filter_invalid(self):
+        with self.assertRaises(re.error):
+            LineFilter(include=b'(')
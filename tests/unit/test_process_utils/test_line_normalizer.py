@@ -0,0 +1,36 @@
+import unittest
+
+from osrf_pycommon.process_utils.line_normalizer import LineNormalizer
+
+
+class TestProcessUtilsLineNormalizer(unittest.TestCase):
+    def test_line_normalizer(self):
+        normalizer = LineNormalizer()
+        self.assertEqual(b'start\n', normalizer.feed(b'start\n10%\r20%\r'))
+        self.assertIsNone(normalizer.feed(b'30%\r'))
+        self.assertEqual(b'30%\r\nx\n', normalizer.feed(b'\r\nx\nx\nx\n'))
+        self.assertEqual(
+            b'[last line repeated 2 times]\ny\n', normalizer.feed(b'y\n'))
+        self.assertIsNone(normalizer.feed(b'y\n'))
+        self.assertEqual(
+            b'[last line repeated 1 time]\n', normalizer.flush())
+        self.assertIsNone(normalizer.flush())
+
+    def test_line_normalizer_collapse_cr(self):
+        normalizer = LineNormalizer(fold_repeats=False)
+        data = b'a\r\na\r\n'
+        self.assertIs(data, normalizer.feed(data))
+        # The run is ended by the next line, which is kept as is
+        self.assertEqual(
+            b'done\n', normalizer.feed(b'1\r2\rdone\n'))
+        self.assertIsNone(normalizer.feed(b'3\r\r'))
+        self.assertEqual(b'3\r', normalizer.flush())
+
+    def test_line_normalizer_fold_repeats(self):
+        normalizer = LineNormalizer(collapse_cr=False)
+        self.assertEqual(
+            b'1\r[last line repeated 1 time]\r1\n'
+            b'[last line repeated 1 time]\n\r\n',
+            normalizer.feed(b'1\r1\r1\n1\n\r\n\r\n\r\n'))
+        self.assertEqual(
+            b'[last line repeated 2 times]\r\n1\r', normalizer.feed(b'1\r'))
@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+
+from osrf_pycommon.process_utils import pty_manager
+from osrf_pycommon.process_utils.pty_manager import PtyManager
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+class TestProcessUtilsPtyManager(unittest.TestCase):
+    def test_open_and_release(self):
+        manager = PtyManager()
+        lease = manager.open_ptys(2)
+        self.assertEqual(2, len(lease.pairs))
+        self.assertEqual(2, manager.in_use)
+        for master, slave in lease.pairs:
+            self.assertTrue(os.isatty(slave))
+            os.close(master)
+            os.close(slave)
+        lease.release()
+        lease.release()
+        self.assertEqual(0, manager.in_use)
+        self.assertEqual(2, manager.peak)
+        self.assertEqual(2, manager.opened)
+        self.assertEqual(0, manager.fallbacks)
+
+    def test_max_ptys(self):
+        manager = PtyManager(max_ptys=2)
+        lease = manager.open_ptys(1)
+        self.assertIsNone(manager.open_ptys(2))
+        self.assertEqual(1, manager.fallbacks)
+        self.assertEqual(0, manager.errors)
+        self.assertEqual(1, manager.in_use)
+        other = manager.open_ptys(1)
+        self.assertIsNone(manager.open_ptys(1))
+        self.assertEqual(2, manager.fallbacks)
+        for opened in (lease, other):
+            for master, slave in opened.pairs:
+                os.close(master)
+                os.close(slave)
+            opened.release()
+        self.assertEqual(0, manager.in_use)
+        self.assertEqual(2, manager.peak)
+        with self.assertRaises(ValueError):
+            PtyManager(max_ptys=0)
+
+    def test_open_error(self):
+        manager = PtyManager()
+        openpty = pty_manager.pty.openpty
+        opened = []
+
+        def failing_openpty():
+            # The second pty can't be opened
+            if opened:
+                raise OSError('out of pty devices')
+            opened.append(openpty())
+            return opened[-1]
+
+        pty_manager.pty.openpty = failing_openpty
+        try:
+            self.assertIsNone(manager.open_ptys(2))
+        finally:
+            pty_manager.pty.openpty = openpty
+        # The pty which was opened is closed again
+        for fd in opened[0]:
+            with self.assertRaises(OSError):
+                os.fstat(fd)
+        self.assertEqual(0, manager.in_use)
+        self.assertEqual(0, manager.opened)
+        self.assertEqual(1, manager.fallbacks)
+        self.assertEqual(1, manager.errors)
+        self.assertEqual('out of pty devices', str(manager.last_error))
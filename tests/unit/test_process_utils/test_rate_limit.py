@@ -0,0 +1,73 @@
+import unittest
+
+from osrf_pycommon.process_utils.rate_limit import RateLimiter
+
+lines = b''.join(b'line %d\n' % i for i in range(20))
+
+
+class TestProcessUtilsRateLimit(unittest.TestCase):
+    def test_rate_limit_drop(self):
+        rate_limit = RateLimiter(lines_per_second=5, tail=2)
+        self.assertEqual(
+            b'line 0\nline 1\nline 2\nline 3\nline 4\n',
+            rate_limit.limit(lines, now=0))
+        # Not enough time for a new line has passed
+        self.assertIsNone(rate_limit.limit(b'error\n', now=0.1))
+        # The output slowed down, so the suppressed lines are summarized
+        self.assertEqual(
+            b'[14 lines suppressed]\nline 19\nerror\nlast\n',
+            rate_limit.limit(b'last\n', now=2))
+        self.assertEqual(16, rate_limit.suppressed_lines)
+        self.assertEqual(16 + 15 * 7, rate_limit.suppressed_bytes)
+        self.assertIsNone(rate_limit.flush())
+
+    def test_rate_limit_sample(self):
+        rate_limit = RateLimiter(lines_per_second=5, policy='sample', tail=1)
+        self.assertEqual(
+            b'line 0\nline 4\nline 8\nline 12\nline 16\n',
+            rate_limit.limit(lines, now=0))
+        self.assertEqual(
+            b'[14 lines suppressed]\nline 19\n', rate_limit.flush())
+        self.assertIsNone(rate_limit.flush())
+
+    def test_rate_limit_order(self):
+        # The tail only has the lines suppressed after the last kept line,
+        # so all of the lines stay in order
+        rate_limit = RateLimiter(lines_per_second=5, policy='sample', tail=10)
+        output = rate_limit.limit(lines, now=0) + rate_limit.flush()
+        self.assertEqual(
+            b'line 0\nline 4\nline 8\nline 12\nline 16\n'
+            b'[12 lines suppressed]\nline 17\nline 18\nline 19\n', output)
+        # Also when lines are kept again, after a refill, from a later batch
+        rate_limit = RateLimiter(lines_per_second=5, tail=2)
+        output = rate_limit.limit(lines, now=0)
+        output += rate_limit.limit(b'a\nb\nc\n', now=0.2)
+        output += rate_limit.limit(b'd\ne\n', now=0.4)
+        output += rate_limit.flush()
+        self.assertEqual(
+            b'line 0\nline 1\nline 2\nline 3\nline 4\na\nd\n'
+            b'[17 lines suppressed]\ne\n', output)
+        numbers = [
+            int(line.split()[1]) for line in output.splitlines()
+            if line.startswith(b'line ')]
+        self.assertEqual(sorted(numbers), numbers)
+
+    def test_rate_limit_bytes(self):
+        rate_limit = RateLimiter(bytes_per_second=20, tail=0)
+        self.assertEqual(b'line 0\nline 1\n', rate_limit.limit(lines, now=0))
+        # Streams are summarized separately, but share the limit
+        self.assertEqual(b'a\n', rate_limit.limit(b'a\n', 'other', now=0.1))
+        self.assertIsNone(rate_limit.flush('other'))
+        self.assertIsNone(
+            rate_limit.limit(lines.replace(b'\n', b'\r\n'), now=0.1))
+        self.assertEqual(b'[38 lines suppressed]\r\n', rate_limit.flush())
+
+    def test_rate_limit_invalid(self):
+        with self.assertRaises(ValueError):
+            RateLimiter()
+        with self.assertRaises(ValueError):
+            RateLimiter(lines_per_second=0)
+        with self.assertRaises(ValueError):
+            RateLimiter(lines_per_second=1, policy='newest')
+        with self.assertRaises(ValueError):
+            RateLimiter(lines_per_second=1, tail=-1)
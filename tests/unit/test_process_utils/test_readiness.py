@@ -0,0 +1,37 @@
+import time
+import unittest
+
+from osrf_pycommon.process_utils import readiness
+from osrf_pycommon.process_utils.readiness import _ReadinessWatch
+
+
+class TestProcessUtilsReadiness(unittest.TestCase):
+    def test_readiness_spans_reads(self):
+        watch = _ReadinessWatch(br'^listening on (\d+) ')
+        self.assertIsNone(watch.search(1, b'starting\nlisten'))
+        self.assertIsNone(watch.search(2, b'listening on 1'))
+        self.assertIsNone(watch.search(1, b'ing on 12'))
+        match = watch.search(1, b'34 ...\r\n')
+        self.assertEqual(b'1234', match.group(1))
+        self.assertIs(match, watch.ready().match)
+
+    def test_readiness_long_line(self):
+        # The incomplete line is not searched over and over as it grows
+        watch = _ReadinessWatch(b'ready')
+        chunk = b'.' * 1024
+        start = time.monotonic()
+        for _ in range(4 * 1024):
+            self.assertIsNone(watch.search(1, chunk))
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(
+            readiness._max_pending + 1, len(watch._pending[1][0]))
+        self.assertIsNone(watch.search(1, b'rea'))
+        self.assertIsNotNone(watch.search(1, b'dy'))
+
+    def test_readiness_long_line_start(self):
+        # ^ does not match where the kept end of a long line starts
+        watch = _ReadinessWatch(b'^ready')
+        watch.search(1, b'x' * (readiness._max_pending + 10))
+        self.assertIsNone(watch.search(1, b'ready'))
+        self.assertIsNone(watch.search(1, b'\nreadz'))
+        self.assertIsNotNone(watch.search(1, b'\nready'))
@@ -0,0 +1,72 @@
+import subprocess
+import sys
+import time
+import unittest
+
+from osrf_pycommon.process_utils import resource_sampler
+from osrf_pycommon.process_utils.resource_sampler import _descendants
+from osrf_pycommon.process_utils.resource_sampler import \
+    _descendants_by_parent
+from osrf_pycommon.process_utils.resource_sampler import _ResourceSampler
+
+python = sys.executable
+
+# A process which uses memory and CPU, and starts a child which sleeps
+tree_script = (
+    'import subprocess, sys, time\n'
+    'child = subprocess.Popen([sys.executable, "-c", '
+    '"import time; time.sleep(60)"])\n'
+    'data = bytearray(64 * 1024 * 1024)\n'
+    'print("ready", flush=True)\n'
+    'end = time.time() + 60\n'
+    'while time.time() < end:\n'
+    '    pass\n')
+
+
+@unittest.skipIf(not sys.platform.startswith('linux'), "Linux only")
+class TestProcessUtilsResourceSampler(unittest.TestCase):
+    def setUp(self):
+        self.p = subprocess.Popen(
+            [python, '-c', tree_script], stdout=subprocess.PIPE)
+        self.assertEqual(b'ready\n', self.p.stdout.readline())
+
+    def tearDown(self):
+        for pid in _descendants([self.p.pid])[1:]:
+            subprocess.call(['kill', '-9', str(pid)])
+        self.p.kill()
+        self.p.wait()
+        self.p.stdout.close()
+
+    def test_descendants(self):
+        descendants = _descendants([self.p.pid])
+        self.assertEqual(2, len(descendants))
+        self.assertEqual(self.p.pid, descendants[0])
+        self.assertEqual(
+            descendants, _descendants_by_parent([self.p.pid]))
+
+    def test_sample(self):
+        sampler = _ResourceSampler([self.p.pid], interval=0.2)
+        self.assertIsNone(sampler.due(sampler.start))
+        time.sleep(0.3)
+        sample = sampler.due(time.monotonic())
+        self.assertEqual(self.p.pid, sample.pid)
+        self.assertEqual(2, sample.processes)
+        self.assertGreater(sample.rss, 64 * 1024 * 1024)
+        self.assertGreater(sample.cpu_percent, 10)
+        self.assertGreater(sample.user_time + sample.system_time, 0)
+        self.assertGreater(sampler.deadline, sample.elapsed + sampler.start)
+
+    def test_sample_exited(self):
+        sampler = _ResourceSampler([self.p.pid])
+        self.tearDown()
+        self.assertIsNone(sampler.sample())
+        self.setUp()
+
+    def test_sample_without_children_files(self):
+        children = resource_sampler._children
+        resource_sampler._children = lambda pid: None
+        try:
+            sample = _ResourceSampler([self.p.pid]).sample()
+        finally:
+            resource_sampler._children = children
+        self.assertEqual(2, sample.processes)
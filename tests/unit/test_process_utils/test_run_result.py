@@ -0,0 +1,69 @@
+import signal
+import subprocess
+import sys
+import time
+import unittest
+
+from osrf_pycommon.process_utils.run_result import _RunStats
+
+python = sys.executable
+
+
+class TestProcessUtilsRunResult(unittest.TestCase):
+    def test_count(self):
+        stats = _RunStats()
+        stats.count(1, b'one\ntwo\nthr')
+        stats.count(2, b'err\n')
+        stats.count(1, bytearray(b'ee\nxxxx'), 3)
+        stats.count(1, b'')
+        result = stats.result(0)
+        self.assertEqual((0, None, False), result[:3])
+        self.assertEqual((14, 3, 4, 1), result[7:])
+        stats.count(1, b'four')
+        self.assertEqual((18, 4), stats.result(0)[7:9])
+
+    def wait(self, stats, p):
+        while stats.reap(p) is None:
+            time.sleep(0.01)
+        return p.returncode
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_reap(self):
+        stats = _RunStats()
+        p = subprocess.Popen([python, '-c', (
+            'import time\n'
+            'data = bytearray(64 * 1024 * 1024)\n'
+            'end = time.process_time() + 0.2\n'
+            'while time.process_time() < end:\n'
+            '    pass')])
+        self.assertEqual(0, self.wait(stats, p))
+        # Already reaped, so subprocess doesn't wait for it again
+        self.assertEqual(0, p.poll())
+        result = stats.result(p.returncode, [p])
+        self.assertEqual((0, None, False), result[:3])
+        self.assertGreaterEqual(result.user_time + result.system_time, 0.2)
+        self.assertGreaterEqual(result.wall_time, 0.2)
+        self.assertGreater(result.max_rss, 64 * 1024 * 1024)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Windows not supported")
+    def test_reap_signal(self):
+        stats = _RunStats()
+        p = subprocess.Popen([python, '-c', 'import time; time.sleep(60)'])
+        p.send_signal(signal.SIGTERM)
+        self.assertEqual(-signal.SIGTERM, self.wait(stats, p))
+        q = subprocess.Popen([python, '-c', 'pass'])
+        self.assertEqual(0, self.wait(stats, q))
+        # The signal is that of the last process which failed
+        result = stats.result(-signal.SIGTERM, [p, q])
+        self.assertEqual(
+            (-signal.SIGTERM, signal.SIGTERM, False), result[:3])
+        self.assertIsNotNone(result.user_time)
+
+    def test_reaped_elsewhere(self):
+        stats = _RunStats()
+        p = subprocess.Popen([python, '-c', 'import sys; sys.exit(3)'])
+        p.wait()
+        self.assertEqual(3, stats.reap(p))
+        result = stats.result(p.returncode, [p])
+        self.assertEqual((3, None, False), result[:3])
+        self.assertEqual((None, None, None), result[4:7])